@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: AGPL-3.0-only
+from __future__ import print_function
+from contextlib import closing
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kopano_backup'))
+import compression
+import storage
+
+"""
+compares compression levels and preset dictionary modes (see 'compression_level' and 'compression_dict'
+in backup.cfg), using the items of an existing backup directory.
+
+the items are first decompressed (whatever they were compressed with), after which they are compressed
+and decompressed again for each setting. dictionaries are trained (in a temporary directory) on the first
+items of each folder or of the whole store, as during backup. reported are the compression ratio, and the
+compression and decompression speed in MiB (of uncompressed data) per second.
+
+example:
+
+python3 compression_benchmark.py backups/henk --samples 100
+
+"""
+
+def folder_items(data_path, limit):
+    """ uncompressed items per folder directory """
+
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(data_path):
+        dirnames.sort()
+        if 'zdicts' in dirnames:
+            dirnames.remove('zdicts')
+        if storage.engine(dirpath+'/items') and storage.engine(dirpath+'/index'):
+            dicts = compression.Dictionaries([dirpath, data_path])
+            with closing(storage.dbopen(dirpath+'/items')) as db:
+                items = []
+                for key, value in db.iteritems():
+                    items.append(compression.decompress(value, dicts))
+                    if limit and len(items) >= limit:
+                        break
+            if items:
+                result[dirpath] = items
+    return result
+
+def run(folders, level, mode, options):
+    tmp_dir = tempfile.mkdtemp(prefix='kopano-backup-bench-')
+    try:
+        raw = packed = 0
+        t_compress = t_decompress = 0.0
+        store_compressor = None
+        for n, (path, items) in enumerate(sorted(folders.items())):
+            folder_path = os.path.join(tmp_dir, str(n))
+            if store_compressor is None or mode != 'store': # one dictionary for all folders with 'store'
+                store_compressor = compression.Compressor(level, mode, folder_path, tmp_dir, options.dict_size, options.samples)
+            compressor = store_compressor
+            t0 = time.time()
+            if compressor.needs_training():
+                compressor.train(items[:options.samples])
+            records = [compressor.compress(item) for item in items]
+            t_compress += time.time() - t0
+
+            dicts = compression.Dictionaries([folder_path, tmp_dir])
+            t0 = time.time()
+            for record in records:
+                compression.decompress(record, dicts)
+            t_decompress += time.time() - t0
+
+            raw += sum(len(item) for item in items)
+            packed += sum(len(record) for record in records)
+        return raw, packed, t_compress, t_decompress
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] BACKUP_DIR')
+    parser.add_option('--levels', default='1,6,9', help='zlib compression levels to compare')
+    parser.add_option('--samples', type='int', default=100, help='number of items to train dictionaries on')
+    parser.add_option('--dict-size', type='int', default=compression.ZDICT_MAX_SIZE, help='maximum dictionary size')
+    parser.add_option('--limit', type='int', default=0, help='maximum number of items per folder (0 for all)')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('please specify a backup directory')
+
+    folders = folder_items(args[0], options.limit)
+    count = sum(len(items) for items in folders.values())
+    size = sum(len(item) for items in folders.values() for item in items)
+    print('%d folders, %d items, %.1f MiB uncompressed' % (len(folders), count, size / 2.0**20))
+    if not count:
+        return
+
+    for level in [int(l) for l in options.levels.split(',')]:
+        for mode in compression.MODES:
+            raw, packed, t_compress, t_decompress = run(folders, level, mode, options)
+            print('level %d, dict %-6s: ratio %.2f, compress %.1f MiB/sec, decompress %.1f MiB/sec' % (
+                level, mode, raw / float(packed or 1), raw / 2.0**20 / (t_compress or 1e-6), raw / 2.0**20 / (t_decompress or 1e-6)))
+
+if __name__ == '__main__':
+    main()
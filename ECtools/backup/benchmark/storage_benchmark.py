@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: AGPL-3.0-only
+from __future__ import print_function
+from contextlib import closing
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kopano_backup'))
+import storage
+
+"""
+compares the 'bsddb' and 'segment' storage engines for the per-folder 'items' database,
+using synthetic (compressed) items of varying size.
+
+measured are: incremental backup (batches of writes, reopening the database per batch as
+FolderImporter.commit does), random reads (as restore with --sourcekey), full scans (as
+restore), deleting part of the items followed by compaction (as --purge), and size on disk.
+
+"""
+
+def records(count, size, rand):
+    for i in range(count):
+        key = ('%044X' % rand.getrandbits(176)).encode('ascii')
+        data = os.urandom(rand.randint(size // 4, size)) + b'\0' * size # compresses somewhat
+        yield key, zlib.compress(data)
+
+def timed(func, *args):
+    t0 = time.time()
+    result = func(*args)
+    return time.time() - t0, result
+
+def write(path, recs, batch):
+    for i in range(0, len(recs), batch):
+        with closing(storage.dbopen(path)) as db:
+            for key, value in recs[i:i+batch]:
+                db[key] = value
+
+def read(path, keys):
+    with closing(storage.dbopen(path)) as db:
+        for key in keys:
+            db[key]
+
+def scan(path):
+    with closing(storage.dbopen(path)) as db:
+        return sum(len(value) for key, value in db.iteritems())
+
+def delete(path, keys):
+    with closing(storage.dbopen(path)) as db:
+        for key in keys:
+            del db[key]
+    return storage.compact(path)
+
+def run(engine, recs, options, rand):
+    tmp_dir = tempfile.mkdtemp(prefix='kopano-backup-bench-')
+    path = os.path.join(tmp_dir, 'items')
+    try:
+        storage.DEFAULT_ENGINE = engine
+        results = {}
+        results['write'], _ = timed(write, path, recs, options.batch)
+        results['size'] = storage.size(path)
+        keys = [key for key, _ in recs]
+        results['read'], _ = timed(read, path, rand.sample(keys, min(options.reads, len(keys))))
+        results['scan'], _ = timed(scan, path)
+        deleted = rand.sample(keys, int(len(keys) * options.delete))
+        results['delete'], results['reclaimed'] = timed(delete, path, deleted)
+        results['compacted size'] = storage.size(path)
+        return results
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--items', type='int', default=20000, help='number of items')
+    parser.add_option('--size', type='int', default=20000, help='maximum (uncompressed) item size')
+    parser.add_option('--batch', type='int', default=100, help='number of items written per commit')
+    parser.add_option('--reads', type='int', default=5000, help='number of random reads')
+    parser.add_option('--delete', type='float', default=0.3, help='fraction of items to delete before compaction')
+    parser.add_option('--seed', type='int', default=0, help='random seed')
+    options, args = parser.parse_args()
+
+    rand = random.Random(options.seed)
+    recs = list(records(options.items, options.size, rand))
+    payload = sum(len(value) for _, value in recs)
+    print('%d items, %.1f MiB compressed payload' % (len(recs), payload / 2.0**20))
+
+    for engine in storage.ENGINES:
+        results = run(engine, recs, options, random.Random(options.seed))
+        print('%s:' % engine)
+        print('  write (%d per commit): %.2f s (%.0f items/sec)' % (options.batch, results['write'], len(recs) / (results['write'] or 1e-6)))
+        print('  random read: %.2f s (%.0f items/sec)' % (results['read'], options.reads / (results['read'] or 1e-6)))
+        print('  scan: %.2f s (%.1f MiB/sec)' % (results['scan'], payload / 2.0**20 / (results['scan'] or 1e-6)))
+        print('  delete %d%% + compact: %.2f s' % (100 * options.delete, results['delete']))
+        print('  size on disk: %.1f MiB (%.0f%% of payload), after delete: %.1f MiB' % (
+            results['size'] / 2.0**20, 100.0 * results['size'] / payload, results['compacted size'] / 2.0**20))
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,17 @@
 #!/usr/bin/python3
 # SPDX-License-Identifier: AGPL-3.0-only
 from .version import __version__
+from . import storage
+from . import compression
 
 import codecs
+import collections
 from contextlib import closing
 import csv
 import datetime
 import fcntl
+import hashlib
+import json
 from multiprocessing import Queue
 import os.path
 import re
@@ -18,10 +23,9 @@ try:
     import cPickle as pickle
 except ImportError:
     import _pickle as pickle
-import bsddb3 as bsddb
 
 from MAPI import (
-    PT_UNICODE, PT_ERROR, KEEP_OPEN_READWRITE,
+    PT_UNICODE, PT_ERROR, KEEP_OPEN_READWRITE, MAPI_DEFERRED_ERRORS, RELOP_EQ,
 )
 
 from MAPI.Defs import (
@@ -29,7 +33,7 @@ from MAPI.Defs import (
 )
 
 from MAPI.Struct import (
-    MAPIErrorNotFound, SPropValue,
+    MAPIErrorNotFound, SPropValue, SOrRestriction, SPropertyRestriction,
 )
 
 from MAPI.Tags import (
@@ -57,15 +61,28 @@ from kopano import log_exc, Config
 """
 kopano-backup - a MAPI-level backup/restore tool built on python-kopano.
 
-backup is done incrementally using ICS and can be parallellized over stores.
+backup is done incrementally using ICS and can be parallellized over stores. large stores ('store_split_size'
+in backup.cfg) are split into per-folder jobs, so their folders can be backed up in parallel as well. in this case,
+the main process writes the store-level data (store/user metadata, timestamp) and holds the lock on the store
+directory until all folders are done.
 
-restore is not parallelized.
+restore can be parallelized over folders: folders are first created in hierarchy order, after which
+their items are restored by worker processes (each with its own session). metadata is restored at the end.
 
-items are serialized and maintained in per-folder key-value stores.
+items are serialized and maintained in per-folder key-value stores. these use Berkeley DB hash files, or
+('storage_engine' in backup.cfg) append-only segment files with a sorted index (see storage.py). existing
+backups can be converted using --convert-storage, and --purge compacts segment files.
+
+optionally ('attachment_dedup_size' in backup.cfg), attachment data above a certain size is stored only once, in a
+content-addressed 'blob store' ('.blobs', next to the backup directories). the serialized items then contain
+references, which are listed in the index entries so they can be reference-counted (see BlobStore).
 
 metadata such as webapp settings, rules, acls and delegation permissions are also stored per-folder.
 
-differential backups are possible via the --differential option.
+differential backups are possible via the --differential option. these are merged (--merge) per folder: the
+index records of all differentials are combined first, after which each folder is updated in a single pass
+(so only changed index records and the latest version of each item are written). folders can be merged in
+parallel, and --dry-run estimates the cost.
 
 basic commands (see --help for all options):
 
@@ -77,6 +94,7 @@ kopano-backup --restore -u user2 user1 -> same, but restore to account 'user2'
 
 kopano-backup --stats user1 -> summarize contents of backup directory 'user1', in CSV format
 kopano-backup --index user1 -> low-level overview of stored items, in CSV format
+kopano-backup --convert-storage segment user1 -> convert backup directory 'user1' to segment files
 
 options can be combined when this makes sense, for example:
 
@@ -86,9 +104,21 @@ kopano-backup --index user1 -f Inbox/subfolder --recursive --period-begin 2014-0
 
 CONFIG = {
     'backup_servers': Config.string(multiple=True, default=None),
+    'store_split_size': Config.size(default=10*2**30),
+    'attachment_dedup_size': Config.size(default=0),
+    'storage_engine': Config.string(options=list(storage.ENGINES), default=storage.DEFAULT_ENGINE),
+    'compression_level': Config.integer(options=list(range(10)), default=6),
+    'compression_dict': Config.string(options=list(compression.MODES), default='none'),
+    'compression_dict_size': Config.size(default=compression.ZDICT_MAX_SIZE),
+    'compression_dict_samples': Config.integer(default=100),
+    'report_file': Config.string(default='backup-report.json'),
+    'prometheus_file': Config.string(default=None),
 }
 
 CACHE_SIZE = 64000000 # XXX make configurable
+DELETE_SIZE = 128 # approximate cache size of a pending delete (sourcekey, index record)
+TABLE_BATCH = 1000 # number of rows to query at a time
+RESTORE_CHUNK = 1000 # number of items between restore progress reports
 
 def pickle_dumps(s):
     return pickle.dumps(s, protocol=2)
@@ -107,26 +137,555 @@ def fatal(s):
     sys.exit(1)
 
 def dbopen(path):
-    return bsddb.hashopen(path, 'c')
+    return storage.dbopen(path)
+
+PHASES = ('fetch', 'serialize', 'dedup', 'compress', 'write', 'meta')
+
+class Phases:
+    """ per-phase counters (seconds, count, bytes), to see whether the server ('fetch': ICS, excluding time spent
+        in the importer), the CPU ('serialize', 'dedup', 'compress', 'meta') or the disk ('write') is the bottleneck """
+
+    def __init__(self, data=None):
+        self.data = data or {} # phase -> [seconds, count, bytes]
+
+    def add(self, phase, seconds, nbytes=0, count=1):
+        counters = self.data.setdefault(phase, [0.0, 0, 0])
+        counters[0] += seconds
+        counters[1] += count
+        counters[2] += nbytes
+
+    def call(self, phase, func, *args, **kwargs):
+        """ call function, counting its duration and the size of its (bytes) result """
+
+        t0 = time.time()
+        result = func(*args, **kwargs)
+        self.add(phase, time.time()-t0, len(result) if isinstance(result, bytes) else 0)
+        return result
+
+    def update(self, other):
+        for phase, (seconds, count, nbytes) in other.data.items():
+            self.add(phase, seconds, nbytes, count)
+
+    def summary(self):
+        return ', '.join('%s %.2fs' % (phase, self.data[phase][0]) for phase in PHASES if phase in self.data)
+
+    def dump(self):
+        return dict((phase, {'seconds': seconds, 'count': count, 'bytes': nbytes})
+            for phase, (seconds, count, nbytes) in self.data.items())
+
+class RunReport:
+    """ statistics and phase counters of a backup run, per worker and per store """
+
+    def __init__(self, timestamp, worker_processes):
+        self.timestamp = timestamp
+        self.worker_processes = worker_processes
+        self.t0 = time.time()
+        self.workers = {} # name -> Phases
+        self.stores = {} # path -> {'stats': .., 'seconds': .., 'phases': Phases}
+        self.phases = Phases()
+        self.stats = {'changes': 0, 'deletes': 0, 'errors': 0}
+
+    def add(self, worker, path, stats, phases, seconds):
+        self.workers.setdefault(worker, Phases()).update(phases)
+        store = self.stores.setdefault(path, {'stats': dict.fromkeys(stats, 0), 'seconds': 0.0, 'phases': Phases()})
+        for key in stats:
+            store['stats'][key] = store['stats'].get(key, 0) + stats[key]
+            self.stats[key] = self.stats.get(key, 0) + stats[key]
+        store['seconds'] += seconds
+        store['phases'].update(phases)
+        self.phases.update(phases)
+
+    def dump(self):
+        return {
+            'timestamp': self.timestamp.isoformat(),
+            'seconds': time.time()-self.t0,
+            'worker_processes': self.worker_processes,
+            'stats': self.stats,
+            'phases': self.phases.dump(),
+            'workers': dict((name, phases.dump()) for name, phases in self.workers.items()),
+            'stores': dict((path, {'stats': store['stats'], 'seconds': store['seconds'], 'phases': store['phases'].dump()})
+                for path, store in self.stores.items()),
+        }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.dump(), indent=2, sort_keys=True).encode('utf8'))
+
+    def write_prometheus(self, path):
+        """ write node_exporter textfile (totals only, to keep the number of series low) """
+
+        report = self.dump()
+        lines = []
+        def metric(name, help_, type_, values):
+            lines.append('# HELP kopano_backup_%s %s' % (name, help_))
+            lines.append('# TYPE kopano_backup_%s %s' % (name, type_))
+            for labels, value in values:
+                lines.append('kopano_backup_%s%s %s' % (name, labels, value))
+        phases = sorted(report['phases'].items())
+        metric('phase_seconds', 'Time spent per phase during last run.', 'gauge',
+            [('{phase="%s"}' % phase, c['seconds']) for phase, c in phases])
+        metric('phase_count', 'Number of operations per phase during last run.', 'gauge',
+            [('{phase="%s"}' % phase, c['count']) for phase, c in phases])
+        metric('phase_bytes', 'Bytes processed per phase during last run.', 'gauge',
+            [('{phase="%s"}' % phase, c['bytes']) for phase, c in phases])
+        metric('changes', 'Number of changes (including deletes) during last run.', 'gauge',
+            [('', report['stats']['changes'] + report['stats']['deletes'])])
+        metric('errors', 'Number of errors during last run.', 'gauge', [('', report['stats']['errors'])])
+        metric('stores', 'Number of stores backed up during last run.', 'gauge', [('', len(report['stores']))])
+        metric('duration_seconds', 'Duration of last run.', 'gauge', [('', report['seconds'])])
+        metric('last_run_timestamp_seconds', 'Start time of last run.', 'gauge', [('', time.mktime(self.timestamp.timetuple()))])
+        _write_atomic(path, ('\n'.join(lines) + '\n').encode('ascii'))
+
+def _write_atomic(path, data):
+    with open(path+'.tmp', 'wb') as f:
+        f.write(data)
+    os.rename(path+'.tmp', path)
+
+BLOB_REF = b'blob'
+
+class BlobStore:
+    """ content-addressed store for attachment data, shared by backup directories
+
+    blobs are stored compressed under their sha256 digest. serialized items refer to them using (BLOB_REF, digest)
+    instead of the attachment data. references are counted in the 'refs' database, so a blob can be removed
+    once no backup refers to it anymore. to never lose data, references are added when blobs are stored
+    (under the same lock, so a concurrent release cannot remove a blob that is being reused), so before
+    items referring to them are stored, and released after such items are removed.
+
+    backup directories using the store are registered in the 'users' file. as removing a backup directory (such
+    as a merged differential) does not release its references, sweep() (run by --purge) recounts them from the
+    index records of all registered directories that still exist, and removes blobs no longer referred to. """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def put(self, datas):
+        """ store blobs (if not stored already) and add a reference to each, returning their digests """
+
+        digests = [hashlib.sha256(data).hexdigest() for data in datas]
+        if not digests:
+            return digests
+        with open(self.path+'/lock', 'w') as lockfile:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            for digest, data in zip(digests, datas):
+                blob_path = self._blob_path(digest)
+                if not os.path.exists(blob_path):
+                    if not os.path.isdir(os.path.dirname(blob_path)):
+                        os.makedirs(os.path.dirname(blob_path))
+                    tmp_path = '%s.%d.tmp' % (blob_path, os.getpid())
+                    with open(tmp_path, 'wb') as f:
+                        f.write(zlib.compress(data))
+                    os.rename(tmp_path, blob_path) # atomic, as readers do not lock
+            self._update_refs_locked(digests, 1)
+        return digests
+
+    def get(self, digest):
+        with open(self._blob_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def size(self, digest):
+        blob_path = self._blob_path(digest)
+        return os.path.getsize(blob_path) if os.path.exists(blob_path) else 0
+
+    def _update_refs(self, digests, delta):
+        if not digests:
+            return
+        with open(self.path+'/lock', 'w') as lockfile:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            self._update_refs_locked(digests, delta)
+
+    def _update_refs_locked(self, digests, delta):
+        with closing(dbopen(self.path+'/refs')) as db_refs:
+            for digest in digests:
+                key = digest.encode('ascii')
+                count = int(db_refs.get(key, b'0')) + delta
+                if count > 0:
+                    db_refs[key] = str(count).encode('ascii')
+                else:
+                    if key in db_refs:
+                        del db_refs[key]
+                    if os.path.exists(self._blob_path(digest)):
+                        os.remove(self._blob_path(digest))
+
+    def addref(self, digests):
+        self._update_refs(digests, 1)
+
+    def release(self, digests):
+        """ release references, removing unreferenced blobs """
+
+        self._update_refs(digests, -1)
+
+    def _users(self):
+        if not os.path.exists(self.path+'/users'):
+            return []
+        return [line for line in open(self.path+'/users', 'rb').read().decode('utf8').splitlines() if line]
+
+    def register(self, data_path):
+        """ record backup directory as using the store (as relative path, so backups can be moved together) """
+
+        user = os.path.relpath(os.path.abspath(data_path), self.path)
+        with open(self.path+'/lock', 'w') as lockfile:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            if user not in self._users():
+                with open(self.path+'/users', 'ab') as f:
+                    f.write((user+'\n').encode('utf8'))
+
+    def sweep(self, locked_path=None):
+        """ rebuild reference counts from the index records of all registered backup directories, and remove
+            unreferenced blobs, returning their number. the backup directories are locked first (as backup does),
+            so no backup can add references meanwhile. if one of them is in use, nothing is done and None is
+            returned. locked_path is a backup directory already locked by the caller. """
+
+        registered = self._users()
+        users = []
+        for user in registered:
+            data_path = os.path.normpath(os.path.join(self.path, user))
+            blobs = open_blobstore(data_path) if os.path.isdir(data_path) else None
+            if blobs and os.path.realpath(blobs.path) == os.path.realpath(self.path):
+                users.append((user, data_path))
+
+        dir_locks = []
+        try:
+            for _, data_path in users:
+                if locked_path and os.path.realpath(data_path) == os.path.realpath(locked_path):
+                    continue
+                lockfile = open(data_path+'/lock', 'w')
+                dir_locks.append(lockfile)
+                try:
+                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    return None
+
+            with open(self.path+'/lock', 'w') as lockfile:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+                if self._users() != registered: # directory added meanwhile
+                    return None
+
+                # mark: count references of all index records
+                counts = collections.Counter()
+                for _, data_path in users:
+                    for dirpath, _, _ in os.walk(data_path):
+                        if storage.engine(dirpath+'/index'):
+                            with closing(dbopen(dirpath+'/index')) as db_index:
+                                counts.update(index_blobs(db_index))
+
+                with closing(dbopen(self.path+'/refs')) as db_refs:
+                    for key in list(db_refs.keys()):
+                        if key.decode('ascii') not in counts:
+                            del db_refs[key]
+                    for digest, count in counts.items():
+                        db_refs[digest.encode('ascii')] = str(count).encode('ascii')
+
+                # sweep: remove unreferenced blobs (and left-over temporary files)
+                removed = 0
+                for subdir in os.listdir(self.path):
+                    if len(subdir) == 2 and os.path.isdir(os.path.join(self.path, subdir)):
+                        for filename in os.listdir(os.path.join(self.path, subdir)):
+                            if filename not in counts:
+                                os.remove(os.path.join(self.path, subdir, filename))
+                                removed += 1
+
+                # forget removed backup directories
+                with open(self.path+'/users', 'wb') as f:
+                    f.write(''.join(user+'\n' for user, _ in users).encode('utf8'))
+
+            return removed
+        finally:
+            for lockfile in dir_locks:
+                lockfile.close()
+
+    def extract(self, data, min_size):
+        """ move attachment data of at least min_size bytes from serialized item into store,
+            adding references for the returned digests """
+
+        d = pickle_loads(data)
+        found = []
+        self._extract(d, min_size, found)
+        if not found:
+            return data, []
+        digests = self.put([data for _, _, data in found])
+        for (atts, i, _), digest in zip(found, digests):
+            atts[i] = (atts[i][0], (BLOB_REF, digest))
+        return pickle_dumps(d), digests
+
+    def _extract(self, d, min_size, found):
+        atts = d[b'attachments']
+        for i, (props, data) in enumerate(atts):
+            if isinstance(data, dict): # embedded item
+                self._extract(data, min_size, found)
+            elif len(data) >= min_size:
+                found.append((atts, i, data))
+
+    def resolve(self, data):
+        """ replace references in serialized item with attachment data """
+
+        d = pickle_loads(data)
+        self._resolve(d)
+        return pickle_dumps(d)
+
+    def _resolve(self, d):
+        atts = d[b'attachments']
+        for i, (props, data) in enumerate(atts):
+            if isinstance(data, dict): # embedded item
+                self._resolve(data)
+            elif isinstance(data, tuple) and data[0] == BLOB_REF:
+                atts[i] = (props, self.get(data[1]))
+
+def open_blobstore(data_path):
+    """ open blob store used by backup directory, if any """
+
+    if os.path.exists(data_path+'/blobstore'):
+        blob_path = open(data_path+'/blobstore', 'rb').read().decode('utf8')
+        return BlobStore(os.path.normpath(os.path.join(data_path, blob_path)))
+
+def link_blobstore(data_path, blob_path):
+    """ make backup directory use blob store (stored as relative path, so backups can be moved together) """
+
+    if not os.path.exists(data_path+'/blobstore'):
+        open(data_path+'/blobstore', 'wb').write(os.path.relpath(blob_path, data_path).encode('utf8'))
+    open_blobstore(data_path).register(data_path)
+
+def index_blobs(db_index):
+    """ collect blob references of all items in index """
+
+    digests = []
+    for key, value in db_index.items():
+        if key != b'folder':
+            digests.extend(pickle_loads(value).get(b'blobs', []))
+    return digests
+
+def _db_size(path):
+    return storage.size(path)
+
+def _item_size(idx, db_items, key):
+    """ compressed size of item, as stored in index record (or else determined from 'items' database) """
+
+    size = idx.get(b'size')
+    if size is None:
+        size = storage.value_size(db_items, key)
+    return size
+
+SUMMARY_VERSION = 1
+
+class Summary:
+    """ per-folder summary of the 'index' database ('summary' file), maintained by backup, merge and purge,
+        so --stats does not have to read all index records. items are counted separately when marked as
+        deleted. 'first' and 'last' (modification dates) are only narrowed again by purge. """
+
+    def __init__(self, data=None):
+        self.data = data or {
+            b'version': SUMMARY_VERSION,
+            b'items': self._state(),
+            b'deleted': self._state(),
+        }
+
+    @staticmethod
+    def _state():
+        return {
+            b'count': 0,
+            b'bytes': 0, # compressed size
+            b'first': None,
+            b'last': None,
+            b'months': {}, # (year, month) -> count
+            b'blobs': {}, # digest -> count
+        }
+
+    @staticmethod
+    def load(folder_path):
+        path = folder_path+'/summary'
+        if os.path.exists(path):
+            data = pickle_loads(open(path, 'rb').read())
+            if data.get(b'version') == SUMMARY_VERSION:
+                return Summary(data)
+
+    @staticmethod
+    def build(db_index, db_items):
+        summary = Summary()
+        for key, value in db_index.iteritems():
+            idx = pickle_loads(value)
+            summary.add(idx, _item_size(idx, db_items, key))
+        return summary
+
+    @staticmethod
+    def open(folder_path, db_index, db_items):
+        """ load summary, or build it from scratch (backup created without summaries) """
+
+        return Summary.load(folder_path) or Summary.build(db_index, db_items)
+
+    def save(self, folder_path):
+        path = folder_path+'/summary'
+        with open(path+'.tmp', 'wb') as f:
+            f.write(pickle_dumps(self.data))
+        os.rename(path+'.tmp', path)
+
+    def add(self, idx, size, sign=1):
+        """ add (or with sign -1, remove) index record and item size """
+
+        last_modified = idx.get(b'last_modified')
+        if last_modified is None: # folder, sourcekey-only delete (differential)
+            return
+        state = self.data[b'deleted' if idx.get(b'backup_deleted') else b'items']
+        state[b'count'] += sign
+        state[b'bytes'] += sign * size
+        _add_count(state[b'months'], (last_modified.year, last_modified.month), sign)
+        for digest in idx.get(b'blobs', []):
+            _add_count(state[b'blobs'], digest, sign)
+
+        if state[b'count'] == 0:
+            state[b'first'] = state[b'last'] = None
+        elif sign > 0:
+            if state[b'first'] is None or last_modified < state[b'first']:
+                state[b'first'] = last_modified
+            if state[b'last'] is None or last_modified > state[b'last']:
+                state[b'last'] = last_modified
+
+    def remove(self, idx, size):
+        self.add(idx, size, -1)
+
+    def states(self, deletes):
+        """ summaries to show, depending on --deletes """
+
+        if deletes == 'no':
+            return [self.data[b'items']]
+        return [self.data[b'items'], self.data[b'deleted']]
+
+def _add_count(counts, key, sign):
+    count = counts.get(key, 0) + sign
+    if count:
+        counts[key] = count
+    else:
+        del counts[key]
+
+def _copy_zdicts(from_dir, to_dir):
+    """ copy compression dictionaries (named after their content, so existing ones are kept) """
+
+    from_path, to_path = from_dir+'/zdicts', to_dir+'/zdicts'
+    if os.path.isdir(from_path):
+        if not os.path.isdir(to_path):
+            os.makedirs(to_path)
+        for filename in os.listdir(from_path):
+            if filename != 'current' and not os.path.exists(to_path+'/'+filename):
+                shutil.copy(from_path+'/'+filename, to_path)
 
 def _copy_folder_meta(from_dir, to_dir, keep_db=False):
     if not os.path.exists(to_dir):
         os.makedirs(to_dir)
 
-    for filename in ('acl', 'folder', 'rules', 'items', 'index', 'state', 'path'): # 'path' last to indicate completion
-        if not (keep_db and filename in ('index', 'items')):
+    _copy_zdicts(from_dir, to_dir) # before items referring to them
+
+    for filename in ('acl', 'folder', 'rules', 'items', 'index', 'summary', 'state', 'path'): # 'path' last to indicate completion
+        if not (keep_db and filename in ('index', 'items', 'summary')):
             from_path = from_dir+'/'+filename
             to_path = to_dir+'/'+filename
-            if os.path.exists(from_path):
+            if filename in ('index', 'items'):
+                if storage.engine(from_path):
+                    storage.copy(from_path, to_path) # overwrites
+            elif os.path.exists(from_path):
                 shutil.copy(from_path, to_dir) # overwrites
 
 def _copy_store_meta(from_dir, to_dir):
+    _copy_zdicts(from_dir, to_dir)
+
     for filename in ('delegates', 'store', 'user'):
         from_path = from_dir+'/'+filename
         to_path = to_dir+'/'+filename
         if os.path.exists(from_path):
             shutil.copy(from_path, to_dir) # overwrites
 
+def _store_props(store):
+    props = list(store.props())
+
+    for proptag in SETTINGS_PROPTAGS:
+        if not [prop for prop in props if prop.proptag == proptag]:
+            prop = store.get_prop(proptag)
+            if prop:
+                props.append(prop)
+
+    return props
+
+def backup_paths(path, options, config, log):
+    """ create backup directory and determine (from- and to-) paths, taking --differential into account """
+
+    orig_path = blob_base = path
+    if options.differential:
+        path = 'differential/' + path
+
+    # create main directory
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    # differential: determine to- and from- backups
+    if options.differential:
+        diff_ids = [int(x) for x in os.listdir(path)]
+        if diff_ids:
+            orig_path = path + '/' + str(max(diff_ids))
+            diff_id = max(diff_ids)+1
+        else:
+            diff_id = 1
+        path = path + '/' + str(diff_id)
+        log.info("performing differential backup from '%s' to '%s'", orig_path, path)
+        os.makedirs(path)
+
+    # attachment deduplication: blob store next to (non-differential) backup directories
+    if config['attachment_dedup_size']:
+        link_blobstore(path, os.path.join(os.path.dirname(os.path.abspath(blob_base)), '.blobs'))
+
+    return path, orig_path
+
+def backup_store(path, orig_path, stats, options, store, user, timestamp, log, phases=None):
+    """ backup store-level data, timestamp deleted folders and determine folders to backup,
+        as (data path, original data path, folder) tuples """
+
+    phases = phases or Phases()
+
+    # backup user and store properties
+    if not options.folders:
+        open(path+'/store', 'wb').write(phases.call('meta', dump_props, _store_props(store), stats, log))
+        if user:
+            open(path+'/user', 'wb').write(phases.call('meta', dump_props, user.props(), stats, log))
+            if not options.skip_meta:
+                open(path+'/delegates', 'wb').write(phases.call('meta', store.delegations_dumps, stats=stats))
+                open(path+'/acl', 'wb').write(phases.call('meta', store.permissions_dumps, stats=stats))
+
+    # time of last backup
+    open(path+'/timestamp', 'wb').write(pickle_dumps(timestamp))
+    if not os.path.exists(path+'/folders'):
+        os.makedirs(path+'/folders')
+
+    # check command-line options and collect folders
+    log.info('backing up: %s', path)
+    sk_folder = {}
+    folders = list(store.folders())
+    if options.recursive:
+        folders = sum([[f]+list(f.folders()) for f in folders], [])
+    for folder in folders:
+        if (not store.public and \
+            ((options.skip_junk and store.is_special(folder, 'junk')) or \
+             (options.skip_deleted and store.is_special(folder, 'wastebasket')))):
+            continue
+        sk_folder[folder.sourcekey] = folder
+    sk_dir = sk_struct(orig_path, options)
+
+    # differential
+    if options.differential:
+        return [(path+'/folders/'+folder.sourcekey, (orig_path+'/'+sk_dir[sk]) if sk in sk_dir else None, folder)
+            for sk, folder in sk_folder.items()]
+
+    # timestamp deleted folders
+    if not options.folders:
+        for del_sk in set(sk_dir) - set(sk_folder):
+            fpath = open(path+'/'+sk_dir[del_sk]+'/path', 'rb').read().decode('utf8')
+            index = (path+'/'+sk_dir[del_sk]+'/index')
+            _mark_deleted(index, fpath, timestamp, log)
+
+    # new folders, existing folders
+    return [(path+'/folders/'+new_sk, path+'/folders/'+new_sk, sk_folder[new_sk]) for new_sk in set(sk_folder) - set(sk_dir)] + \
+           [(path+'/'+sk_dir[both_sk], path+'/'+sk_dir[both_sk], sk_folder[both_sk]) for both_sk in set(sk_folder) & set(sk_dir)]
+
 def _mark_deleted( index, fpath, timestamp, log):
     log.debug("marking deleted folder '%s'", fpath)
 
@@ -137,121 +696,164 @@ def _mark_deleted( index, fpath, timestamp, log):
             d[b'backup_deleted'] = timestamp
             db_index[b'folder'] = pickle_dumps(d)
 
+def merge_updates(updates, orig_dir, stats, added, released, dry_run):
+    """ apply combined index records to folder in key order, only writing index records that actually change """
+
+    diff_items = {}
+    try:
+        with closing(dbopen(orig_dir+'/items')) as orig_db_items:
+          with closing(dbopen(orig_dir+'/index')) as orig_db_index:
+            summary = None if dry_run else Summary.open(orig_dir, orig_db_index, orig_db_items)
+
+            for key in sorted(updates):
+                fields, item_dir = updates[key]
+                stats['records'] += 1
+                value = orig_db_index.get(key)
+                orig_idx = pickle_loads(value) if value is not None else None
+                orig_size = size = _item_size(orig_idx, orig_db_items, key) if orig_idx is not None else 0
+
+                idx = dict(orig_idx or {})
+                if item_dir: # replaced item
+                    released.extend(idx.pop(b'blobs', []))
+                    added.extend(fields.get(b'blobs', []))
+                elif list(fields) == [b'backup_deleted']:
+                    stats['deletes'] += 1
+                idx.update(fields)
+
+                if item_dir:
+                    if item_dir not in diff_items:
+                        diff_items[item_dir] = dbopen(item_dir+'/items')
+                    data = diff_items[item_dir][key]
+                    size = idx[b'size'] = len(data)
+                    stats['items'] += 1
+                    stats['bytes'] += size
+                    if not dry_run:
+                        orig_db_items[key] = data
+
+                if idx != orig_idx:
+                    stats['writes'] += 1
+                    if not dry_run:
+                        orig_db_index[key] = pickle_dumps(idx)
+                        if orig_idx is not None:
+                            summary.remove(orig_idx, orig_size)
+                        summary.add(idx, size)
+
+            if summary:
+                summary.save(orig_dir)
+    finally:
+        for db in diff_items.values():
+            db.close()
+
+def merge_folder(job, dry_run, log):
+    """ merge differential data into folder: the index records of all differentials are first combined
+        per key, after which the folder databases are updated in a single pass in key order """
+
+    fpath, orig_dir, new_dir, diff_dirs = job
+    stats = {'records': 0, 'writes': 0, 'items': 0, 'bytes': 0, 'deletes': 0}
+    added, released = [], []
+
+    # new folder: copy from first differential containing it
+    if new_dir:
+        log.debug("merging new folder '%s'", fpath)
+        with closing(dbopen(new_dir+'/items')) as db_items:
+            stats['items'] += len(db_items)
+        stats['bytes'] += _db_size(new_dir+'/items')
+        if dry_run:
+            orig_dir = new_dir
+        else:
+            with closing(dbopen(new_dir+'/index')) as db_index:
+                added.extend(index_blobs(db_index))
+            _copy_folder_meta(new_dir, orig_dir)
+
+    # combine index records: key -> [updated fields, differential containing latest item version]
+    updates = {}
+    for diff_dir in diff_dirs:
+        if not storage.engine(diff_dir+'/index'):
+            continue
+        with closing(dbopen(diff_dir+'/items')) as diff_db_items:
+          with closing(dbopen(diff_dir+'/index')) as diff_db_index:
+            for key in sorted(diff_db_index.keys()):
+                diff_idx = pickle_loads(diff_db_index[key])
+                update = updates.setdefault(key, [{}, None])
+                if list(diff_idx) != [b'backup_deleted'] and key in diff_db_items: # differential may contain pure delete (no item)
+                    update[0].pop(b'blobs', None)
+                    update[1] = diff_dir
+                update[0].update(diff_idx) # possibly only update 'backup_deleted' (differential)
+
+    if updates:
+        log.debug("merging '%s' (%d updates)", fpath, len(updates))
+        if not dry_run:
+            for diff_dir in diff_dirs:
+                _copy_zdicts(diff_dir, orig_dir) # before items referring to them
+        merge_updates(updates, orig_dir, stats, added, released, dry_run)
+
+    if not dry_run:
+        for diff_dir in diff_dirs:
+            _copy_folder_meta(diff_dir, orig_dir, keep_db=True)
+
+    return stats, added, released
+
 class BackupWorker(kopano.Worker):
     """ each worker takes stores from a queue, and backs them up to disk (or syncs them),
         according to the given command-line options """
 
     def main(self):
         config, server, options = self.service.config, self.service.server, self.service.options
+        self.split_stores = {} # store entryid -> store, for folder jobs
         while True:
             stats = {'changes': 0, 'deletes': 0, 'errors': 0}
             self.service.stats = stats # XXX generalize
+            self.phases = Phases()
+            job, job_t0 = None, time.time()
             with log_exc(self.log, stats):
-                # get store from input queue
-                (store_entryid, username, path) = self.iqueue.get()
-                store = server.store(entryid=store_entryid)
-                user = store.user
-
-                # from- and to- paths for differential
-                self.orig_path = path
-                if options.differential:
-                    path = 'differential/' + path
-
-                # create main directory
-                if not os.path.isdir(path):
-                    os.makedirs(path)
-
-                # differential: determine to- and from- backups
-                if options.differential:
-                    diff_ids = [int(x) for x in os.listdir(path)]
-                    if diff_ids:
-                        self.orig_path = path + '/' + str(max(diff_ids))
-                        diff_id = max(diff_ids)+1
-                    else:
-                        diff_id = 1
-                    path = path + '/' + str(diff_id)
-                    self.log.info("performing differential backup from '%s' to '%s'", self.orig_path, path)
-                    os.makedirs(path)
-
-                # lock backup dir and sync hierarchy
-                with open(path+'/lock', 'w') as lockfile:
-                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
-                    t0 = time.time()
-                    self.backup_hierarchy(path, stats, options, store, user, server, config)
-                    changes = stats['changes'] + stats['deletes']
-                    self.log.info('backing up %s took %.2f seconds (%d changes, ~%.2f/sec, %d errors)',
-                        path, time.time()-t0, changes, changes/(time.time()-t0), stats['errors'])
-
-            # return statistics in output queue
-            self.oqueue.put(stats)
-
-    def _store_props(self, store):
-        props = list(store.props())
-
-        for proptag in SETTINGS_PROPTAGS:
-            if not [prop for prop in props if prop.proptag == proptag]:
-                prop = store.get_prop(proptag)
-                if prop:
-                    props.append(prop)
-
-        return props
+                # get store or folder (of split store) from input queue
+                job = self.iqueue.get()
+                if job[0] == 'folder':
+                    (_, store_entryid, folder_entryid, path, data_path, orig_data_path) = job
+                    store = self.open_split_store(server, store_entryid)
+                    folder = store.folder(entryid=folder_entryid)
+                    self.blobs = open_blobstore(path)
+                    self.store_path = path
+                    self.backup_folder(data_path, orig_data_path, folder, store.subtree, config, options, stats, store, store.user, server)
+                else:
+                    (_, store_entryid, username, path) = job
+                    store = server.store(entryid=store_entryid)
+                    user = store.user
+                    path, self.orig_path = backup_paths(path, options, config, self.log)
+                    self.blobs = open_blobstore(path)
+                    self.store_path = path
+
+                    # lock backup dir and sync hierarchy
+                    with open(path+'/lock', 'w') as lockfile:
+                        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+                        t0 = time.time()
+                        self.backup_hierarchy(path, stats, options, store, user, server, config)
+                        changes = stats['changes'] + stats['deletes']
+                        self.log.info('backing up %s took %.2f seconds (%d changes, ~%.2f/sec, %d errors)',
+                            path, time.time()-t0, changes, changes/(time.time()-t0), stats['errors'])
+                        self.log.info('backing up %s: %s', path, self.phases.summary())
+
+            # return statistics and phase counters in output queue
+            self.oqueue.put((job, stats, self.phases.data, self.name, time.time()-job_t0))
+
+    def open_split_store(self, server, store_entryid):
+        """ open store of folder job, reusing it (and its hierarchy snapshot) for later folder jobs """
+
+        store = self.split_stores.get(store_entryid)
+        if store is None:
+            store = self.split_stores[store_entryid] = server.store(entryid=store_entryid)
+            # folder paths from a single hierarchy table read
+            hierarchy = store.hierarchy
+            self.log.debug('read hierarchy of %d folders', len(hierarchy))
+        return store
 
     def backup_hierarchy(self, path, stats, options, store, user, server, config):
-        # backup user and store properties
-        if not options.folders:
-            open(path+'/store', 'wb').write(dump_props(self._store_props(store), stats, self.log))
-            if user:
-                open(path+'/user', 'wb').write(dump_props(user.props(), stats, self.log))
-                if not options.skip_meta:
-                    open(path+'/delegates', 'wb').write(store.delegations_dumps(stats=stats))
-                    open(path+'/acl', 'wb').write(store.permissions_dumps(stats=stats))
-
-        # time of last backup
-        open(path+'/timestamp', 'wb').write(pickle_dumps(self.service.timestamp))
-        if not os.path.exists(path+'/folders'):
-            os.makedirs(path+'/folders')
-
-        # check command-line options and collect folders
-        self.log.info('backing up: %s', path)
-        sk_folder = {}
-        folders = list(store.folders())
         subtree = store.subtree
-        if options.recursive:
-            folders = sum([[f]+list(f.folders()) for f in folders], [])
-        for folder in folders:
-            if (not store.public and \
-                ((options.skip_junk and folder == store.junk) or \
-                 (options.skip_deleted and folder == store.wastebasket))):
-                continue
-            sk_folder[folder.sourcekey] = folder
-        sk_dir = sk_struct(self.orig_path, options)
-
-        # differential
-        if options.differential:
-            for sk, folder in sk_folder.items():
-                data_path = path+'/folders/'+folder.sourcekey
-                orig_data_path = (self.orig_path+'/'+sk_dir[sk]) if sk in sk_dir else None
-                self.backup_folder(data_path, orig_data_path, folder, subtree, config, options, stats, store, user, server)
-            return
-
-        # add new folders
-        for new_sk in set(sk_folder) - set(sk_dir):
-            data_path = path+'/folders/'+new_sk
-            folder = sk_folder[new_sk]
-            self.backup_folder(data_path, data_path, folder, subtree, config, options, stats, store, user, server)
-
-        # update existing folders
-        for both_sk in set(sk_folder) & set(sk_dir):
-            data_path = path+'/'+sk_dir[both_sk]
-            folder = sk_folder[both_sk]
-            self.backup_folder(data_path, data_path, folder, subtree, config, options, stats, store, user, server)
-
-        # timestamp deleted folders
-        if not options.folders:
-            for del_sk in set(sk_dir) - set(sk_folder):
-                fpath = open(path+'/'+sk_dir[del_sk]+'/path', 'rb').read().decode('utf8')
-                index = (path+'/'+sk_dir[del_sk]+'/index')
-                _mark_deleted(index, fpath, self.service.timestamp, self.log)
+        # folder paths and sourcekeys from a single hierarchy table read
+        hierarchy = store.hierarchy
+        self.log.debug('read hierarchy of %d folders', len(hierarchy))
+        for (data_path, orig_data_path, folder) in backup_store(path, self.orig_path, stats, options, store, user, self.service.timestamp, self.log, self.phases):
+            self.backup_folder(data_path, orig_data_path, folder, subtree, config, options, stats, store, user, server)
 
     def backup_folder(self, data_path, orig_data_path, folder, subtree, config, options, stats, store, user, server):
         """ backup single folder """
@@ -263,122 +865,262 @@ class BackupWorker(kopano.Worker):
 
         # backup folder properties, path, metadata
         open(data_path+'/path', 'wb').write(folder.path.encode('utf8'))
-        open(data_path+'/folder', 'wb').write(dump_props(folder.props(), stats, self.log))
+        open(data_path+'/folder', 'wb').write(self.phases.call('meta', dump_props, folder.props(), stats, self.log))
         if not options.skip_meta:
-            open(data_path+'/acl', 'wb').write(folder.permissions_dumps(stats=stats))
-            rules = folder.rules_dumps(stats=stats)
+            open(data_path+'/acl', 'wb').write(self.phases.call('meta', folder.permissions_dumps, stats=stats))
+            rules = self.phases.call('meta', folder.rules_dumps, stats=stats)
             if rules:
                 open(data_path+'/rules', 'wb').write(rules)
         if options.only_meta:
             return
 
         # sync over ICS, using stored 'state'
-        importer = FolderImporter(folder, data_path, config, options, self.log, stats, self.service)
+        importer = FolderImporter(folder, data_path, config, options, self.log, stats, self.service, self.blobs, self.phases, self.store_path)
         state = None
         if orig_data_path:
             orig_statepath = '%s/state' % orig_data_path
             if os.path.exists(orig_statepath):
                 state = open(orig_statepath, 'rb').read()
                 self.log.debug('found previous folder sync state: %s', state)
+        t0 = time.time()
         new_state = folder.sync(importer, state, log=self.log, stats=stats, begin=options.period_begin, end=options.period_end)
+        self.phases.add('fetch', time.time()-t0-importer.busy, count=importer.changes)
         if new_state != state or options.differential:
             importer.commit()
             statepath = '%s/state' % data_path
             open(statepath, 'wb').write(new_state.encode('ascii'))
             self.log.debug('saved folder sync state: %s', new_state)
 
+class RestoreWorker(kopano.Worker):
+    """ each worker takes (already created) folders from a queue, and restores their items """
+
+    def main(self):
+        server = self.server # own session
+        self.service.log = self.log # XXX generalize
+        while True:
+            stats = {'changes': 0, 'errors': 0}
+            self.service.restored_sourcekeys = set()
+            with log_exc(self.log, stats):
+                # get folder from input queue
+                (store_entryid, folder_entryid, path, fpath) = self.iqueue.get()
+                store = server.store(entryid=store_entryid)
+                folder = store.folder(entryid=folder_entryid)
+                self.service.restore_folder(folder, path, fpath, store, store.subtree, stats, store.user, server)
+
+            # return statistics and restored sourcekeys in output queue
+            self.oqueue.put((stats, self.service.restored_sourcekeys))
+
+class MergeWorker(kopano.Worker):
+    """ each worker takes folders from a queue, and merges differential data into them """
+
+    def main(self):
+        while True:
+            stats = {'errors': 0}
+            job, result = None, None
+            with log_exc(self.log, stats):
+                job = self.iqueue.get()
+                result = merge_folder(job, self.service.options.dry_run, self.log)
+
+            # return result (None on error) in output queue
+            self.oqueue.put((job, result))
+
 class FolderImporter:
     """ tracks changes for a given folder """
 
     def __init__(self, *args):
-        self.folder, self.folder_path, self.config, self.options, self.log, self.stats, self.service = args
+        self.folder, self.folder_path, self.config, self.options, self.log, self.stats, self.service, self.blobs, self.phases, store_path = args
         self.store = self.folder.store
+        self.compressor = compression.Compressor(self.config['compression_level'], self.config['compression_dict'],
+            self.folder_path, store_path, self.config['compression_dict_size'], self.config['compression_dict_samples'])
+        self.busy = 0.0 # time spent in importer (as opposed to ICS)
+        self.changes = 0
         self.reset_cache()
 
     def reset_cache(self):
         self.item_updates = []
         self.index_updates = []
+        self.deletes = set()
         self.cache_size = 0
 
     def update(self, item, flags):
         """ store updated item in 'items' database, and subject and date in 'index' database """
 
+        t0 = time.time()
         with log_exc(self.log, self.stats):
             self.log.debug('folder %s: new/updated document with entryid %s, sourcekey %s', self.folder.sourcekey, item.entryid, item.sourcekey)
 
-            data = zlib.compress(item.dumps(attachments=not self.options.skip_attachments, archiver=False, skip_broken=True))
-            self.item_updates.append((item.sourcekey, data))
+            data = self.phases.call('serialize', item.dumps, attachments=not self.options.skip_attachments, archiver=False, skip_broken=True)
+            digests = []
+            if self.blobs and self.config['attachment_dedup_size'] and item.has_attachments:
+                t1 = time.time()
+                data, digests = self.blobs.extract(data, self.config['attachment_dedup_size'])
+                self.phases.add('dedup', time.time()-t1, len(data))
+            if self.compressor.needs_training(): # compress on commit, after training dictionary
+                size = None
+            else:
+                data = self.phases.call('compress', self.compressor.compress, data)
+                size = len(data)
+            self.item_updates.append((item.sourcekey, data, digests, size is not None))
+            self.deletes.discard(item.sourcekey) # deleted, then restored (within same commit)
 
-            idx = self.make_idx(item, item.read)
-            self.index_updates.append((item.sourcekey, idx))
+            idx = self.make_idx(item, item.read, digests, size)
+            self.index_updates.append((item.sourcekey, idx, len(self.item_updates)-1))
 
             self.stats['changes'] += 1
 
-            self.cache_size += len(data) + len(idx)
-            if self.cache_size > CACHE_SIZE:
-                self.commit()
+            self.add_cache_size(len(data) + len(idx))
+        self.changes += 1
+        self.busy += time.time()-t0
 
-    def make_idx(self, item, read):
+    def add_cache_size(self, size):
+        self.cache_size += size
+        if self.cache_size > CACHE_SIZE:
+            self.commit()
+
+    def make_idx(self, item, read, blobs=None, size=None):
         orig_prop = item.get_prop(PR_EC_BACKUP_SOURCE_KEY)
         if orig_prop:
             orig_prop = _hex(orig_prop.value)
-        idx = pickle_dumps({
+        idx = {
             b'subject': item.subject,
             b'orig_sourcekey': orig_prop,
             b'last_modified': item.last_modified,
             b'backup_updated': self.service.timestamp,
             b'read': read,
-        })
-        return idx
+        }
+        if blobs:
+            idx[b'blobs'] = blobs
+        if size is not None:
+            idx[b'size'] = size
+        return pickle_dumps(idx)
 
-    def delete(self, item, flags): # XXX batch as well, 'updating' cache?
-        """ deleted item from 'items' and 'index' databases """
+    def delete(self, item, flags):
+        """ mark item as deleted in 'index' database (on commit) """
 
+        t0 = time.time()
         with log_exc(self.log, self.stats):
-         with closing(dbopen(self.folder_path+'/items')) as db_items:
-          with closing(dbopen(self.folder_path+'/index')) as db_index:
-
             self.log.debug('folder %s: deleted document with sourcekey %s', self.folder.sourcekey, item.sourcekey)
 
-            # NOTE ICS may generate delete events for items that did not exist
-            # before, for example for a new message which has already been
-            # deleted in the meantime.
-            if item.sourcekey.encode('ascii') in db_items:
-                idx = pickle_loads(db_index[item.sourcekey.encode('ascii')])
-                idx[b'backup_deleted'] = self.service.timestamp
-                db_index[item.sourcekey.encode('ascii')] = pickle_dumps(idx)
-            else:
-                db_index[item.sourcekey.encode('ascii')] = pickle_dumps({
-                    b'backup_deleted': self.service.timestamp
-                })
+            self.deletes.add(item.sourcekey)
             self.stats['deletes'] += 1
 
+            self.add_cache_size(DELETE_SIZE)
+        self.changes += 1
+        self.busy += time.time()-t0
+
     def read(self, item, state):
+        t0 = time.time()
         idx = self.make_idx(item, state)
-        self.index_updates.append((item.sourcekey, idx))
+        self.index_updates.append((item.sourcekey, idx, None))
+        self.add_cache_size(len(idx))
+        self.changes += 1
+        self.busy += time.time()-t0
 
     def commit(self):
         """ commit data to storage """
 
         t0 = time.time()
+        released = [] # references were added on update (see BlobStore.extract)
+
+        # train compression dictionary on (as yet uncompressed) items, then compress these
+        item_updates = []
+        pending = [data for _, data, _, compressed in self.item_updates if not compressed]
+        if pending:
+            t1 = time.time()
+            self.compressor.train(pending)
+            nbytes = 0
+            for sourcekey, data, digests, compressed in self.item_updates:
+                if not compressed:
+                    data = self.compressor.compress(data)
+                    nbytes += len(data)
+                item_updates.append((sourcekey, data, digests))
+            self.phases.add('compress', time.time()-t1, nbytes, len(pending))
+        else:
+            item_updates = [(sourcekey, data, digests) for sourcekey, data, digests, _ in self.item_updates]
+
+        t1 = time.time()
+
         with closing(dbopen(self.folder_path+'/items')) as item_db:
          with closing(dbopen(self.folder_path+'/index')) as index_db:
+            summary = Summary.open(self.folder_path, index_db, item_db)
+
+            # stored index records and item sizes, for summary (before replacing items)
+            current = {}
+            for sourcekey, _, _ in item_updates:
+                key = sourcekey.encode('ascii')
+                current[key] = self._stored(key, item_db, index_db)
 
-            for sourcekey, data in self.item_updates:
+            for sourcekey, data, digests in item_updates:
                 item_db[sourcekey.encode('ascii')] = data
-            for sourcekey, idx in self.index_updates:
-                index_db[sourcekey.encode('ascii')] = idx
 
-        self.log.debug('commit took %.2f seconds (%d items)', time.time()-t0, len(self.item_updates))
+            for sourcekey, idx, n in self.index_updates:
+                key = sourcekey.encode('ascii')
+                if key not in current:
+                    current[key] = self._stored(key, item_db, index_db)
+                old_idx, old_size = current[key]
+                idx = pickle_loads(idx)
+                replaced = n is not None
+                if replaced:
+                    idx[b'size'] = len(item_updates[n][1])
+                size = idx.get(b'size', 0)
+                if old_idx is not None:
+                    if replaced: # release references of replaced item
+                        if self.blobs:
+                            released.extend(old_idx.get(b'blobs', []))
+                    else: # read state change: keep references and size
+                        for field in (b'blobs', b'size'):
+                            if field in old_idx:
+                                idx[field] = old_idx[field]
+                        size = old_size
+                self._store(key, idx, size, index_db, summary, current)
+
+            # NOTE ICS may generate delete events for items that did not exist
+            # before, for example for a new message which has already been
+            # deleted in the meantime.
+            for sourcekey in sorted(self.deletes):
+                key = sourcekey.encode('ascii')
+                if key not in current:
+                    current[key] = self._stored(key, item_db, index_db)
+                old_idx, old_size = current[key]
+                if key in item_db and old_idx is not None:
+                    idx = dict(old_idx)
+                    idx[b'backup_deleted'] = self.service.timestamp
+                else:
+                    idx = {b'backup_deleted': self.service.timestamp}
+                self._store(key, idx, old_size, index_db, summary, current)
+
+            summary.save(self.folder_path)
+
+        if released:
+            self.blobs.release(released)
+
+        self.phases.add('write', time.time()-t1, sum(len(data) for _, data, _ in item_updates))
+        self.log.debug('commit took %.2f seconds (%d items, %d deletes)', time.time()-t0, len(self.item_updates), len(self.deletes))
         self.reset_cache()
 
+    def _stored(self, key, item_db, index_db):
+        value = index_db.get(key)
+        if value is None:
+            return None, 0
+        idx = pickle_loads(value)
+        return idx, _item_size(idx, item_db, key)
+
+    def _store(self, key, idx, size, index_db, summary, current):
+        old_idx, old_size = current[key]
+        if old_idx is not None:
+            summary.remove(old_idx, old_size)
+        summary.add(idx, size)
+        current[key] = (idx, size)
+        index_db[key] = pickle_dumps(idx)
+
 class Service(kopano.Service):
     """ main backup process """
 
     def main(self):
         self.timestamp = datetime.datetime.now()
+        storage.DEFAULT_ENGINE = self.config['storage_engine']
 
-        if self.options.restore or (self.options.purge is not None) or self.options.merge:
+        if self.options.restore or (self.options.purge is not None) or self.options.merge or self.options.convert_storage:
             data_path = self.args[0].rstrip('/')
             with open(data_path+'/lock', 'w') as lockfile:
                 fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
@@ -388,6 +1130,8 @@ class Service(kopano.Service):
                     self.purge(data_path)
                 elif self.options.merge:
                     self.merge(data_path)
+                elif self.options.convert_storage:
+                    self.convert_storage(data_path)
         else:
             self.backup()
 
@@ -403,21 +1147,94 @@ class Service(kopano.Service):
             jobs = self.create_jobs()
         except kopano.Error as e:
             fatal(str(e))
-        for job in jobs:
-            self.iqueue.put(job)
-        self.log.info('queued %d store(s) for parallel backup (%s processes)', len(jobs), len(workers))
         t0 = time.time()
-        stats = [self.oqueue.get() for i in range(len(jobs))] # blocking
+        report = RunReport(self.timestamp, len(workers))
+
+        # split large stores into per-folder jobs, largest jobs first
+        stats = []
+        split = {} # store entryid -> [path, lockfile, pending folder jobs, t0, stats]
+        size_jobs = []
+        split_size = self.config['store_split_size'] if len(workers) > 1 else 0
+        for (store_entryid, username, path, size) in jobs:
+            if split_size and size >= split_size:
+                store = self.server.store(entryid=store_entryid)
+                stats2 = {'changes': 0, 'deletes': 0, 'errors': 0}
+                phases, t1 = Phases(), time.time()
+                with log_exc(self.log, stats2):
+                    size_jobs.extend(self.split_store(store, path, stats2, split, phases))
+                report.add('main', path, stats2, phases, time.time()-t1)
+                if store_entryid not in split:
+                    stats.append(stats2)
+            else:
+                size_jobs.append((size, ('store', store_entryid, username, path)))
+        for size, job in sorted(size_jobs, reverse=True, key=lambda x: x[0]):
+            self.iqueue.put(job)
+        self.log.info('queued %d store(s) and %d folder(s) of %d split store(s) for parallel backup (%s processes)',
+            len([job for _, job in size_jobs if job[0] == 'store']), len([job for _, job in size_jobs if job[0] == 'folder']),
+            len(split), len(workers))
+
+        for entryid in [entryid for entryid in split if split[entryid][2] == 0]:
+            self.finish_split_store(split.pop(entryid), stats)
+        for i in range(len(size_jobs)): # blocking
+            job, stats2, phases, worker, seconds = self.oqueue.get()
+            if job is not None:
+                report.add(worker, job[3], stats2, Phases(phases), seconds)
+            if job is not None and job[0] == 'folder':
+                store_split = split[job[1]]
+                for key in stats2:
+                    store_split[4][key] += stats2[key]
+                store_split[2] -= 1
+                if store_split[2] == 0:
+                    self.finish_split_store(split.pop(job[1]), stats)
+            else:
+                stats.append(stats2)
+
         changes = sum(s['changes'] + s['deletes'] for s in stats)
         errors = sum(s['errors'] for s in stats)
         self.log.info('queue processed in %.2f seconds (%d changes, ~%.2f/sec, %d errors)',
             (time.time()-t0), changes, changes/(time.time()-t0), errors)
+        self.log.info('time spent per phase: %s', report.phases.summary())
+
+        # machine-readable report
+        output_dir = self.options.output_dir or u''
+        if self.config['report_file']:
+            report.write_json(os.path.join(output_dir, self.config['report_file']))
+        if self.config['prometheus_file']:
+            report.write_prometheus(self.config['prometheus_file'])
+
+    def split_store(self, store, path, stats, split, phases):
+        """ coordinate backup of large store: lock backup dir, backup store-level data and return per-folder jobs """
+
+        path, orig_path = backup_paths(path, self.options, self.config, self.log)
+        lockfile = open(path+'/lock', 'w')
+        try:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            size_jobs = [(folder.size, ('folder', store.entryid, folder.entryid, path, data_path, orig_data_path))
+                for (data_path, orig_data_path, folder) in
+                    backup_store(path, orig_path, stats, self.options, store, store.user, self.timestamp, self.log, phases)]
+        except:
+            lockfile.close()
+            raise
+        split[store.entryid] = [path, lockfile, len(size_jobs), time.time(), stats]
+        return size_jobs
+
+    def finish_split_store(self, store_split, stats):
+        """ all folders of split store are done: unlock backup dir """
+
+        path, lockfile, _, t0, stats2 = store_split
+        lockfile.close()
+        changes = stats2['changes'] + stats2['deletes']
+        self.log.info('backing up %s took %.2f seconds (%d changes, ~%.2f/sec, %d errors)',
+            path, time.time()-t0, changes, changes/(time.time()-t0), stats2['errors'])
+        stats.append(stats2)
 
     def restore(self, data_path):
         """ restore data from backup """
 
         self.restored_sourcekeys = set()
         self.options.sourcekeys = [sk.upper() for sk in self.options.sourcekeys]
+        self.blobs = open_blobstore(data_path)
+        self.restore_data_path = data_path
 
         # determine store to restore to
         self.log.info('starting restore of %s', data_path)
@@ -467,8 +1284,9 @@ class Service(kopano.Service):
             if orig_sk:
                 sk_folder[orig_sk] = folder
 
-        # restore specified (parts of) folders
+        # create specified folders, in hierarchy order
         meta_folders = []
+        restore_folders = []
         sks = set()
         for path in paths:
             fpath = path_folder[path]
@@ -488,8 +1306,8 @@ class Service(kopano.Service):
 
                 folder = restore_root.get_folder(path)
                 if (folder and not store.public and \
-                    ((self.options.skip_junk and folder == store.junk) or \
-                    (self.options.skip_deleted and folder == store.wastebasket))):
+                    ((self.options.skip_junk and store.is_special(folder, 'junk')) or \
+                    (self.options.skip_deleted and store.is_special(folder, 'wastebasket')))):
                         continue
 
             # restore folder
@@ -512,10 +1330,13 @@ class Service(kopano.Service):
                 if self.options.clean_folders:
                     self.log.info('emptying folder %s', folder.path)
                     folder.empty()
-                self.restore_folder(folder, path, fpath, store, store.subtree, stats, user, self.server)
+                restore_folders.append((folder, path, fpath))
             if folder:
                 meta_folders.append((folder, fpath))
 
+        # restore items for specified (parts of) folders
+        self.restore_folders(restore_folders, store, stats, user)
+
         # differential folder deletes
         if self.options.differential:
             for sk in set(sk_folder)-sks:
@@ -557,11 +1378,40 @@ class Service(kopano.Service):
         self.log.info('restore completed in %.2f seconds (%d changes, ~%.2f/sec, %d errors)',
             time.time()-t0, stats['changes'], stats['changes']/(time.time()-t0), stats['errors'])
 
+    def restore_folders(self, restore_folders, store, stats, user):
+        """ restore items for given folders, in parallel if multiple worker processes are configured """
+
+        nworkers = min(self.config['worker_processes'], len(restore_folders))
+        if nworkers <= 1:
+            for (folder, path, fpath) in restore_folders:
+                self.restore_folder(folder, path, fpath, store, store.subtree, stats, user, self.server)
+            return
+
+        self.iqueue, self.oqueue = Queue(), Queue()
+        workers = [RestoreWorker(self, 'restore%d'%i, nr=i, iqueue=self.iqueue, oqueue=self.oqueue)
+                       for i in range(nworkers)]
+        for worker in workers:
+            worker.start()
+
+        # largest folders first
+        restore_folders = sorted(restore_folders, reverse=True, key=lambda job: _db_size(job[2]+'/items'))
+        for (folder, path, fpath) in restore_folders:
+            self.iqueue.put((store.entryid, folder.entryid, path, fpath))
+        self.log.info('queued %d folder(s) for parallel restore (%d processes)', len(restore_folders), len(workers))
+
+        for i in range(len(restore_folders)): # blocking
+            stats2, restored_sourcekeys = self.oqueue.get()
+            for key in stats:
+                stats[key] += stats2[key]
+            self.restored_sourcekeys.update(restored_sourcekeys)
+
     def purge(self, data_path):
         """ permanently delete old folders/items from backup """
 
-        stats = {'folders': 0, 'items': 0}
+        stats = {'folders': 0, 'items': 0, 'reclaimed': 0}
         path_folder = folder_struct(data_path, self.options)
+        blobs = open_blobstore(data_path)
+        released = []
 
         for path, fpath in path_folder.items():
             # check if folder was deleted
@@ -569,6 +1419,11 @@ class Service(kopano.Service):
             if folder_deleted(fpath):
                 if (self.timestamp - folder_deleted(fpath)).days >= self.options.purge:
                     self.log.debug('purging folder')
+                    if blobs: # including subfolders
+                        for dirpath, _, _ in os.walk(fpath):
+                            if storage.engine(dirpath+'/index'):
+                                with closing(dbopen(dirpath+'/index')) as db_index:
+                                    released.extend(index_blobs(db_index))
                     shutil.rmtree(fpath)
                     stats['folders'] += 1
 
@@ -576,11 +1431,15 @@ class Service(kopano.Service):
                 with closing(dbopen(fpath+'/items')) as db_items:
                     with closing(dbopen(fpath+'/index')) as db_index:
                         delete_items = []
+                        summary = Summary() # rebuild, narrowing period
                         for item, idx in db_index.items():
                             d = pickle_loads(idx)
                             backup_deleted = d.get(b'backup_deleted')
                             if backup_deleted and (self.timestamp - backup_deleted).days >= self.options.purge:
                                 delete_items.append(item)
+                                released.extend(d.get(b'blobs', []))
+                            else:
+                                summary.add(d, _item_size(d, db_items, item))
 
                         for item in delete_items:
                             stats['items'] += 1
@@ -589,67 +1448,141 @@ class Service(kopano.Service):
                             if item in db_items:
                                 del db_items[item]
 
-        self.log.info('purged %d folders and %d items', stats['folders'], stats['items'])
+                        summary.save(fpath)
+
+                # reclaim space of replaced/deleted items
+                for filename in ('items', 'index'):
+                    stats['reclaimed'] += storage.compact(fpath+'/'+filename)
+
+        # release attachment blobs of purged items (after these are gone)
+        if released:
+            blobs.release(released)
+
+        # recount references, also releasing those of removed backup directories (such as merged differentials)
+        if blobs:
+            blobs.register(data_path)
+            removed = blobs.sweep(locked_path=data_path)
+            if removed is None:
+                self.log.warning('not recounting attachment references: backup directory using blob store is in use')
+            else:
+                self.log.info('removed %d unreferenced attachment blobs', removed)
+
+        self.log.info('purged %d folders and %d items (reclaimed %d bytes)', stats['folders'], stats['items'], stats['reclaimed'])
+
+    def convert_storage(self, data_path):
+        """ convert per-folder databases to other storage engine """
+
+        engine = self.options.convert_storage
+        count = 0
+        for path, fpath in folder_struct(data_path, self.options).items():
+            for filename in ('items', 'index'):
+                if storage.convert(fpath+'/'+filename, engine):
+                    self.log.debug('converted %s database for folder: %s', filename, path)
+                    count += 1
+        self.log.info('converted %d databases to %s storage', count, engine)
 
     def merge(self, data_path):
         """ merge differential backups """
 
         diff_base = 'differential/'+data_path
         diff_ids = sorted((x for x in os.listdir(diff_base)), key=lambda x: int(x))
+        dry_run = self.options.dry_run
+
+        # determine per folder which differentials to merge (in order), and which folders were deleted
+        orig_sk_dir = sk_struct(data_path, self.options)
+        folder_jobs = {} # sourcekey -> (path, orig_dir, new_dir, diff_dirs)
+        deleted = {} # sourcekey -> timestamp
+        blobs = None
 
         for diff_id in diff_ids:
             diff_path = diff_base+'/'+diff_id
             self.log.info("merging differential backup '%s' into '%s'", diff_path, data_path)
 
             timestamp = pickle_loads(open(diff_path+'/timestamp', 'rb').read())
-
-            orig_sk_dir = sk_struct(data_path, self.options)
             diff_sk_dir = sk_struct(diff_path, self.options)
 
-            # add new folders
-            for new_sk in set(diff_sk_dir) - set(orig_sk_dir):
-                from_dir = diff_path+'/'+diff_sk_dir[new_sk]
-                to_dir = data_path+'/folders/'+new_sk
-                fpath = open(from_dir+'/path', 'rb').read().decode('utf8')
-                self.log.debug("merging new folder '%s'", fpath)
-                _copy_folder_meta(from_dir, to_dir)
-
-            # update existing folders # XXX check matching & higher syncstate?
-            for both_sk in set(orig_sk_dir) & set(diff_sk_dir):
-                folder_dir = diff_path+'/'+diff_sk_dir[both_sk]
-                fpath = open(folder_dir+'/path', 'rb').read().decode('utf8')
-                orig_dir = data_path+'/'+orig_sk_dir[both_sk]
-
-                # now merge new data
-                with closing(dbopen(orig_dir+'/items')) as orig_db_items:
-                 with closing(dbopen(orig_dir+'/index')) as orig_db_index:
-                  with closing(dbopen(folder_dir+'/items')) as diff_db_items:
-                   with closing(dbopen(folder_dir+'/index')) as diff_db_index:
-
-                    if diff_db_index: # XXX check higher if file exists
-                        self.log.debug("merging '%s' (%d updates)", fpath, len(diff_db_index))
-
-                        for key, value in diff_db_index.items():
-                            if key in orig_db_index:
-                                idx = pickle_loads(orig_db_index[key])
-                                idx.update(pickle_loads(value)) # possibly only update 'backup_deleted' (differential)
-                            else:
-                                idx = pickle_loads(value)
-                            orig_db_index[key] = pickle_dumps(idx)
+            # merged items refer to the same blobs as the differential (which keeps its references until removed and purged)
+            diff_blobs = open_blobstore(diff_path)
+            if diff_blobs:
+                blobs = diff_blobs
+                if not dry_run:
+                    link_blobstore(data_path, blobs.path)
+
+            for sk, diff_dir in diff_sk_dir.items():
+                from_dir = diff_path+'/'+diff_dir
+                if sk in folder_jobs: # XXX check matching & higher syncstate?
+                    folder_jobs[sk][3].append(from_dir)
+                else:
+                    fpath = open(from_dir+'/path', 'rb').read().decode('utf8')
+                    if sk in orig_sk_dir:
+                        folder_jobs[sk] = (fpath, data_path+'/'+orig_sk_dir[sk], None, [from_dir])
+                    else: # new folder
+                        folder_jobs[sk] = (fpath, data_path+'/folders/'+sk, from_dir, [])
+
+            for del_sk in (set(orig_sk_dir) | set(folder_jobs)) - set(diff_sk_dir):
+                deleted.setdefault(del_sk, timestamp)
+
+            if not dry_run:
+                _copy_store_meta(diff_path, data_path)
+
+        # merge folders, largest first
+        jobs = sorted(folder_jobs.values(), reverse=True,
+            key=lambda job: sum(_db_size(d+'/items') for d in job[3] + [job[2] or job[1]]))
+        stats = {'records': 0, 'writes': 0, 'items': 0, 'bytes': 0, 'deletes': 0}
+        added, released = [], []
+        failed = 0
+        writer = csv.writer(sys.stdout) if dry_run else None
+
+        for job, result in self.merge_folders(jobs):
+            if result is None:
+                failed += 1
+                continue
+            stats2, added2, released2 = result
+            for key in stats:
+                stats[key] += stats2[key]
+            added.extend(added2)
+            released.extend(released2)
+            if writer:
+                writer.writerow([job[0], stats2['records'], stats2['writes'], stats2['items'], stats2['bytes'], stats2['deletes']])
 
-                            if key in diff_db_items:
-                                orig_db_items[key] = diff_db_items[key] # differential may contain pure delete (no item)
+        # timestamp deleted folders
+        if not dry_run:
+            for del_sk, timestamp in deleted.items():
+                orig_dir = folder_jobs[del_sk][1] if del_sk in folder_jobs else data_path+'/'+orig_sk_dir[del_sk]
+                fpath = open(orig_dir+'/path', 'rb').read().decode('utf8')
+                _mark_deleted(orig_dir+'/index', fpath, timestamp, self.log)
 
-                _copy_folder_meta(folder_dir, orig_dir, keep_db=True)
+            if blobs:
+                blobs.addref(added)
+                blobs.release(released)
 
-            # timestamp deleted folders
-            for del_sk in set(orig_sk_dir) - set(diff_sk_dir):
-                orig_dir = data_path+'/'+orig_sk_dir[del_sk]
-                fpath = open(orig_dir+'/path', 'rb').read().decode('utf8')
+        self.log.info('%s %d folders (%d new, %d deleted): %d index records (%d changed, %d pure deletes), %d items (%d bytes)',
+            'would merge' if dry_run else 'merged', len(jobs), len([job for job in jobs if job[2]]), len(deleted),
+            stats['records'], stats['writes'], stats['deletes'], stats['items'], stats['bytes'])
+        if failed:
+            fatal('merging failed for %d folder(s)' % failed)
 
-                _mark_deleted(orig_dir+'/index', fpath, timestamp, self.log)
+    def merge_folders(self, jobs):
+        """ merge given folders, in parallel if multiple worker processes are configured """
 
-            _copy_store_meta(diff_path, data_path)
+        nworkers = min(self.config['worker_processes'], len(jobs))
+        if nworkers <= 1:
+            for job in jobs:
+                yield job, merge_folder(job, self.options.dry_run, self.log)
+            return
+
+        self.iqueue, self.oqueue = Queue(), Queue()
+        workers = [MergeWorker(self, 'merge%d'%i, nr=i, iqueue=self.iqueue, oqueue=self.oqueue)
+                       for i in range(nworkers)]
+        for worker in workers:
+            worker.start()
+
+        for job in jobs:
+            self.iqueue.put(job)
+        self.log.info('queued %d folder(s) for parallel merge (%d processes)', len(jobs), len(workers))
+
+        for i in range(len(jobs)): # blocking
+            yield self.oqueue.get()
 
     def create_jobs(self):
         """ check command-line options and determine which stores should be backed up """
@@ -693,7 +1626,9 @@ class Service(kopano.Service):
             for job in jobs:
                 list(job[0].folders())
 
-        return [(job[0].entryid,)+job[1:] for job in sorted(jobs, reverse=True, key=lambda x: x[0].size)]
+        # determine store sizes once, so the main process need not reopen stores
+        jobs = [job+(job[0].size,) for job in jobs]
+        return [(job[0].entryid,)+job[1:] for job in sorted(jobs, reverse=True, key=lambda x: x[3])]
 
     def restore_folder(self, folder, path, data_path, store, subtree, stats, user, server):
         """ restore (partial) folder """
@@ -709,35 +1644,48 @@ class Service(kopano.Service):
                 if value is not None:
                     folder[proptag] = value
 
-        # load existing sourcekeys in folder, to check for duplicates
-        existing = {}
-        table = folder.mapiobj.GetContentsTable(0)
-        table.SetColumns([PR_SOURCE_KEY, PR_EC_BACKUP_SOURCE_KEY, PR_ENTRYID], 0)
-        for row in table.QueryRows(2147483647, 0):
-            if PROP_TYPE(row[1].ulPropTag) != PT_ERROR:
-                existing[_hex(row[1].Value)] = _hex(row[2].Value)
-            else:
-                existing[_hex(row[0].Value)] = _hex(row[2].Value)
+        dicts = compression.Dictionaries([data_path, self.restore_data_path]) # per folder or per store
 
-        # now dive into 'items', and restore desired items
         with closing(dbopen(data_path+'/items')) as db_items:
           with closing(dbopen(data_path+'/index')) as db_index:
-            index = dict((a, pickle_loads(b)) for (a,b) in db_index.iteritems())
 
-            # determine sourcekey(s) to restore
-            sourcekeys = db_index.keys()
+            # determine items to restore, decoding index entries on demand
             if self.options.sourcekeys:
-                sourcekeys = [sk for sk in self.options.sourcekeys if sk.encode('ascii') in sourcekeys]
+                records = []
+                for sourcekey2 in self.options.sourcekeys:
+                    idx = db_index.get(sourcekey2.encode('ascii'))
+                    if idx is not None:
+                        records.append((sourcekey2.encode('ascii'), pickle_loads(idx)))
+                total = len(records)
+
+                # lookup existing items for these sourcekeys only (server-side)
+                lookup = set()
+                for sourcekey2a, idx in records:
+                    lookup.add(sourcekey2a)
+                    if idx.get(b'orig_sourcekey'):
+                        lookup.add(idx[b'orig_sourcekey'])
+                existing = existing_items(folder, lookup)
             else:
-                sourcekeys = [sk.decode('ascii') for sk in sourcekeys]
-
-            # restore/delete each item
-            for sourcekey2 in sourcekeys:
-                sourcekey2a = sourcekey2.encode('ascii')
+                records = ((key, pickle_loads(value)) for (key, value) in db_index.iteritems() if key != b'folder')
+                total = len(db_index) - (b'folder' in db_index)
+
+                # load existing sourcekeys in folder, to check for duplicates
+                existing = existing_items(folder)
+
+            # restore/delete each item, reporting progress per chunk
+            t0 = time.time()
+            count, changes = 0, stats['changes']
+            for sourcekey2a, idx in records:
+                count += 1
+                if count % RESTORE_CHUNK == 0:
+                    secs = time.time() - t0
+                    self.log.info('folder %s: processed %d/%d items, %d restored (%.1f items/sec)',
+                        path, count, total, stats['changes'] - changes, count / (secs or 1e-6))
+                sourcekey2 = sourcekey2a.decode('ascii')
                 with log_exc(self.log, stats):
 
                     # differential delete
-                    if index[sourcekey2a].get(b'backup_deleted') and self.options.differential:
+                    if idx.get(b'backup_deleted') and self.options.differential:
                         if self.options.deletes == 'no':
                             self.log.warning('skipping deleted item with sourcekey %s', sourcekey2)
                             continue
@@ -753,12 +1701,12 @@ class Service(kopano.Service):
 
                     # regular delete
                     if(sourcekey2a not in db_items or \
-                       (index[sourcekey2a].get(b'backup_deleted') and self.options.deletes in (None, 'no'))
+                       (idx.get(b'backup_deleted') and self.options.deletes in (None, 'no'))
                     ):
                         continue
 
                     # date range check
-                    last_modified = index[sourcekey2a].get(b'last_modified')
+                    last_modified = idx.get(b'last_modified')
                     if(last_modified and \
                        ((self.options.period_begin and last_modified < self.options.period_begin) or \
                          (self.options.period_end and last_modified >= self.options.period_end))
@@ -766,7 +1714,7 @@ class Service(kopano.Service):
                          continue
 
                     # handle existing item
-                    entryid = existing.get(sourcekey2a) or existing.get(index[sourcekey2a][b'orig_sourcekey'])
+                    entryid = existing.get(sourcekey2a) or existing.get(idx[b'orig_sourcekey'])
                     if entryid is not None:
                         if self.options.differential or self.options.overwrite:
                             folder.delete(folder.item(entryid=entryid))
@@ -776,8 +1724,12 @@ class Service(kopano.Service):
 
                     # restore item
                     self.log.debug('restoring item with sourcekey %s', sourcekey2)
-                    data = zlib.decompress(db_items[sourcekey2a])
-                    read = index[sourcekey2a].get(b'read')
+                    data = compression.decompress(db_items[sourcekey2a], dicts)
+                    if idx.get(b'blobs'): # deduplicated attachments
+                        if not self.blobs:
+                            raise kopano.Error('no attachment blob store found for %s' % data_path)
+                        data = self.blobs.resolve(data)
+                    read = idx.get(b'read')
 
                     item = folder.create_item(
                         loads=data,
@@ -796,6 +1748,11 @@ class Service(kopano.Service):
                         self.restored_sourcekeys.add(sourcekey2)
                     stats['changes'] += 1
 
+            if count >= RESTORE_CHUNK:
+                secs = time.time() - t0
+                self.log.info('folder %s: processed %d items in %.2f seconds (%.1f items/sec)',
+                    path, count, secs, count / (secs or 1e-6))
+
         # store original folder sourcekey
         folder_sk = folderprops[PR_SOURCE_KEY]
         try:
@@ -818,6 +1775,30 @@ class Service(kopano.Service):
         else:
             return self.server.user(username).store
 
+def existing_items(folder, sourcekeys=None):
+    """ map (original) sourcekeys of items in folder to entryids, optionally only for given sourcekeys """
+
+    existing = {}
+    table = folder.mapiobj.GetContentsTable(MAPI_DEFERRED_ERRORS)
+    table.SetColumns([PR_SOURCE_KEY, PR_EC_BACKUP_SOURCE_KEY, PR_ENTRYID], 0)
+    if sourcekeys is not None:
+        if not sourcekeys:
+            return existing
+        table.Restrict(SOrRestriction([
+            SPropertyRestriction(RELOP_EQ, proptag, SPropValue(proptag, _unhex(sourcekey)))
+                for sourcekey in sourcekeys for proptag in (PR_SOURCE_KEY, PR_EC_BACKUP_SOURCE_KEY)
+        ]), 0)
+    while True:
+        rows = table.QueryRows(TABLE_BATCH, 0)
+        if not rows:
+            break
+        for row in rows:
+            if PROP_TYPE(row[1].ulPropTag) != PT_ERROR:
+                existing[_hex(row[1].Value)] = _hex(row[2].Value)
+            else:
+                existing[_hex(row[0].Value)] = _hex(row[2].Value)
+    return existing
+
 def sk_struct(data_path, options, mapper=None, base_path=None):
     """ determine all folders in backup directory """
 
@@ -849,7 +1830,7 @@ def folder_struct(data_path, options, mapper=None): # XXX deprecate?
 
 def folder_deleted(data_path):
     if os.path.exists(data_path+'/index'):
-        with closing(bsddb.hashopen(data_path+'/index')) as db:
+        with closing(dbopen(data_path+'/index')) as db:
            idx = db.get(b'folder')
            if idx and pickle_loads(idx).get(b'backup_deleted'):
                return pickle_loads(idx).get(b'backup_deleted')
@@ -869,6 +1850,8 @@ def show_contents(data_path, options):
         paths = [p for p in path_folder if [f for f in paths if p.startswith(f)]]
 
     # loop over folders
+    blobs = open_blobstore(data_path)
+    digests = set()
     for path in paths:
         data_path = path_folder[path]
         items = []
@@ -876,22 +1859,50 @@ def show_contents(data_path, options):
         if options.deletes == 'no' and folder_deleted(data_path):
             continue
 
+        # --stats: use summary, unless filtering on date
+        if options.stats and not (options.period_begin or options.period_end):
+            summary = Summary.load(data_path)
+            if summary:
+                states = summary.states(options.deletes)
+                dates = [state[key] for state in states for key in (b'first', b'last') if state[key]]
+                writer.writerow([path,
+                    sum(state[b'count'] for state in states),
+                    sum(state[b'bytes'] for state in states),
+                    min(dates) if dates else None,
+                    max(dates) if dates else None,
+                ])
+                for state in states:
+                    digests.update(state[b'blobs'])
+                continue
+
         # filter items on date using 'index' database
+        size = 0
         if os.path.exists(data_path+'/index'):
-            with closing(bsddb.hashopen(data_path+'/index')) as db:
-                for key, value in db.iteritems():
-                    d = pickle_loads(value)
-                    if ((key == b'folder') or
-                        (options.period_begin and d[b'last_modified'] < options.period_begin) or
-                        (options.period_end and d[b'last_modified'] >= options.period_end) or
-                        (options.deletes == 'no' and d.get(b'backup_deleted'))):
-                        continue
-                    if b'last_modified' in d: # ignore sourcekey-only deletes (differential)
+            with closing(dbopen(data_path+'/index')) as db:
+                db_items = None
+                if options.stats and storage.engine(data_path+'/items'):
+                    db_items = dbopen(data_path+'/items')
+                try:
+                    for key, value in db.iteritems():
+                        d = pickle_loads(value)
+                        if ((key == b'folder') or
+                            (b'last_modified' not in d) or # ignore sourcekey-only deletes (differential)
+                            (options.period_begin and d[b'last_modified'] < options.period_begin) or
+                            (options.period_end and d[b'last_modified'] >= options.period_end) or
+                            (options.deletes == 'no' and d.get(b'backup_deleted'))):
+                            continue
                         items.append((key, d))
+                        digests.update(d.get(b'blobs', []))
+                        if db_items is not None:
+                            size += _item_size(d, db_items, key)
+                finally:
+                    if db_items is not None:
+                        db_items.close()
 
         # --stats: one entry per folder
         if options.stats:
-            writer.writerow([path, len(items)])
+            dates = [d[b'last_modified'] for key, d in items]
+            writer.writerow([path, len(items), size, min(dates) if dates else None, max(dates) if dates else None])
 
         # --index: one entry per item
         elif options.index:
@@ -899,6 +1910,10 @@ def show_contents(data_path, options):
             for key, d in items:
                 writer.writerow([key.decode('ascii'), path, d[b'last_modified'], d[b'subject']])
 
+    # --stats: deduplicated attachments (number, compressed size)
+    if options.stats and blobs and digests:
+        writer.writerow(['(attachment blobs)', len(digests), sum(blobs.size(digest) for digest in digests)])
+
 def dump_props(props, stats, log):
     """ dump given MAPI properties """
 
@@ -929,23 +1944,29 @@ def main():
     parser.add_option('', '--differential', dest='differential', action='store_true', help='create/restore differential backup')
     parser.add_option('', '--overwrite', dest='overwrite', action='store_true', help='overwrite duplicate items')
     parser.add_option('', '--merge', dest='merge', action='store_true', help='merge differential backups')
+    parser.add_option('', '--dry-run', dest='dry_run', action='store_true', help='only estimate the cost of --merge')
     parser.add_option('', '--clean-folders', dest='clean_folders', action='store_true', help='empty folder(s) before restore (dangerous!)')
+    parser.add_option('', '--convert-storage', dest='convert_storage', help='convert PATH to storage engine', metavar='ENGINE')
 
     # parse and check command-line options
     options, args = parser.parse_args()
 
     options.service = False
-    if options.restore or options.merge or options.stats or options.index or (options.purge is not None):
+    if options.restore or options.merge or options.stats or options.index or (options.purge is not None) or options.convert_storage:
         if len(args) != 1 or not os.path.isdir(args[0]):
             fatal('please specify path to backup data')
     elif len(args) != 0:
         fatal('too many arguments')
+    if options.convert_storage and options.convert_storage not in storage.ENGINES:
+        fatal('the --convert-storage option takes one of: %s' % ', '.join(storage.ENGINES))
     if options.deletes and options.deletes not in ('yes', 'no'):
         fatal("the --deletes option takes 'yes' or 'no'")
-    if options.folders and (options.differential or (options.purge is not None) or options.merge):
-        fatal('the --folder option cannot be combined with --differential, --purge or --merge')
+    if options.folders and (options.differential or (options.purge is not None) or options.merge or options.convert_storage):
+        fatal('the --folder option cannot be combined with --differential, --purge, --merge or --convert-storage')
     if options.output_dir and options.differential:
         fatal('the --output-dir option cannot be combined with --differential')
+    if options.dry_run and not options.merge:
+        fatal('the --dry-run option can only be combined with --merge')
     if options.sourcekeys and options.differential:
         fatal('invalid use of --sourcekeys option')
 
@@ -0,0 +1,136 @@
+# SPDX-License-Identifier: AGPL-3.0-only
+import collections
+import hashlib
+import os
+import re
+import zlib
+
+"""
+compression of serialized items, as stored in the per-folder 'items' databases.
+
+records are either plain zlib streams (as written by older versions, or without preset dictionary), or start with
+a version byte. since a zlib stream always starts with a CMF byte with compression method 8 (deflate) in the lower
+4 bits, the two cannot be confused:
+
+0x01: dictionary id (8 bytes), zlib stream compressed with the respective preset dictionary (zdict)
+
+dictionaries are trained from a sample of items, per folder or per store (see 'compression_dict' in backup.cfg),
+and stored in a 'zdicts' directory next to the folder or store data, named after their id (a content hash). the
+'current' file in this directory points to the dictionary used for new records. older dictionaries are kept, so
+existing records can always be decompressed.
+
+"""
+
+MODES = ('none', 'folder', 'store')
+
+ZDICT = b'\x01'
+ZDICT_ID_SIZE = 8
+ZDICT_MAX_SIZE = 32768 # deflate window
+CHUNK_RE = re.compile(b'[^\\n\\x00>]*[\\n\\x00>]?') # content-defined chunks (lines, tags, pickled strings)
+CHUNK_MIN, CHUNK_MAX = 8, 512
+
+def train(samples, size=ZDICT_MAX_SIZE):
+    """ build preset dictionary from sample data, out of chunks occurring in as many samples as possible
+        (weighed by their length). the most valuable chunks are placed at the end, as deflate can refer
+        to these most cheaply """
+
+    size = min(size, ZDICT_MAX_SIZE)
+    counts = collections.Counter()
+    for sample in samples:
+        counts.update(set(chunk for chunk in CHUNK_RE.findall(sample) if CHUNK_MIN <= len(chunk) <= CHUNK_MAX))
+
+    chunks, total = [], 0
+    for chunk in sorted((c for c in counts if counts[c] >= 2), key=lambda c: counts[c] * len(c), reverse=True):
+        if total + len(chunk) > size:
+            continue
+        chunks.append(chunk)
+        total += len(chunk)
+    return b''.join(reversed(chunks))
+
+def dict_id(zdict):
+    return hashlib.sha1(zdict).digest()[:ZDICT_ID_SIZE]
+
+class Dictionaries:
+    """ preset dictionaries in one or more 'zdicts' directories (searched in order) """
+
+    def __init__(self, paths):
+        self.paths = [os.path.join(path, 'zdicts') for path in paths if path]
+        self.cache = {}
+
+    def get(self, id_):
+        zdict = self.cache.get(id_)
+        if zdict is None:
+            for path in self.paths:
+                dict_path = os.path.join(path, id_.hex())
+                if os.path.exists(dict_path):
+                    with open(dict_path, 'rb') as f:
+                        zdict = self.cache[id_] = f.read()
+                    break
+            else:
+                raise IOError('no compression dictionary %s found in %s' % (id_.hex(), ', '.join(self.paths)))
+        return zdict
+
+    def current(self):
+        """ id of dictionary for new records in first directory, or None """
+
+        current_path = os.path.join(self.paths[0], 'current')
+        if os.path.exists(current_path):
+            with open(current_path, 'rb') as f:
+                return bytes.fromhex(f.read().decode('ascii'))
+
+    def add(self, zdict):
+        """ store dictionary in first directory, and make it the current one """
+
+        path = self.paths[0]
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        id_ = dict_id(zdict)
+        for filename, data in ((id_.hex(), zdict), ('current', id_.hex().encode('ascii'))):
+            with open(os.path.join(path, filename+'.tmp'), 'wb') as f:
+                f.write(data)
+            os.rename(os.path.join(path, filename+'.tmp'), os.path.join(path, filename))
+        self.cache[id_] = zdict
+        return id_
+
+class Compressor:
+    """ compress records for a folder, with the configured level and (trained) dictionary """
+
+    def __init__(self, level=6, mode='none', folder_path=None, store_path=None, dict_size=ZDICT_MAX_SIZE, samples=100):
+        self.level = level
+        self.mode = mode
+        self.dict_size = dict_size
+        self.samples = samples
+        self.dicts = None
+        self.zdict_id = None
+        if mode != 'none':
+            self.dicts = Dictionaries([folder_path if mode == 'folder' else store_path])
+            self.zdict_id = self.dicts.current()
+
+    def needs_training(self):
+        return self.mode != 'none' and self.zdict_id is None
+
+    def train(self, samples):
+        """ train and store dictionary from sample data (if there is enough to learn from) """
+
+        samples = samples[:self.samples]
+        if len(samples) >= 2:
+            zdict = train(samples, self.dict_size)
+            if zdict:
+                self.zdict_id = self.dicts.add(zdict)
+
+    def compress(self, data):
+        if self.zdict_id is None:
+            return zlib.compress(data, self.level)
+        c = zlib.compressobj(self.level, zdict=self.dicts.get(self.zdict_id))
+        return ZDICT + self.zdict_id + c.compress(data) + c.flush()
+
+def decompress(data, dicts=None):
+    """ decompress record of any version; dicts (Dictionaries) is needed for records using a dictionary """
+
+    if data[:1] == ZDICT:
+        if dicts is None:
+            raise IOError('no compression dictionaries available')
+        id_ = data[1:1+ZDICT_ID_SIZE]
+        d = zlib.decompressobj(zdict=dicts.get(id_))
+        return d.decompress(data[1+ZDICT_ID_SIZE:]) + d.flush()
+    return zlib.decompress(data)
@@ -0,0 +1,321 @@
+# SPDX-License-Identifier: AGPL-3.0-only
+from contextlib import closing
+import mmap
+import os
+import shutil
+import struct
+
+import bsddb3 as bsddb
+
+"""
+storage engines for the per-folder 'items' and 'index' key-value stores.
+
+'bsddb' (the default) uses a Berkeley DB hash file.
+
+'segment' uses a directory, containing append-only segment files and a compact sorted index ('keys').
+each record in a segment consists of a header (key length, value length, tombstone flag), the key and the value.
+writes (including deletes) are appended sequentially. reads use mmap. the sorted index is written on close, and
+remembers up to which length each segment was indexed, so records appended after that (for example, when the
+process was killed) are recovered by replaying the segment. replaced and deleted records are only removed
+when the database is compacted (see compact, used by --purge).
+
+both engines offer the same (dict-like) interface, and an existing database is always opened with the engine
+it was created with. so backups can contain a mix of both, and can be converted at any time (see convert).
+
+"""
+
+ENGINES = ('bsddb', 'segment')
+DEFAULT_ENGINE = 'bsddb' # for new databases
+
+SEGMENT_SIZE = 2**26
+COMPACT_RATIO = 0.25 # compact when at least this fraction of segment data is garbage
+
+RECORD = struct.Struct('<IIB') # key length, value length, tombstone
+KEYS_HEADER = struct.Struct('<4sIIQ') # magic, version, number of segments, garbage bytes
+KEYS_SEGMENT = struct.Struct('<IQ') # segment number, indexed length
+KEYS_ENTRY = struct.Struct('<HIQI') # key length, segment number, value offset, value length
+KEYS_MAGIC = b'KBSG'
+KEYS_VERSION = 1
+
+def engine(path):
+    """ engine of existing database, or None """
+
+    if os.path.isdir(path):
+        return 'segment'
+    elif os.path.exists(path):
+        return 'bsddb'
+
+def dbopen(path, engine_=None):
+    """ open (or create) database; existing databases are opened using their own engine """
+
+    engine_ = engine(path) or engine_ or DEFAULT_ENGINE
+    if engine_ == 'segment':
+        return SegmentDB(path)
+    return bsddb.hashopen(path, 'c')
+
+def convert(path, engine_):
+    """ convert existing database to given engine; the original is kept as path.old until done """
+
+    if engine(path) in (None, engine_):
+        return False
+    tmp_path, old_path = path+'.convert', path+'.old'
+    for p in (tmp_path, old_path):
+        remove(p)
+    with closing(dbopen(path)) as db_from:
+        with closing(dbopen(tmp_path, engine_)) as db_to:
+            for key in db_from.keys():
+                db_to[key] = db_from[key]
+    os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    remove(old_path)
+    return True
+
+def compact(path):
+    """ compact (segment) database if it contains enough garbage; returns number of bytes reclaimed """
+
+    if engine(path) != 'segment':
+        return 0
+    with closing(SegmentDB(path)) as db:
+        if db.garbage and db.garbage >= COMPACT_RATIO * db.size():
+            return db.compact()
+    return 0
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def value_size(db, key):
+    """ size of value stored under key (0 if missing), without reading the value if possible """
+
+    if isinstance(db, SegmentDB):
+        return db.value_size(key)
+    value = db.get(key)
+    return len(value) if value is not None else 0
+
+def size(path):
+    """ size of database on disk (of any engine) """
+
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    elif os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
+
+def copy(from_path, to_path):
+    """ copy database (of any engine), replacing existing database """
+
+    remove(to_path)
+    if os.path.isdir(from_path):
+        shutil.copytree(from_path, to_path)
+    else:
+        shutil.copy(from_path, to_path)
+
+class SegmentDB:
+    """ append-only segment files with a sorted index; see above """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.index = {} # key -> (segment, value offset, value length)
+        self.maps = {} # segment -> mmap
+        self.writer = None
+        self.write_seg = self.write_pos = 0
+        self.garbage = 0
+        self.dirty = False
+        self._load()
+
+    def _seg_path(self, seg):
+        return os.path.join(self.path, '%08d.seg' % seg)
+
+    def _segments(self):
+        return sorted(int(f[:-4]) for f in os.listdir(self.path) if f.endswith('.seg'))
+
+    def _load(self):
+        indexed = {}
+        keys_path = os.path.join(self.path, 'keys')
+        if os.path.exists(keys_path):
+            with open(keys_path, 'rb') as f:
+                data = f.read()
+            magic, version, nsegs, self.garbage = KEYS_HEADER.unpack_from(data, 0)
+            pos = KEYS_HEADER.size
+            for i in range(nsegs):
+                seg, length = KEYS_SEGMENT.unpack_from(data, pos)
+                indexed[seg] = length
+                pos += KEYS_SEGMENT.size
+            while pos < len(data):
+                keylen, seg, offset, length = KEYS_ENTRY.unpack_from(data, pos)
+                pos += KEYS_ENTRY.size
+                self.index[data[pos:pos+keylen]] = (seg, offset, length)
+                pos += keylen
+
+        last_indexed = max(indexed) if indexed else 0
+        for seg in self._segments():
+            if seg in indexed:
+                start = indexed[seg]
+            elif seg > last_indexed: # appended after index was written
+                start = 0
+            else: # left-over from interrupted compaction (no longer listed, see compact)
+                os.remove(self._seg_path(seg))
+                continue
+            if os.path.getsize(self._seg_path(seg)) > start:
+                self._replay(seg, start)
+
+    def _replay(self, seg, start):
+        with open(self._seg_path(seg), 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        pos = 0
+        while pos + RECORD.size <= len(data):
+            keylen, length, tombstone = RECORD.unpack_from(data, pos)
+            end = pos + RECORD.size + keylen + length
+            if end > len(data):
+                break
+            key = data[pos+RECORD.size:pos+RECORD.size+keylen]
+            old = self.index.pop(key, None)
+            if old:
+                self.garbage += RECORD.size + keylen + old[2]
+            if tombstone:
+                self.garbage += RECORD.size + keylen
+            else:
+                self.index[key] = (seg, start + pos + RECORD.size + keylen, length)
+            pos = end
+        if pos < len(data): # incomplete record
+            with open(self._seg_path(seg), 'r+b') as f:
+                f.truncate(start + pos)
+        self.dirty = True
+
+    def _append(self, key, value, tombstone=False):
+        if self.writer is None or self.write_pos >= SEGMENT_SIZE:
+            if self.writer:
+                self.writer.close()
+            segs = self._segments()
+            seg = segs[-1] if segs else 1
+            if segs and os.path.getsize(self._seg_path(seg)) >= SEGMENT_SIZE:
+                seg += 1
+            self.writer = open(self._seg_path(seg), 'ab')
+            self.write_seg, self.write_pos = seg, self.writer.tell()
+        self.writer.write(RECORD.pack(len(key), len(value), tombstone) + key + value)
+        offset = self.write_pos + RECORD.size + len(key)
+        self.write_pos = offset + len(value)
+        self.dirty = True
+        return offset
+
+    def _read(self, seg, offset, length):
+        if self.writer and seg == self.write_seg:
+            self.writer.flush()
+        m = self.maps.get(seg)
+        if m is None or offset + length > len(m):
+            if m is not None:
+                m.close()
+            with open(self._seg_path(seg), 'rb') as f:
+                m = self.maps[seg] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return m[offset:offset+length]
+
+    def __getitem__(self, key):
+        return self._read(*self.index[key])
+
+    def get(self, key, default=None):
+        entry = self.index.get(key)
+        return self._read(*entry) if entry else default
+
+    def __setitem__(self, key, value):
+        old = self.index.get(key)
+        if old:
+            self.garbage += RECORD.size + len(key) + old[2]
+        offset = self._append(key, value)
+        self.index[key] = (self.write_seg, offset, len(value))
+
+    def __delitem__(self, key):
+        old = self.index.pop(key)
+        self._append(key, b'', tombstone=True)
+        self.garbage += 2 * (RECORD.size + len(key)) + old[2]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def value_size(self, key):
+        entry = self.index.get(key)
+        return entry[2] if entry else 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return sorted(self.index)
+
+    def iteritems(self):
+        """ iterate over records in on-disk order, so reading is sequential """
+
+        for key, entry in sorted(self.index.items(), key=lambda x: x[1]):
+            yield key, self._read(*entry)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def size(self):
+        if self.writer:
+            self.writer.flush()
+        return sum(os.path.getsize(self._seg_path(seg)) for seg in self._segments())
+
+    def compact(self):
+        """ rewrite live records into new segments and remove old segments; returns number of bytes reclaimed """
+
+        old_size = self.size()
+        old_segs = self._segments()
+        seg = (old_segs[-1] + 1) if old_segs else 1
+        index = {}
+        new_segs = [seg]
+        f = open(self._seg_path(seg), 'wb')
+        pos = 0
+        try:
+            for key, value in self.iteritems():
+                if pos >= SEGMENT_SIZE:
+                    f.close()
+                    seg += 1
+                    new_segs.append(seg)
+                    f = open(self._seg_path(seg), 'wb')
+                    pos = 0
+                f.write(RECORD.pack(len(key), len(value), False) + key + value)
+                index[key] = (seg, pos + RECORD.size + len(key), len(value))
+                pos += RECORD.size + len(key) + len(value)
+        finally:
+            f.close()
+        self._close_files()
+        self.index, self.garbage = index, 0
+        self._write_keys(new_segs) # from here on, old segments are removed on load
+        for old_seg in old_segs:
+            os.remove(self._seg_path(old_seg))
+        return old_size - self.size()
+
+    def _write_keys(self, segs=None):
+        keys_path = os.path.join(self.path, 'keys')
+        if segs is None:
+            segs = self._segments()
+        with open(keys_path+'.tmp', 'wb') as f:
+            f.write(KEYS_HEADER.pack(KEYS_MAGIC, KEYS_VERSION, len(segs), self.garbage))
+            for seg in segs:
+                f.write(KEYS_SEGMENT.pack(seg, os.path.getsize(self._seg_path(seg))))
+            for key in sorted(self.index):
+                seg, offset, length = self.index[key]
+                f.write(KEYS_ENTRY.pack(len(key), seg, offset, length) + key)
+        os.rename(keys_path+'.tmp', keys_path)
+        self.dirty = False
+
+    def _close_files(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        for m in self.maps.values():
+            m.close()
+        self.maps = {}
+
+    def close(self):
+        self._close_files()
+        if self.dirty:
+            self._write_keys()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: AGPL-3.0-only
+from __future__ import print_function
+import logging
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kopano_search'))
+import plugin_xapian
+from synthetic import vocabulary, text
+
+"""
+measures the index size overhead and query speedup of the 'index_prefix_terms' option,
+by indexing the same synthetic documents with and without prefix terms.
+
+"""
+
+SERVER = '00000000000000000000000000000000'
+STORE = '11111111111111111111111111111111'
+FIELDS = (0x0037, 0x1000) # PR_SUBJECT, PR_BODY
+
+def documents(count, vocab, rand):
+    for docid in range(1, count + 1):
+        yield {
+            'serverid': SERVER,
+            'storeid': STORE,
+            'folderid': 1,
+            'docid': docid,
+            'sourcekey': '%040X' % docid,
+            'mapi%d' % FIELDS[0]: text(vocab, 8, rand),
+            'mapi%d' % FIELDS[1]: text(vocab, 200, rand),
+            'data': '',
+        }
+
+def dirsize(path):
+    return sum(os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, files in os.walk(path) for f in files)
+
+def run(config, options, log):
+    index_path = tempfile.mkdtemp(prefix='kopano-search-bench-')
+    try:
+        plugin = plugin_xapian.Plugin(index_path, log, config)
+        rand = random.Random(options.seed)
+        vocab = vocabulary(options.vocabulary, rand)
+
+        t0 = time.time()
+        for i, doc in enumerate(documents(options.items, vocab, rand)):
+            plugin.update(doc)
+            if (i + 1) % 1000 == 0:
+                plugin.commit(False)
+        plugin.commit(False)
+        plugin.close()
+        index_time = time.time() - t0
+
+        plugin.results = plugin_xapian.ResultCache(0) # measure queries, not the result cache
+        timings = {}
+        for length in range(1, 7):
+            queries = [[w[:length]] for w in rand.sample(vocab, options.queries) if len(w) >= length]
+            t0 = time.time()
+            for terms in queries:
+                query = '(' + ' OR '.join('(' + ' AND '.join('mapi%d:%s*' % (f, term) for term in terms) + ')' for f in FIELDS) + ')' # as kopano-search
+                plugin.search(SERVER, STORE, [], [(FIELDS, terms)], query, 1000, log)
+            timings[length] = (time.time() - t0) / max(len(queries), 1)
+
+        return dirsize(plugin.dbpath(SERVER, STORE)), index_time, timings
+    finally:
+        shutil.rmtree(index_path)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--items', type='int', default=10000, help='number of documents to index')
+    parser.add_option('--vocabulary', type='int', default=50000, help='number of distinct words')
+    parser.add_option('--queries', type='int', default=100, help='number of queries per prefix length')
+    parser.add_option('--min-length', type='int', default=1, help='index_prefix_min_length')
+    parser.add_option('--max-length', type='int', default=8, help='index_prefix_max_length')
+    parser.add_option('--seed', type='int', default=0, help='random seed')
+    options, args = parser.parse_args()
+    log = logging.getLogger('benchmark')
+
+    results = {}
+    for mode in ('wildcards', 'prefix terms'):
+        config = {
+            'index_prefix_terms': mode == 'prefix terms',
+            'index_prefix_min_length': options.min_length,
+            'index_prefix_max_length': options.max_length,
+        }
+        results[mode] = run(config, options, log)
+
+    (size1, index1, timings1), (size2, index2, timings2) = results['wildcards'], results['prefix terms']
+    print('%d items, %d words per item, vocabulary of %d words' % (options.items, 208, options.vocabulary))
+    print('index size:  %.1f MiB -> %.1f MiB (%+.0f%%)' % (size1 / 2.0**20, size2 / 2.0**20, 100.0 * (size2 - size1) / size1))
+    print('index time:  %.2f s -> %.2f s' % (index1, index2))
+    for length in sorted(timings1):
+        print('query %d-char prefix: %.2f ms -> %.2f ms' % (length, 1000 * timings1[length], 1000 * timings2[length]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: AGPL-3.0-only
+from __future__ import print_function
+import cProfile
+import logging
+import optparse
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # prefer installed kopano_search
+import kopano
+import kopano_search
+from kopano_search import plaintext
+from synthetic import Folder, Source, PR_SUBJECT, PR_BODY, PR_DISPLAY_TO
+
+"""
+benchmark for indexing and querying, using synthetic items instead of a kopano server.
+
+items are passed through FolderImporter (and hence the attachment converter and search plugin)
+as during initial indexing, one folder at a time. afterwards, random queries and suggestions are
+performed against the resulting index, in the same way as SearchWorker does.
+
+the python-kopano and search engine bindings need to be installed. the search.cfg given with '-c'
+is used for all settings except 'index_path' (by default, a temporary directory is used).
+
+example:
+
+python3 search_benchmark.py --items 10000 --attachments 0.1 --profile /tmp/search.prof
+
+"""
+
+SERVER = '00000000000000000000000000000000'
+STORE = '11111111111111111111111111111111'
+FIELDS = [[PR_SUBJECT], [PR_BODY], [PR_DISPLAY_TO], [PR_SUBJECT, PR_BODY, PR_DISPLAY_TO]]
+
+def percentiles(timings, pcts=(50, 90, 99)):
+    timings = sorted(timings) or [0.0]
+    return ['p%d=%.2fms' % (p, 1000 * timings[min(len(timings) * p // 100, len(timings) - 1)]) for p in pcts]
+
+def dirsize(path):
+    return sum(os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, files in os.walk(path) for f in files)
+
+def timed(func, timings):
+    def wrapper(*args, **kwargs):
+        t0 = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.append(time.time() - t0)
+    return wrapper
+
+def index(config, plugin, source, options, log):
+    converter = plaintext.Converter(
+        os.path.join(config['index_path'], 'attachments') if config['index_attachment_cache'] else None,
+        config['index_attachment_processes'], log)
+    per_folder = max(options.items // options.folders, 1)
+    docid = 1
+    try:
+        t0 = time.time()
+        for hierarchyid in range(1, options.folders + 1):
+            folder = Folder(hierarchyid)
+            importer = kopano_search.FolderImporter(SERVER, config, plugin, config['suggestions'], log, converter, False)
+            for item in source.items(STORE, folder, per_folder, docid):
+                importer.update(item, 0)
+            importer.commit()
+            plugin.flush(SERVER, STORE)
+            docid += per_folder
+        return docid - 1, time.time() - t0
+    finally:
+        converter.close()
+        plugin.close()
+
+def query(config, plugin, source, options, log):
+    search_timings, suggest_timings = [], []
+    for i in range(options.queries):
+        fields = FIELDS[i % len(FIELDS)]
+        terms = plugin.extract_terms(u' '.join(source.terms(1 + i % options.terms)))
+        fields_terms = [(fields, terms)]
+        t0 = time.time()
+        plugin.search(SERVER, STORE, [], fields_terms, kopano_search.query_string([], fields_terms), config['limit_results'], log)
+        search_timings.append(time.time() - t0)
+        if config['suggestions']:
+            t0 = time.time()
+            plugin.suggest(SERVER, STORE, terms, u' '.join(terms), log)
+            suggest_timings.append(time.time() - t0)
+    return search_timings, suggest_timings
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-c', '--config', dest='config_file', help='search.cfg to use (default: defaults)')
+    parser.add_option('--index-path', help='index into this (empty) directory and keep the result')
+    parser.add_option('--items', type='int', default=10000, help='number of items to index')
+    parser.add_option('--folders', type='int', default=10, help='number of folders to spread items over')
+    parser.add_option('--body-words', type='int', default=200, help='number of words per body')
+    parser.add_option('--vocabulary', type='int', default=50000, help='number of distinct words')
+    parser.add_option('--attachments', type='float', default=0.0, help='fraction of items with a (text) attachment')
+    parser.add_option('--queries', type='int', default=500, help='number of queries')
+    parser.add_option('--terms', type='int', default=2, help='maximum number of terms per query')
+    parser.add_option('--seed', type='int', default=0, help='random seed')
+    parser.add_option('--profile', help='dump cProfile statistics to this file')
+    parser.add_option('-v', '--verbose', action='store_true', help='show log output')
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.WARNING)
+    log = logging.getLogger('benchmark')
+
+    config = kopano.Config(kopano_search.CONFIG, filename=options.config_file or os.devnull)
+    index_path = options.index_path or tempfile.mkdtemp(prefix='kopano-search-bench-')
+    config.data['index_path'] = index_path
+    config.data['query_cache_size'] = 0 # measure queries, not the result cache
+    if options.attachments:
+        config.data['index_attachments'] = True
+
+    plugin = __import__('plugin_%s' % config['search_engine']).Plugin(index_path, log, config)
+    commit_timings = []
+    plugin.commit = timed(plugin.commit, commit_timings)
+    source = Source(options.vocabulary, options.body_words, options.attachments, options.seed)
+
+    profile = cProfile.Profile() if options.profile else None
+    if profile:
+        profile.enable()
+    try:
+        items, secs = index(config, plugin, source, options, log)
+        search_timings, suggest_timings = query(config, plugin, source, options, log)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(options.profile)
+        size = dirsize(plugin.dbpath(SERVER, STORE)) if config['search_engine'] == 'xapian' else 0
+        if not options.index_path:
+            shutil.rmtree(index_path)
+
+    print('indexed %d items in %.2f seconds (%.1f items/sec)' % (items, secs, items / (secs or 1e-6)))
+    print('commits: %d, %s' % (len(commit_timings), ' '.join(percentiles(commit_timings))))
+    print('queries: %d, %s' % (len(search_timings), ' '.join(percentiles(search_timings))))
+    if suggest_timings:
+        print('suggestions: %d, %s' % (len(suggest_timings), ' '.join(percentiles(suggest_timings))))
+    if size:
+        print('index size: %.1f MiB per 10k items' % (size * 10000.0 / items / 2**20))
+    if profile:
+        print('profile written to %s; top functions by cumulative time:' % options.profile)
+        pstats.Stats(options.profile).sort_stats('cumulative').print_stats(15)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: AGPL-3.0-only
+import random
+
+"""
+synthetic items, exposing the attributes of python-kopano items used for indexing
+(props, text, attachments, recipients..), so indexing can be measured without a server.
+
+words are drawn from a zipf-like distribution over a random vocabulary, so
+there are many rare terms (which is what makes wildcard expansion expensive).
+
+"""
+
+# mapi property ids
+PR_SUBJECT = 0x0037
+PR_SENDER_NAME = 0x0C1A
+PR_SENDER_EMAIL_ADDRESS = 0x0C1F
+PR_DISPLAY_TO = 0x0E04
+PR_BODY = 0x1000
+
+def vocabulary(size, rand):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [''.join(rand.choice(letters) for _ in range(rand.randint(2, 12))) for _ in range(size)]
+
+def text(vocab, nwords, rand):
+    return u' '.join(vocab[min(int(rand.paretovariate(1.0)) - 1, len(vocab) - 1)] for _ in range(nwords))
+
+class Prop:
+    def __init__(self, id_, value):
+        self.id_ = id_
+        self.value = value
+
+class Address:
+    def __init__(self, name, email):
+        self.name = name
+        self.email = email
+
+class Attachment:
+    def __init__(self, filename, data, mimetype='text/plain'):
+        self.filename = self.name = filename
+        self.mimetype = mimetype
+        self.data = data
+
+    def read(self):
+        return self.data
+
+    def __len__(self):
+        return len(self.data)
+
+class Folder:
+    def __init__(self, hierarchyid):
+        self.hierarchyid = hierarchyid
+        self.entryid = '%048X' % hierarchyid
+
+class Item:
+    def __init__(self, storeid, folder, docid, subject, text, sender, to, attachments=()):
+        self.storeid = storeid
+        self.folder = folder
+        self.docid = docid
+        self.entryid = '%048X' % docid
+        self.sourcekey = '%044X' % docid
+        self.subject = subject
+        self.text = text
+        self.sender = self.from_ = sender
+        self.to = to
+        self.cc = self.bcc = []
+        self._attachments = list(attachments)
+
+    def props(self):
+        yield Prop(PR_SUBJECT, self.subject)
+        yield Prop(PR_SENDER_NAME, self.sender.name)
+        yield Prop(PR_SENDER_EMAIL_ADDRESS, self.sender.email)
+        yield Prop(PR_DISPLAY_TO, u'; '.join(a.name for a in self.to))
+        yield Prop(PR_BODY, self.text)
+
+    def items(self): # embedded items
+        return []
+
+    def attachments(self):
+        return self._attachments
+
+class Source:
+    """ deterministic source of synthetic items """
+
+    def __init__(self, vocabulary_size=50000, body_words=200, attachment_ratio=0.0, seed=0):
+        self.rand = random.Random(seed)
+        self.vocab = vocabulary(vocabulary_size, self.rand)
+        self.body_words = body_words
+        self.attachment_ratio = attachment_ratio
+        self.people = [Address(text(self.vocab, 2, self.rand), u'user%d@example.com' % i) for i in range(100)]
+
+    def items(self, storeid, folder, count, first_docid=1):
+        rand = self.rand
+        for docid in range(first_docid, first_docid + count):
+            attachments = []
+            if rand.random() < self.attachment_ratio:
+                data = text(self.vocab, 5 * self.body_words, rand).encode('utf-8')
+                attachments.append(Attachment(u'attachment%d.txt' % docid, data))
+            yield Item(storeid, folder, docid,
+                subject=text(self.vocab, 8, rand),
+                text=text(self.vocab, self.body_words, rand),
+                sender=rand.choice(self.people),
+                to=rand.sample(self.people, rand.randint(1, 3)),
+                attachments=attachments,
+            )
+
+    def terms(self, count):
+        """ random query terms """
+        return [self.rand.choice(self.vocab)[:self.rand.randint(1, 6)] for _ in range(count)]
@@ -62,7 +62,7 @@ def main():
     else:  # otherwise, select all databases for compaction
         dbpaths = []
         for path in glob.glob(os.path.join(index_path, server.guid+'-*')):
-            if not path.endswith('.lock'):
+            if not path.endswith(('.lock', '.wait', '.shadow')): # skip stores being reindexed
                 dbpaths.append(path)
 
     # loop and compact
@@ -84,7 +84,9 @@ def main():
                 print('compact:', dbpath)
 
                 with open('%s.lock' % dbpath, 'w') as lockfile:  # do not index at the same time
-                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+                    with open('%s.wait' % dbpath, 'w') as waitfile: # make indexing processes release it
+                        fcntl.flock(waitfile.fileno(), fcntl.LOCK_SH)
+                        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
                     shutil.rmtree(dbpath + '.compact', ignore_errors=True)
                     subprocess.call(['xapian-compact', dbpath, dbpath + '.compact'])
                     # quickly swap in compacted database
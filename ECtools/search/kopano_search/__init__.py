@@ -4,9 +4,11 @@ from __future__ import print_function
 from .version import __version__
 
 import collections
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 import codecs
 import fcntl
+import heapq
 import os.path
 
 from multiprocessing import Queue, Value
@@ -16,6 +18,24 @@ import sys
 import bsddb3 as bsddb
 from queue import Empty
 
+from MAPI import MAPI_DEFERRED_ERRORS, PT_ERROR, PT_MV_UNICODE, MNID_STRING
+from MAPI.Defs import PROP_ID, PROP_TYPE, CHANGE_PROP_TYPE
+from MAPI.Struct import MAPINAMEID
+from MAPI.Tags import (
+    PR_ENTRYID, PR_SOURCE_KEY, PR_EC_HIERARCHYID, PR_MESSAGE_CLASS_W,
+    PR_HASATTACH, PR_SUBJECT_W, PR_BODY_W, PR_SENDER_NAME_W,
+    PR_SENDER_EMAIL_ADDRESS_W, PR_SENT_REPRESENTING_NAME_W,
+    PR_SENT_REPRESENTING_EMAIL_ADDRESS_W, PR_DISPLAY_TO_W, PR_DISPLAY_CC_W,
+    PR_DISPLAY_BCC_W, PR_SENDER_ADDRTYPE_W, PR_SENDER_ENTRYID,
+    PR_SENDER_SEARCH_KEY, PR_SENT_REPRESENTING_ADDRTYPE_W,
+    PR_SENT_REPRESENTING_ENTRYID, PR_SENT_REPRESENTING_SEARCH_KEY,
+    PR_NORMALIZED_SUBJECT_W, PR_SUBJECT_PREFIX_W, PR_CONVERSATION_TOPIC_W,
+    PR_RECEIVED_BY_NAME_W, PR_RECEIVED_BY_EMAIL_ADDRESS_W,
+    PR_RCVD_REPRESENTING_NAME_W, PR_RCVD_REPRESENTING_EMAIL_ADDRESS_W,
+    PR_INTERNET_MESSAGE_ID_W, PR_IN_REPLY_TO_ID_W, PR_INTERNET_REFERENCES_W,
+    PR_LAST_MODIFIER_NAME_W, PS_PUBLIC_STRINGS,
+)
+
 from kopano_search import plaintext
 import kopano
 from kopano import log_exc, Config
@@ -26,13 +46,19 @@ kopano-search v3 - a process-based indexer and query handler built on python-kop
 
 initial indexing is performed in parallel using N instances of class IndexWorker, fed with a queue containing folder-ids.
 
-incremental indexing is later performed in the same fashion. when there is no pending work, we
-check if there are reindex requests and handle one of these (again parallellized). so incremental syncing is currently paused
-during reindexing.
+incremental indexing is later performed in the same fashion, but pipelined: changed folders found using server-level ICS are
+deduplicated into a priority queue (class SyncPipeline), from which workers get new work as soon as they are done. the server
+state is only saved once all folders changed up to that state have been indexed. reindex requests are handled one at a time, in the
+background, by a separate set of IndexWorker instances. these build a 'shadow' index for the store, while incremental
+changes for the store are written to both indexes. as reindexing a folder may overwrite such changes with older data,
+changes since reindexing of the folder started are replayed into the shadow index afterwards. when done, the shadow
+index replaces the live index.
 
-search queries from outlook/webapp are dealt with by a single instance of class SearchWorker.
+search queries from outlook/webapp are dealt with by a single instance of class SearchWorker, which
+handles connections concurrently using a pool of threads.
 
 since ICS does not know for deletion changes which store they belong to, we remember ourselves using a berkeleydb file ("serverguid_mapping").
+writes to this file are buffered and flushed together with the index (see DbStore), and deletions are looked up in bulk.
 
 we also maintain folder and server ICS states in a berkeleydb file, for example so we can resume initial indexing ("serverguid_state").
 after initial indexing folder states are not updated anymore.
@@ -42,13 +68,35 @@ the used search engine is pluggable, but by default we use xapian (plugin_xapian
 a tricky bit is that outlook/exchange perform 'prefix' searches by default and we want to be compatible with this, so terms get an
 implicit '*' at the end. not every search engine may perform well for this, but we could make this configurable perhaps.
 
+for initial indexing, the 'index_bulk' option enables a faster path, where the indexable properties of simple
+mails are read in batches from the contents table, and only other items are opened (see FolderImporter.bulk_update).
+only the string properties mails normally have are indexed in this way, and for recipients, only their table is read.
+
 """
 
+# columns for bulk indexing: the (string) properties indexed as-is come last, as well as categories (see bulk_update)
+BULK_COLUMNS = [
+    PR_ENTRYID, PR_SOURCE_KEY, PR_EC_HIERARCHYID, PR_MESSAGE_CLASS_W, PR_HASATTACH,
+    PR_SENDER_ADDRTYPE_W, PR_SENDER_ENTRYID, PR_SENDER_SEARCH_KEY,
+    PR_SENT_REPRESENTING_ADDRTYPE_W, PR_SENT_REPRESENTING_ENTRYID, PR_SENT_REPRESENTING_SEARCH_KEY,
+    PR_SUBJECT_W, PR_NORMALIZED_SUBJECT_W, PR_SUBJECT_PREFIX_W, PR_CONVERSATION_TOPIC_W, PR_BODY_W,
+    PR_SENDER_NAME_W, PR_SENDER_EMAIL_ADDRESS_W, PR_SENT_REPRESENTING_NAME_W, PR_SENT_REPRESENTING_EMAIL_ADDRESS_W,
+    PR_RECEIVED_BY_NAME_W, PR_RECEIVED_BY_EMAIL_ADDRESS_W, PR_RCVD_REPRESENTING_NAME_W,
+    PR_RCVD_REPRESENTING_EMAIL_ADDRESS_W, PR_DISPLAY_TO_W, PR_DISPLAY_CC_W, PR_DISPLAY_BCC_W,
+    PR_INTERNET_MESSAGE_ID_W, PR_IN_REPLY_TO_ID_W, PR_INTERNET_REFERENCES_W, PR_LAST_MODIFIER_NAME_W,
+]
+BULK_TEXT_COLUMNS = BULK_COLUMNS[11:]
+NAMED_PROP_CATEGORY = MAPINAMEID(PS_PUBLIC_STRINGS, MNID_STRING, 'Keywords')
+TABLE_STRING_CAP = 255 # string values in tables are truncated to this length
+
 CONFIG = {
     'index_attachments': Config.boolean(default=False),
     'index_attachment_extension_filter': Config.ignore(),
     'index_attachment_mime_filter': Config.ignore(),
     'index_attachment_max_size': Config.size(default=2**24),
+    'index_attachment_cache': Config.boolean(default=True),
+    'index_attachment_cache_size': Config.size(default=2**30),
+    'index_attachment_processes': Config.integer(default=1),
     'index_attachment_parser': Config.ignore(),
     'index_attachment_parser_max_memory': Config.ignore(),
     'index_attachment_parser_max_cputime': Config.ignore(),
@@ -62,6 +110,12 @@ CONFIG = {
     'index_exclude_properties': Config.integer(multiple=True, base=16, default=[0x007D, 0x0064, 0x0C1E, 0x0075, 0x678E, 0x678F, 0x001A]),
     'index_path': Config.string(default='/var/lib/kopano/search/'),
     'index_processes': Config.integer(default=1),
+    'index_bulk': Config.boolean(default=False),
+    'index_prefix_terms': Config.boolean(default=False),
+    'index_prefix_min_length': Config.integer(default=1),
+    'index_prefix_max_length': Config.integer(default=8),
+    'reindex_processes': Config.integer(default=1),
+    'sync_poll_interval': Config.integer(default=5),
     'limit_results': Config.integer(default=1000),
     'run_as_user': Config.string(default="kopano"),
     'run_as_group': Config.string(default="kopano"),
@@ -73,6 +127,11 @@ CONFIG = {
     'ssl_private_key_file': Config.path(default=None, check=False), # XXX don't check when default=None?
     'ssl_certificate_file': Config.path(default=None, check=False),
     'term_cache_size': Config.size(default=64000000),
+    'index_db_pool_size': Config.integer(default=16),
+    'index_db_idle_timeout': Config.integer(default=10),
+    'query_threads': Config.integer(default=4),
+    'query_db_cache_size': Config.integer(default=64),
+    'query_cache_size': Config.size(default=2**24),
 }
 
 def db_get(db_path, key):
@@ -93,28 +152,101 @@ def db_put(db_path, key, value):
         with closing(bsddb.hashopen(db_path, 'c')) as db:
             db[key] = value
 
+class DbStore:
+    """ buffered access to a db file which is shared between processes
+
+    writes are buffered until flush(), which writes them in one go under
+    the external lock. lookups check buffered writes first, and can be done
+    in bulk using a single open of the db file. """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.pending = {}
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """ lookup given keys; returns dict with values for found keys """
+
+        result = {}
+        lookup = []
+        for key in keys:
+            if key in self.pending:
+                result[key] = self.pending[key]
+            else:
+                lookup.append(key)
+        if lookup:
+            with closing(bsddb.hashopen(self.db_path, 'c')) as db:
+                for key in lookup:
+                    value = db.get(key.encode('ascii') if not isinstance(key, bytes) else key)
+                    if value is not None:
+                        result[key] = value.decode('ascii')
+        return result
+
+    def put(self, key, value):
+        self.pending[key] = value
+
+    def flush(self):
+        """ write pending values """
+
+        if self.pending:
+            with open(self.db_path+'.lock', 'w') as lockfile:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+                with closing(bsddb.hashopen(self.db_path, 'c')) as db:
+                    for key, value in self.pending.items():
+                        db[key.encode('ascii') if not isinstance(key, bytes) else key] = value
+            self.pending = {}
+
+def query_string(folder_ids, fields_terms):
+    """ translate request to fielded query; plugin doesn't have to use this relatively standard query format """
+
+    restrictions = []
+    if folder_ids:
+        restrictions.append('('+' OR '.join(['folderid:%s' % f for f in folder_ids])+')')
+    for fields, terms in fields_terms:
+        if fields:
+            restrictions.append('('+' OR '.join('('+' AND '.join('mapi%d:%s*' % (f, term) for term in terms)+')' for f in fields)+')')
+        else:
+            restrictions.append('('+' AND '.join('%s*' % term for term in terms)+')')
+    return ' AND '.join(restrictions)
+
 class SearchWorker(kopano.Worker):
     """ process which handles search requests coming from outlook/webapp, according to our internal protocol """
 
     def main(self):
-        config, plugin = self.service.config, self.service.plugin
-        def response(conn, msg):
-            self.log.info('Response: %s', msg)
-            conn.sendall((msg + '\r\n').encode())
+        config = self.service.config
         s = kopano.server_socket(config['server_bind_name'], ssl_key=config['ssl_private_key_file'], ssl_cert=config['ssl_certificate_file'], log=self.log)
-        while True:
-            with log_exc(self.log):
-                conn, _ = s.accept()
+        with ThreadPoolExecutor(max_workers=max(config['query_threads'], 1)) as executor:
+            while True:
+                with log_exc(self.log):
+                    conn, _ = s.accept()
+                    executor.submit(self.handle, conn)
+
+    def response(self, conn, msg):
+        self.log.info('Response: %s', msg)
+        conn.sendall((msg + '\r\n').encode())
+
+    def handle(self, conn):
+        """ handle a single client connection (in a thread of the pool) """
+
+        config, plugin, response = self.service.config, self.service.plugin, self.response
+        t0 = time.time()
+        cmds = []
+        with log_exc(self.log):
+            try:
                 fields_terms = []
                 for data in conn.makefile():
                     data = data.strip()
                     self.log.info('Command: %s', data)
                     cmd, args = data.split()[0], data.split()[1:]
+                    cmds.append(cmd)
                     if cmd == 'PROPS':
                         response(conn, 'OK:'+' '.join(map(str, config['index_exclude_properties'])))
                         break
                     if cmd == 'SYNCRUN':  # wait for syncing to be up-to-date (only used in tests)
                         self.syncrun.value = time.time()
+                        self.wakeup.put(None)
                         while self.syncrun.value:
                             time.sleep(1)
                         response(conn, 'OK:')
@@ -141,76 +273,123 @@ class SearchWorker(kopano.Worker):
                                     suggestion = u''
                         response(conn, 'OK: '+suggestion)
                     elif cmd == 'QUERY':
-                        t0 = time.time()
-                        restrictions = []
-                        if folder_ids:
-                            restrictions.append('('+' OR '.join(['folderid:%s' % f for f in folder_ids])+')')
-                        for fields, terms in fields_terms:
-                            if fields:
-                                restrictions.append('('+' OR '.join('('+' AND '.join('mapi%d:%s*' % (f, term) for term in terms)+')' for f in fields)+')')
-                            else:
-                                restrictions.append('('+' AND '.join('%s*' % term for term in terms)+')')
-                        query = ' AND '.join(restrictions)  # plugin doesn't have to use this relatively standard query format
+                        t1 = time.time()
+                        query = query_string(folder_ids, fields_terms)
                         docids = plugin.search(server_guid, store_guid, folder_ids, fields_terms, query, config['limit_results'], self.log)
                         response(conn, 'OK: '+' '.join(map(str, docids)))
-                        self.log.info('found %d results in %.2f seconds', len(docids), time.time()-t0)
+                        self.log.info('found %d results in %.2f seconds', len(docids), time.time()-t1)
+                        break
+                    elif cmd == 'STATS':  # result cache statistics
+                        stats = plugin.stats()
+                        response(conn, 'OK: '+' '.join('%s=%s' % (k, stats[k]) for k in sorted(stats)))
                         break
                     elif cmd == 'REINDEX':
                         self.reindex_queue.put(args[0])
+                        self.wakeup.put(None)
                         response(conn, 'OK:')
                         self.log.info("queued store %s for reindexing", args[0])
                         break
                     else:
                         self.log.error("unknown command: %s", cmd)
                         break
+            finally:
                 conn.close()
+                self.log.info('request (%s) handled in %.3f seconds', ' '.join(cmds), time.time()-t0)
 
 class IndexWorker(kopano.Worker):
     """ process which gets folders from input queue and indexes them, putting the nr of changes in output queue """
 
+    shadow = False # reindexing into shadow index
+
     def main(self):
         config, server, plugin = self.service.config, self.server, self.service.plugin
         state_db = os.path.join(config['index_path'], server.guid+'_state')
+        cache_path = os.path.join(config['index_path'], 'attachments') if config['index_attachment_cache'] else None
+        self.converter = plaintext.Converter(cache_path, config['index_attachment_processes'], self.log,
+            config['index_attachment_cache_size'])
+        try:
+            while True:
+                self.index_folder(config, server, plugin, state_db)
+        finally:
+            plugin.close()
+            self.converter.close()
+
+    def next_job(self, plugin):
+        """ get next folder from input queue, closing idle databases while waiting """
+
         while True:
-            changes = 0
-            with log_exc(self.log):
-                (_, storeguid, folderid, reindex) = self.iqueue.get()
-                store = server.store(storeguid)
-                folder = kopano.Folder(store, folderid)
-                path = folder.path
-                if path and \
-                   (folder != store.outbox) and \
-                   (folder != store.junk or config['index_junk']) and \
-                   (folder != store.drafts or config['index_drafts']):
-                    suggestions = config['suggestions'] and folder != store.junk
-                    self.log.info('syncing folder: "%s" "%s"', store.name, path)
-                    importer = FolderImporter(server.guid, config, plugin, suggestions, self.log)
-                    state = db_get(state_db, folder.entryid) if not reindex else None
-                    if state:
-                        self.log.info('found previous folder sync state: %s', state)
-                    t0 = time.time()
-                    new_state = folder.sync(importer, state, log=self.log)
-                    if new_state != state:
-                        plugin.commit(suggestions)
+            try:
+                return self.iqueue.get(timeout=1)
+            except Empty:
+                plugin.flush_idle()
+
+    def index_folder(self, config, server, plugin, state_db):
+        """ index next folder from input queue, putting the folder and nr of changes in output queue """
+
+        changes = 0
+        job = replay_state = None
+        with log_exc(self.log):
+            job = self.next_job(plugin)
+            (_, storeguid, folderid, reindex) = job
+            store = server.store(storeguid)
+            folder = kopano.Folder(store, folderid)
+            path = folder.path
+            junk = store.is_special(folder, 'junk')
+            if path and \
+               not store.is_special(folder, 'outbox') and \
+               (not junk or config['index_junk']) and \
+               (not store.is_special(folder, 'drafts') or config['index_drafts']):
+                suggestions = config['suggestions'] and not junk
+                self.log.info('syncing folder: "%s" "%s"', store.name, path)
+                importer = FolderImporter(server.guid, config, plugin, suggestions, self.log, self.converter, self.shadow)
+                if reindex is True: # changes during reindexing are replayed afterwards (see check_reindex)
+                    state, replay_state = None, folder.state
+                elif reindex: # replay changes since reindexing started
+                    state = reindex
+                else:
+                    state = db_get(state_db, folder.entryid)
+                if state:
+                    self.log.info('found previous folder sync state: %s', state)
+                t0 = time.time()
+                bulk = state is None and config['index_bulk']
+                if bulk:
+                    state = replay_state or folder.state # changes during bulk indexing are picked up by ICS
+                    importer.bulk_update(folder)
+                new_state = folder.sync(importer, state, log=self.log)
+                if new_state != state or bulk:
+                    importer.commit()
+                    plugin.flush(server.guid, store.guid)
+                    if not self.shadow: # live index keeps its own state
                         db_put(state_db, folder.entryid, new_state)
                         self.log.info('saved folder sync state: %s', new_state)
-                        changes = importer.changes + importer.deletes
-                        self.log.info('syncing folder "%s" took %.2f seconds (%d changes, %d attachments)', path, time.time()-t0, changes, importer.attachments)
-            self.oqueue.put(changes)
+                    changes = importer.changes + importer.deletes
+                    self.log.info('syncing folder "%s" took %.2f seconds (%d changes, %d attachments)', path, time.time()-t0, changes, importer.attachments)
+                    for mode in ('bulk', 'full'):
+                        count, secs = importer.timings[mode]
+                        if count:
+                            self.log.info('%s path: %d items in %.2f seconds (~%.2f/sec)', mode, count, secs, count/(secs or 1e-6))
+        plugin.flush_idle()
+        result = (job[1:3] if job else None, changes)
+        if self.shadow:
+            result += (replay_state,)
+        self.oqueue.put(result)
 
 class FolderImporter:
     """ tracks changes for a given folder """
 
     def __init__(self, *args):
-        self.serverid, self.config, self.plugin, self.suggestions, self.log = args
+        self.serverid, self.config, self.plugin, self.suggestions, self.log, self.converter, self.shadow = args
         self.changes = self.deletes = self.attachments = 0
-        self.mapping_db = os.path.join(self.config['index_path'], self.serverid+'_mapping')
+        self.mapping = DbStore(os.path.join(self.config['index_path'], self.serverid+'_mapping'))
+        self.deleted = []
+        self.timings = {'bulk': [0, 0.0], 'full': [0, 0.0]} # items, seconds
         self.excludes = set(self.config['index_exclude_properties']+[0x1000, 0x1009, 0x1013, 0x678C, 0x6791]) # PR_BODY, PR_RTF_COMPRESSED, PR_HTML, PR_EC_IMAP_EMAIL, PR_EC_BODY_FILTERED
         self.term_cache_size = 0
 
     def update(self, item, flags):
         """ called for a new or changed item; get mapi properties, attachments and pass to indexing plugin """
 
+        t0 = time.time()
         with log_exc(self.log):
             self.changes += 1
             storeid, folderid, entryid, sourcekey, docid = item.storeid, item.folder.hierarchyid, item.entryid, item.sourcekey, item.docid
@@ -236,7 +415,7 @@ class FolderImporter:
                         self.log.debug('indexing attachment (filename=%s, size=%d, mimetag=%s)',
                             attachment.filename, len(attachment), attachment.mimetype)
                         self.attachments += 1
-                        attach_text.append(plaintext.get(attachment, mimetype=attachment.mimetype, log=self.log))
+                        attach_text.append(self.converter.get(attachment, mimetype=attachment.mimetype))
                     attach_text.append(attachment.filename or u'')
 
                 doc['mapi4096'] += u' ' + subitem.text + u' ' + u' '.join(attach_text)  # PR_BODY
@@ -246,45 +425,188 @@ class FolderImporter:
                 doc['mapi3586'] += u' ' + u' '.join([a.name + u' ' + a.email for a in subitem.bcc])  # PR_DISPLAY_BCC
 
             doc['data'] = 'subject: %s\n' % item.subject
-            db_put(self.mapping_db, item.sourcekey, '%s %s' % (storeid, item.folder.entryid))  # ICS doesn't remember which store a change belongs to..
-            self.plugin.update(doc)
-            self.term_cache_size += sum(len(v) for k, v in doc.items() if k.startswith('mapi'))
-            if (8*self.term_cache_size) > self.config['term_cache_size']:
-                self.plugin.commit(self.suggestions)
-                self.term_cache_size = 0
+            self.add(doc, item.folder.entryid)
+        self.timings['full'][0] += 1
+        self.timings['full'][1] += time.time()-t0
+
+    def add(self, doc, folder_entryid):
+        """ pass document to indexing plugin, committing when the term cache is full """
+
+        self.mapping.put(doc['sourcekey'], '%s %s' % (doc['storeid'], folder_entryid))  # ICS doesn't remember which store a change belongs to..
+        self.plugin.update(doc)
+        self.term_cache_size += sum(len(v) for k, v in doc.items() if k.startswith('mapi'))
+        if (8*self.term_cache_size) > self.config['term_cache_size']:
+            self.commit()
+
+    def bulk_update(self, folder, batch_size=100):
+        """ index all items in folder, reading indexable properties in batches from the contents table
+
+        for recipients, only the recipient table is read. items that have attachments, are not simple
+        mails or have truncated values are opened instead """
+
+        store = folder.store
+        storeid, folderid, folder_entryid = store.guid, folder.hierarchyid, folder.entryid
+        text_columns = list(BULK_TEXT_COLUMNS)
+        category_proptag = folder.mapiobj.GetIDsFromNames([NAMED_PROP_CATEGORY], 0)[0]
+        if PROP_TYPE(category_proptag) != PT_ERROR:
+            text_columns.append(CHANGE_PROP_TYPE(category_proptag, PT_MV_UNICODE))
+        columns = BULK_COLUMNS[:-len(BULK_TEXT_COLUMNS)] + text_columns
+        table = folder.mapiobj.GetContentsTable(MAPI_DEFERRED_ERRORS)
+        table.SetColumns(columns, 0)
+        while True:
+            t0 = time.time()
+            rows = table.QueryRows(batch_size, 0)
+            if not rows:
+                break
+            fallback = []
+            count = 0
+            for row in rows:
+                with log_exc(self.log):
+                    values = dict((c.ulPropTag, c.Value) for c in row if PROP_TYPE(c.ulPropTag) != PT_ERROR)
+                    texts = [values.get(proptag, u'') for proptag in text_columns]
+                    texts = [u' '.join(text) if isinstance(text, list) else text for text in texts] # categories
+                    if (values.get(PR_HASATTACH) or
+                        not values.get(PR_MESSAGE_CLASS_W, u'').startswith('IPM.Note') or
+                        [text for text in texts if len(text) >= TABLE_STRING_CAP]):
+                        fallback.append(values)
+                        continue
+
+                    sourcekey = kopano.benc(values[PR_SOURCE_KEY])
+                    self.changes += 1
+                    count += 1
+                    doc = collections.defaultdict(str)
+                    doc.update({'serverid': self.serverid, 'storeid': storeid, 'folderid': folderid, 'docid': values[PR_EC_HIERARCHYID], 'sourcekey': sourcekey})
+                    for proptag, text in zip(text_columns, texts):
+                        if text and PROP_ID(proptag) not in self.excludes:
+                            doc['mapi%d' % PROP_ID(proptag)] += u' ' + text
+                    doc['mapi4096'] += u' ' + values.get(PR_BODY_W, u'')  # PR_BODY
+                    # resolve SMTP addresses as FolderImporter.update does
+                    sender, from_ = [kopano.Address(store.server, *[values.get(proptag) for proptag in proptags]) for proptags in (
+                        (PR_SENDER_ADDRTYPE_W, PR_SENDER_NAME_W, PR_SENDER_EMAIL_ADDRESS_W, PR_SENDER_ENTRYID, PR_SENDER_SEARCH_KEY),
+                        (PR_SENT_REPRESENTING_ADDRTYPE_W, PR_SENT_REPRESENTING_NAME_W, PR_SENT_REPRESENTING_EMAIL_ADDRESS_W,
+                         PR_SENT_REPRESENTING_ENTRYID, PR_SENT_REPRESENTING_SEARCH_KEY))]
+                    doc['mapi3098'] += u' ' + u' '.join([sender.name, sender.email, from_.name, from_.email])  # PR_SENDER_NAME
+                    if values.get(PR_DISPLAY_TO_W) or values.get(PR_DISPLAY_CC_W) or values.get(PR_DISPLAY_BCC_W):
+                        item = folder.item(entryid=kopano.benc(values[PR_ENTRYID]))
+                        doc['mapi3588'] += u' ' + u' '.join([a.name + u' ' + a.email for a in item.to])  # PR_DISPLAY_TO
+                        doc['mapi3587'] += u' ' + u' '.join([a.name + u' ' + a.email for a in item.cc])  # PR_DISPLAY_CC
+                        doc['mapi3586'] += u' ' + u' '.join([a.name + u' ' + a.email for a in item.bcc])  # PR_DISPLAY_BCC
+                    doc['data'] = 'subject: %s\n' % values.get(PR_SUBJECT_W, u'')
+                    self.add(doc, folder_entryid)
+            self.timings['bulk'][0] += count
+            self.timings['bulk'][1] += time.time()-t0
+
+            for values in fallback:
+                with log_exc(self.log):
+                    item = folder.item(entryid=kopano.benc(values[PR_ENTRYID]))
+                    item.storeid, item.docid = storeid, values[PR_EC_HIERARCHYID]
+                    self.update(item, 0)
 
     def delete(self, item, flags):
-        """ for a deleted item, determine store and ask indexing plugin to delete """
+        """ for a deleted item, remember sourcekey; store is determined in bulk during commit """
 
         with log_exc(self.log):
             self.deletes += 1
-            ids = db_get(self.mapping_db, item.sourcekey)
+            self.deleted.append(item.sourcekey)
+
+    def commit(self):
+        """ pass deletes to indexing plugin, commit it and write store/folder mapping for updates """
+
+        mapping = self.mapping.get_many(self.deleted)
+        for sourcekey in self.deleted:
+            ids = mapping.get(sourcekey)
             if ids:  # when a 'new' item is deleted right away (spooler?), the 'update' function may not have been called
                 storeid, folderid = ids.split()
-                doc = {'serverid': self.serverid, 'storeid': storeid, 'sourcekey': item.sourcekey}
-                self.log.debug('store %s: deleted document with sourcekey %s', doc['storeid'], item.sourcekey)
+                doc = {'serverid': self.serverid, 'storeid': storeid, 'sourcekey': sourcekey}
+                self.log.debug('store %s: deleted document with sourcekey %s', doc['storeid'], sourcekey)
                 self.plugin.delete(doc)
+        self.deleted = []
+        self.plugin.commit(self.suggestions, shadow=self.shadow)
+        self.mapping.flush()
+        self.term_cache_size = 0
 
 class ServerImporter:
-    """ tracks changes for a server node; queues encountered folders for updating """  # XXX improve ICS to track changed folders?
+    """ tracks changes for a server node; collects encountered folders for updating """  # XXX improve ICS to track changed folders?
 
-    def __init__(self, serverid, config, iqueue, log):
-        self.mapping_db = os.path.join(config['index_path'], serverid+'_mapping')
-        self.iqueue = iqueue
-        self.queued = set() # sync each folder at most once
+    def __init__(self, serverid, config, log):
+        self.mapping = DbStore(os.path.join(config['index_path'], serverid+'_mapping'))
+        self.folders = collections.defaultdict(int) # (store, folder) -> nr of changes
+        self.deleted = []
 
     def update(self, item, flags):
-        self.queue((0, item.storeid, item.folder.entryid))
+        self.folders[(item.storeid, item.folder.entryid)] += 1
 
     def delete(self, item, flags):
-        ids = db_get(self.mapping_db, item.sourcekey)
-        if ids:
-            self.queue((0,) + tuple(ids.split()))
+        self.deleted.append(item.sourcekey)
+
+    def flush(self):
+        """ determine folders for deleted items in bulk, and queue them """
+
+        mapping = self.mapping.get_many(self.deleted)
+        for sourcekey in self.deleted:
+            ids = mapping.get(sourcekey)
+            if ids:
+                self.folders[tuple(ids.split())] += 1
+        self.deleted = []
+
+class SyncPipeline:
+    """ deduplicated priority queue of changed folders, feeding at most one job per worker at a time
 
-    def queue(self, folder):
-        if folder not in self.queued:
-            self.iqueue.put(folder+(False,))
-            self.queued.add(folder)
+    each server-level sync with changes starts a new 'round'. a folder is up-to-date for a round when
+    it was synced by a job which was queued after that round. so the server state of a round can be
+    saved, once every folder changed up to and including that round is up-to-date for it. """
+
+    def __init__(self, iqueue, slots):
+        self.iqueue = iqueue
+        self.slots = max(slots, 1)
+        self.round = 0
+        self.states = {} # round -> server state
+        self.outstanding = {} # folder -> last round changed
+        self.priority = {} # folder -> (first round changed, -nr of changes)
+        self.running = {} # folder -> round when queued
+        self.changes = 0
+
+    def add(self, folders, state):
+        """ add changed folders for new server state """
+
+        self.round += 1
+        self.states[self.round] = state
+        for folder, count in folders.items():
+            first, neg_count = self.priority.get(folder, (self.round, 0))
+            self.priority[folder] = (first, neg_count-count)
+            self.outstanding[folder] = self.round
+
+    def dispatch(self):
+        """ queue highest priority folders for idle workers; the same folder is never synced in parallel """
+
+        free = self.slots - len(self.running)
+        if free > 0:
+            waiting = (f for f in self.outstanding if f not in self.running)
+            for folder in heapq.nsmallest(free, waiting, key=lambda f: self.priority[f]):
+                self.running[folder] = self.round
+                self.iqueue.put((0,) + folder + (False,))
+
+    def done(self, folder, changes):
+        """ process result from worker """
+
+        self.changes += changes
+        round_ = self.running.pop(folder, None)
+        if round_ is not None and self.outstanding.get(folder, 0) <= round_:
+            del self.outstanding[folder]
+            del self.priority[folder]
+
+    def checkpoint(self):
+        """ return latest server state for which all changes have been indexed, if any """
+
+        safe = min(self.outstanding.values())-1 if self.outstanding else self.round
+        state = self.states.get(safe)
+        for round_ in [r for r in self.states if r < safe]:
+            del self.states[round_]
+        return state
+
+    @property
+    def idle(self):
+        return not (self.outstanding or self.running)
 
 class Service(kopano.Service):
     """ main search process """
@@ -302,10 +624,12 @@ class Service(kopano.Service):
                 self.log.error("Unable to create directory '%s': permission denied", index_path)
                 sys.exit(1)
         self.state_db = os.path.join(index_path, self.server.guid+'_state')
-        self.plugin = __import__('plugin_%s' % self.config['search_engine']).Plugin(index_path, self.log)
+        self.plugin = __import__('plugin_%s' % self.config['search_engine']).Plugin(index_path, self.log, self.config)
         self.iqueue, self.oqueue = Queue(), Queue()
         self.index_processes = self.config['index_processes']
         workers = [IndexWorker(self, 'index%d'%i, nr=i, iqueue=self.iqueue, oqueue=self.oqueue) for i in range(self.index_processes)]
+        self.rqueue, self.roqueue = Queue(), Queue()
+        workers += [IndexWorker(self, 'reindex%d'%i, nr=i, iqueue=self.rqueue, oqueue=self.roqueue, shadow=True) for i in range(self.config['reindex_processes'])]
         for worker in workers:
             worker.start()
         try:
@@ -324,7 +648,7 @@ class Service(kopano.Service):
             db_put(self.state_db, 'SERVER', self.state)
             self.log.info('saved server sync state = %s', self.state)
         self.syncrun = Value('d', 0)
-        SearchWorker(self, 'query', reindex_queue=self.reindex_queue, syncrun=self.syncrun).start()
+        SearchWorker(self, 'query', reindex_queue=self.reindex_queue, syncrun=self.syncrun, wakeup=self.oqueue).start()
         self.log.info('starting incremental sync')
         self.incremental_sync()
 
@@ -337,37 +661,94 @@ class Service(kopano.Service):
         itemcount = sum(f[0] for f in folders)
         self.log.info('queued %d folders (~%d changes) for parallel indexing (%s processes)', len(folders), itemcount, self.index_processes)
         t0 = time.time()
-        changes = sum([self.oqueue.get() for i in range(len(folders))])  # blocking
+        changes = sum([self.oqueue.get()[1] for i in range(len(folders))])  # blocking
         self.log.info('queue processed in %.2f seconds (%d changes, ~%.2f/sec)', time.time()-t0, changes, changes/(time.time()-t0))
 
+    def check_reindex(self):
+        """ start handling next reindex request in the background, or check if the current one is done """
+
+        if self.reindexing is None:
+            try:
+                storeid = self.reindex_queue.get(block=False)
+            except Empty:
+                return
+            store = self.server.store(storeid)
+            self.log.info('handling reindex request for "%s"', store.name)
+            self.plugin.start_reindex(self.server.guid, store.guid)
+            folders = [(f.count, store.guid, f.entryid, True) for f in store.folders()]
+            for f in sorted(folders, reverse=True):
+                self.rqueue.put(f)
+            self.log.info('queued %d folders (~%d changes) for reindexing (%d processes)', len(folders), sum(f[0] for f in folders), self.config['reindex_processes'])
+            self.reindexing = [store, len(folders), time.time(), 0]
+
+        store, pending, t0, changes = self.reindexing
+        while pending:
+            try:
+                folder, changes2, replay_state = self.roqueue.get(block=False)
+            except Empty:
+                break
+            changes += changes2
+            pending -= 1
+            # incremental changes written to the shadow index during reindexing of the folder
+            # may have been overwritten with older data, so replay them
+            if replay_state:
+                self.rqueue.put((0, folder[0], folder[1], replay_state))
+                pending += 1
+        self.reindexing[1], self.reindexing[3] = pending, changes
+        if not pending:
+            self.plugin.finish_reindex(self.server.guid, store.guid)
+            self.log.info('reindexing "%s" took %.2f seconds (%d changes)', store.name, time.time()-t0, changes)
+            self.reindexing = None
+
     def incremental_sync(self):
-        """ process changes in real-time (not yet parallelized); if no pending changes handle reindex requests """
+        """ process changes in real-time, keeping workers busy; handle reindex requests in the background
+
+        we wake up when a worker is done or a client request arrives, and otherwise poll for changes. """
 
+        self.reindexing = None
+        pipeline = SyncPipeline(self.iqueue, self.index_processes)
+        state, next_sync, t_sync = self.state, 0, 0
         while True:
             with log_exc(self.log):
-                try:
-                    storeid = self.reindex_queue.get(block=False)
-                    store = self.server.store(storeid)
-                    self.log.info('handling reindex request for "%s"', store.name)
-                    self.plugin.reindex(self.server.guid, store.guid)
-                    self.initial_sync([store], reindex=True)
-                except Empty:
-                    pass
-                importer = ServerImporter(self.server.guid, self.config, self.iqueue, self.log)
-                t0 = time.time()
-                new_state = self.server.sync(importer, self.state, log=self.log)
-                if new_state != self.state:
-                    changes = sum([self.oqueue.get() for i in range(len(importer.queued))])  # blocking
-                    for f in importer.queued:
-                        self.iqueue.put(f+(False,))  # make sure folders are at least synced to new_state
-                    changes += sum([self.oqueue.get() for i in range(len(importer.queued))])  # blocking
-                    self.log.info('queue processed in %.2f seconds (%d changes, ~%.2f/sec)', time.time()-t0, changes, changes/(time.time()-t0))
-                    self.state = new_state
+                self.check_reindex()
+
+                # check for new changes
+                if time.time() >= next_sync:
+                    importer = ServerImporter(self.server.guid, self.config, self.log)
+                    t_sync = time.time()
+                    new_state = self.server.sync(importer, state, log=self.log)
+                    importer.flush()
+                    if new_state != state:
+                        pipeline.add(importer.folders, new_state)
+                        self.log.info('found changes in %d folders', len(importer.folders))
+                        state = new_state
+                        next_sync = t_sync + 1 # more changes may be coming
+                    else:
+                        next_sync = t_sync + self.config['sync_poll_interval']
+
+                # keep workers busy and save server state if possible
+                pipeline.dispatch()
+                checkpoint = pipeline.checkpoint()
+                if checkpoint and checkpoint != self.state:
+                    self.log.info('processed %d changes', pipeline.changes)
+                    pipeline.changes = 0
+                    self.state = checkpoint
                     db_put(self.state_db, 'SERVER', self.state)
                     self.log.info('saved server sync state = %s', self.state)
-                if t0 > self.syncrun.value+1:
+                if pipeline.idle and t_sync > self.syncrun.value+1:
                     self.syncrun.value = 0
-            time.sleep(5)
+
+            # wait for worker result or wakeup from client request
+            try:
+                result = self.oqueue.get(timeout=max(next_sync-time.time(), 0))
+                while True:
+                    if result is not None:
+                        pipeline.done(*result)
+                    else:
+                        next_sync = 0
+                    result = self.oqueue.get(block=False)
+            except Empty:
+                pass
 
     def reindex(self):
         """ pass usernames/store-ids given on command-line to running search process """
@@ -1,11 +1,21 @@
 #!/usr/bin/python3
 # SPDX-License-Identifier: AGPL-3.0-only
+from html.parser import HTMLParser
+import hashlib
+import io
 import mimetypes
 import os.path
+import pickle
 import resource
 import shutil
+import struct
 import subprocess
+import sys
 import tempfile
+import threading
+import xml.etree.ElementTree as ET
+import zipfile
+import zlib
 
 # distros ship incompatible magic.py projects!
 import magic
@@ -26,12 +36,26 @@ convert attachment to plaint text using external commands, as given below
 basically the type of an attachment is determined first by its filename extension,
 then stored mimetype and if neither are present by using python-magic.
 
+simple formats (plain text, html, xml and zipped xml such as ODF/OOXML) are converted
+in-process. external commands are run by a small pool of long-running helper processes
+(see ConverterPool), so the indexing process itself does not have to fork for each
+attachment. the helpers apply the resource limits below to each command.
+
+conversion results are cached on disk (see Converter), keyed by the SHA-256 of the
+attachment data, so the same attachment sent to many recipients is converted only once.
+the cache is versioned by CONVERTER_VERSION, which should be increased when conversion
+output changes. failed conversions are not cached, so they are retried next time. the
+cache is kept below a configured size by removing the least recently used results.
+
 
 """
 
 MAX_TIME = 10 # time limit: 10 seconds # XXX get from cfg
 MAX_MEMORY = 256*10**6 # max mem usage: 256 MB # XXX get from cfg
 
+CONVERTER_VERSION = 1
+CACHE_PRUNE_TARGET = 0.9 # prune cache to this fraction of its maximum size
+
 CONVERT_ODF = 'unzip -p %(file)s content.xml | %(xmltotext)s -'
 CONVERT_OOXML = 'cd %(dir)s; unzip -o -qq %(file)s; for i in $(find . -name \*.xml); do %(xmltotext)s $i; done'
 
@@ -61,10 +85,102 @@ def setlimits(): # pragma: no cover
     resource.setrlimit(resource.RLIMIT_DATA, (MAX_MEMORY, MAX_MEMORY))
     resource.setrlimit(resource.RLIMIT_CPU, (MAX_TIME, MAX_TIME))
 
+def _xml_text(data):
+    """ all text and attribute values, as done by xmltotext.xslt """
+
+    words = []
+    for elem in ET.fromstring(data).iter():
+        words.extend(elem.attrib.values())
+        if elem.text:
+            words.append(elem.text)
+        if elem.tail:
+            words.append(elem.tail)
+    return u' '.join(words)
+
+def _zip_xml_text(data, names):
+    """ text from xml files in zip archive; abort if it decompresses to too much data """
+
+    result = []
+    total = 0
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        for info in z.infolist():
+            if names(info.filename):
+                total += info.file_size
+                if total > MAX_MEMORY:
+                    raise ValueError('zip file too large')
+                result.append(_xml_text(z.read(info)))
+    return u' '.join(result)
+
+class _HTMLText(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.result = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self.skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.result.append(data)
+
+def _decode(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', 'ignore')
+
+def convert_txt(data):
+    return _decode(data)
+
+def convert_html(data):
+    parser = _HTMLText()
+    parser.feed(_decode(data))
+    parser.close()
+    return u' '.join(parser.result)
+
+def convert_xml(data):
+    return _xml_text(data)
+
+def convert_odf(data):
+    return _zip_xml_text(data, lambda name: name == 'content.xml')
+
+def convert_ooxml(data):
+    return _zip_xml_text(data, lambda name: name.endswith('.xml'))
+
+# in-process converters, tried before the external command
+FUNC = {
+    'txt': convert_txt, 'text/plain': convert_txt,
+    'html': convert_html, 'htm': convert_html, 'text/html': convert_html,
+    'xml': convert_xml, 'application/xml': convert_xml, 'text/xml': convert_xml,
+}
+for (X, C) in DB:
+    for Y in X.split(';'):
+        if C == CONVERT_ODF:
+            FUNC[Y] = convert_odf
+        elif C == CONVERT_OOXML:
+            FUNC[Y] = convert_ooxml
+
 def convert(cmd, data, log):
     """ save data to tempfile and call external command on it; abort if it uses too much memory/time """
 
-    result = []
+    plain, err, returncode = _convert(cmd, data)
+    _log_result(data, plain, err, returncode, log)
+    return plain
+
+def _log_result(data, plain, err, returncode, log):
+    if err:
+        log.warning('output on stderr:\n'+err[:1024]+'..')
+    if returncode != 0:
+        log.warning('return code = %d' % returncode)
+    log.debug('converted %d bytes to %d chars of plaintext' % (len(data), len(plain)))
+
+def _convert(cmd, data):
     tmpdir = tempfile.mkdtemp()
     try:
         tmpfile = '%s/attachment' % tmpdir
@@ -76,20 +192,209 @@ def convert(cmd, data, log):
             'file': tmpfile,
             'xmltotext': 'xsltproc '+os.path.join(os.path.dirname(os.path.realpath(__file__)), 'xmltotext.xslt')
         }
-        log.debug("executing command: '%s'" % cmd)
         p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=setlimits, env={"HOME": tmpdir})
         out, err = p.communicate()
-        if err:
-            err = err.decode('utf-8', 'ignore')
-            log.warning('output on stderr:\n'+err[:1024]+'..')
-        if p.returncode != 0:
-            log.warning('return code = %d' % p.returncode)
         plain = out.decode('utf-8', 'ignore') # XXX warning instead of ignore
-        log.debug('converted %d bytes to %d chars of plaintext' % (len(data), len(plain)))
-        return plain
+        return plain, err.decode('utf-8', 'ignore'), p.returncode
     finally:
         shutil.rmtree(tmpdir)
 
+def _read_msg(f):
+    header = f.read(4)
+    if len(header) < 4:
+        raise EOFError
+    size = struct.unpack('!I', header)[0]
+    return pickle.loads(f.read(size))
+
+def _write_msg(f, msg):
+    data = pickle.dumps(msg, protocol=2)
+    f.write(struct.pack('!I', len(data)) + data)
+    f.flush()
+
+def helper_main(): # pragma: no cover
+    """ helper process: convert (cmd, data) requests from stdin, until it is closed """
+
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    while True:
+        try:
+            cmd, data = _read_msg(stdin)
+        except EOFError:
+            break
+        try:
+            result = _convert(cmd, data)
+        except Exception as e:
+            result = (u'', u'conversion failed: %s' % e, -1)
+        _write_msg(stdout, result)
+
+class ConverterPool:
+    """ bounded pool of long-running helper processes running external commands """
+
+    def __init__(self, size=1):
+        self.size = max(size, 1)
+        self.lock = threading.Condition()
+        self.idle = []
+        self.count = 0
+
+    def _spawn(self):
+        return subprocess.Popen([sys.executable, os.path.realpath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+
+    def _acquire(self):
+        with self.lock:
+            while not self.idle and self.count >= self.size:
+                self.lock.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.count += 1
+        try:
+            return self._spawn()
+        except:
+            self._release(None)
+            raise
+
+    def _release(self, helper):
+        with self.lock:
+            if helper is None:
+                self.count -= 1
+            else:
+                self.idle.append(helper)
+            self.lock.notify()
+
+    def convert(self, cmd, data):
+        """ convert data using external command in a helper process; returns (plain, err, returncode) """
+
+        for attempt in range(2): # helper may have died in the meantime
+            helper = self._acquire()
+            try:
+                _write_msg(helper.stdin, (cmd, data))
+                result = _read_msg(helper.stdout)
+            except (EOFError, IOError, OSError):
+                helper.kill()
+                helper.wait()
+                self._release(None)
+                continue
+            self._release(helper)
+            return result
+        return u'', u'helper process failed', -1
+
+    def close(self):
+        with self.lock:
+            for helper in self.idle:
+                helper.stdin.close()
+                helper.wait()
+            self.count -= len(self.idle)
+            self.idle = []
+
+class Converter:
+    """ convert attachments to plaintext, caching results on disk """
+
+    def __init__(self, cache_path=None, processes=1, log=None, cache_size=0):
+        self.cache_root = cache_path
+        self.cache_path = os.path.join(cache_path, str(CONVERTER_VERSION)) if cache_path else None
+        self.cache_size = cache_size
+        self.stored = cache_size # bytes stored since last prune; prune on first store
+        self.pool = ConverterPool(processes)
+        self.log = log
+        self.hits = self.misses = 0
+
+    def _cache_file(self, key, data):
+        digest = hashlib.sha256(data).hexdigest()
+        return os.path.join(self.cache_path, digest[:2], '%s.%s' % (digest, key.replace('/', '_')))
+
+    def convert(self, key, data):
+        """ convert data of given type (extension or mimetype) """
+
+        cache_file = None
+        if self.cache_path:
+            cache_file = self._cache_file(key, data)
+            try:
+                with open(cache_file, 'rb') as f:
+                    plain = zlib.decompress(f.read()).decode('utf-8')
+                os.utime(cache_file) # recently used, see prune
+                self.hits += 1
+                self.log.debug('using cached plaintext for %d bytes (%s)' % (len(data), key))
+                return plain
+            except (IOError, OSError, zlib.error):
+                self.misses += 1
+
+        plain, returncode = None, 0
+        if key in FUNC:
+            try:
+                plain = FUNC[key](data)
+                _log_result(data, plain, None, 0, self.log)
+            except Exception as e:
+                self.log.debug('in-process conversion failed (%s), using external command' % e)
+        if plain is None:
+            if key not in CMD:
+                return u''
+            self.log.debug("executing command: '%s'" % CMD[key])
+            plain, err, returncode = self.pool.convert(CMD[key], data)
+            _log_result(data, plain, err, returncode, self.log)
+
+        if cache_file and returncode == 0: # retry failed conversions next time
+            self._store(cache_file, plain)
+        return plain
+
+    def _store(self, cache_file, plain):
+        try:
+            if not os.path.isdir(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+            tmpfile = '%s.%d.tmp' % (cache_file, os.getpid())
+            data = zlib.compress(plain.encode('utf-8'))
+            with open(tmpfile, 'wb') as f:
+                f.write(data)
+            os.rename(tmpfile, cache_file) # atomic, as other processes may read it
+        except (IOError, OSError) as e:
+            self.log.warning('could not store plaintext in cache: %s' % e)
+            return
+        if self.cache_size:
+            self.stored += len(data)
+            if self.stored >= self.cache_size * (1 - CACHE_PRUNE_TARGET):
+                self.prune()
+
+    def prune(self):
+        """ remove least recently used results (including those of older converter versions),
+            until the cache is below CACHE_PRUNE_TARGET of its maximum size """
+
+        self.stored = 0
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.cache_root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError: # removed by other process
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        if total <= self.cache_size:
+            return
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.cache_size * CACHE_PRUNE_TARGET:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        self.log.info('pruned %d converted attachments from cache' % removed)
+
+    def get(self, f, mimetype=None):
+        """ convert file-like object to plaintext, only reading data if needed; check DB with determined extension and mimetype """
+
+        filename = f.name or u''
+        ext, mimetype, data = ext_mime_data(f, filename, mimetype, self.log)
+        for key in ext, mimetype:
+            if key in CMD or key in FUNC:
+                return self.convert(key, data or f.read())
+        self.log.debug('unknown or unsupported filetype, skipping')
+        return u''
+
+    def close(self):
+        self.pool.close()
+
 def ext_mime_data(f, filename, mimetype, log):
     """ First, use filename extension to determine type, if that fails, the stored mimetype, and finally libmagic. """
 
@@ -117,7 +422,17 @@ def get(f, mimetype=None, log=None):
     filename = f.name or u''
     ext, mimetype, data = ext_mime_data(f, filename, mimetype, log)
     for key in ext, mimetype:
+        if key in FUNC:
+            data = data or f.read()
+            try:
+                return FUNC[key](data)
+            except Exception as e:
+                log.debug('in-process conversion failed (%s), using external command' % e)
         if key in CMD:
+            log.debug("executing command: '%s'" % CMD[key])
             return convert(CMD[key], data or f.read(), log)
     log.debug('unknown or unsupported filetype, skipping')
     return u''
+
+if __name__ == '__main__':
+    helper_main() # pragma: no cover
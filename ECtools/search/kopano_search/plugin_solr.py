@@ -10,7 +10,7 @@ note how simple this is compared to the xapian plugin.
 """
 
 class Plugin:
-    def __init__(self, index_path, log):
+    def __init__(self, index_path, log, config=None):
         self.log = log
         self.solr = pysolr.Solr(index_path)
         self.data = []
@@ -32,7 +32,7 @@ class Plugin:
         self.commit()
         self.solr.delete(q='sourcekey:%s' % doc['sourcekey'])
 
-    def commit(self):
+    def commit(self, suggestions=None, shadow=False):
         if self.data:
             try:
                 self.solr.add(self.data)
@@ -40,5 +40,23 @@ class Plugin:
                 self.data = []
                 self.charcount = 0
 
+    def stats(self):
+        return {}
+
+    def flush(self, server_guid=None, store_guid=None):
+        pass
+
+    def flush_idle(self):
+        pass
+
+    def close(self):
+        pass
+
+    def start_reindex(self, server_guid, store_guid):
+        pass
+
+    def finish_reindex(self, server_guid, store_guid):
+        pass
+
     def reindex(self, server_guid, store_guid):
         pass
@@ -1,8 +1,13 @@
 # SPDX-License-Identifier: AGPL-3.0-only
-from contextlib import closing
+import collections
+from contextlib import contextmanager
+import ctypes
+import ctypes.util
 import fcntl
 import os.path
+import platform
 import shutil
+import threading
 import time
 
 import xapian
@@ -19,35 +24,351 @@ http://xapian.org/docs/apidoc/html/classXapian_1_1TermGenerator.html
 things would be a lot simpler if we stored everything in 1 xapian database,
 but in the old situation we have one database per store which is nice.
 
+writable databases are kept open across commits in a small per-process pool,
+as opening/closing them for every folder is expensive. a pooled database keeps
+holding the external '.lock' file. processes blocking on this lock (other
+indexing processes, reindexing, kopano-search-xapian-compact.py) hold a shared
+lock on the '.wait' file meanwhile, so the holder can see this and flush and
+close the database after the current folder (see lock_db).
+
+queries are handled by multiple threads, so read-only databases are cached as well.
+a handle is used by one thread at a time, and reopened to see the latest revision.
+
+query and suggestion results are cached, tagged with the database revision they
+were computed for. so any commit to a store automatically invalidates its results.
+
+stores are reindexed into a 'shadow' database (serverguid-storeguid.shadow), while the
+live database keeps serving queries. as long as the shadow database exists, incremental
+changes for the store are written to both, holding the lock on the live database until
+both are written. when reindexing is done, the shadow database replaces the live database
+using an atomic rename (exchange). where this is not supported, the live database is removed
+first, so queries briefly find no database (as when reindexing used to remove it).
+
+optionally, edge n-gram 'prefix terms' (XP<field>:<prefix>) are stored for each field term,
+so the implicit prefix searches can use exact term lookups instead of expanding wildcards
+over the termlist, which is expensive for short prefixes. the prefix lengths are stored
+in the database metadata when it is created, so existing databases keep working as before
+(and reindexing a store switches it to the configured mode).
 
 """
 
+WAIT = '.wait'
+
+def lock_db(lockfile, dbpath):
+    """ exclusively lock database using its external lock file; while blocking,
+        hold a shared lock on the '.wait' file, so the holder knows to release it """
+
+    try:
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+    except (IOError, OSError):
+        with open(dbpath+WAIT, 'w') as waitfile:
+            fcntl.flock(waitfile.fileno(), fcntl.LOCK_SH)
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+
+class PooledDatabase:
+    """ open writable database, holding the external lock until closed """
+
+    def __init__(self, db, lockfile, dbpath, prefix_terms=None):
+        self.db = db
+        self.lockfile = lockfile
+        self.dbpath = dbpath
+        self.waitfile = None
+        self.prefix_terms = prefix_terms
+        self.termgenerator = xapian.TermGenerator()
+        self.termgenerator.set_database(db)
+        self.dirty = False
+        self.opened = self.last_used = time.time()
+
+    def flush(self):
+        if self.dirty:
+            self.db.commit()
+            self.dirty = False
+
+    def waited_for(self):
+        """ another process is blocking on the lock (see lock_db) """
+
+        if self.waitfile is None:
+            self.waitfile = open(self.dbpath+WAIT, 'w')
+        try:
+            fcntl.flock(self.waitfile.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return True
+        fcntl.flock(self.waitfile.fileno(), fcntl.LOCK_UN)
+        return False
+
+    def close(self):
+        try:
+            self.db.close() # implicitly commits
+        finally:
+            self.lockfile.close() # releases lock
+            if self.waitfile:
+                self.waitfile.close()
+
+class DatabasePool:
+    """ LRU pool of open writable databases, keyed by (server_guid, store_guid) """
+
+    MAX_AGE = 300 # also close busy databases once in a while, so others can lock them
+
+    def __init__(self, open_func, size, idle_timeout, log):
+        self.open_func = open_func
+        self.size = max(size, 1)
+        self.idle_timeout = idle_timeout
+        self.log = log
+        self.dbs = collections.OrderedDict()
+
+    def get(self, key, keep=None):
+        """ return pooled database for key, opening it if needed; the database for
+            'keep' stays open (and locked) meanwhile """
+
+        pdb = self.dbs.pop(key, None)
+        if pdb is None:
+            for key2 in [k for k in self.dbs if k != keep][:max(len(self.dbs)-self.size+1, 0)]:
+                self.evict(key2)
+            pdb = self.open_func(key, self, keep)
+            if pdb is None:
+                return None
+        self.dbs[key] = pdb # most recently used last
+        pdb.last_used = time.time()
+        return pdb
+
+    def flush(self, key=None):
+        """ commit pending changes for key (or all databases) to disk """
+
+        for key2, pdb in list(self.dbs.items()):
+            if key is None or key2 == key:
+                pdb.flush()
+
+    def flush_idle(self):
+        """ flush and close databases that have not been used for a while,
+            or that another process is waiting for """
+
+        now = time.time()
+        for key, pdb in list(self.dbs.items()):
+            if now - pdb.last_used >= self.idle_timeout or now - pdb.opened >= self.MAX_AGE or \
+               pdb.waited_for():
+                self.evict(key)
+
+    def release_waited(self):
+        """ flush and close databases that another process is waiting for """
+
+        for key, pdb in list(self.dbs.items()):
+            if pdb.waited_for():
+                self.log.debug('releasing database %s-%s for other process', *key)
+                self.evict(key)
+
+    def evict(self, key):
+        pdb = self.dbs.pop(key, None)
+        if pdb is not None:
+            self.log.debug('closing database %s-%s', *key)
+            pdb.close()
+
+    def close(self, exclude=None):
+        for key in list(self.dbs):
+            if key != exclude:
+                self.evict(key)
+
+class ReaderCache:
+    """ cache of read-only databases, keyed by (server_guid, store_guid) """
+
+    def __init__(self, open_func, size, log):
+        self.open_func = open_func
+        self.size = size
+        self.log = log
+        self.lock = threading.Lock()
+        self.dbs = collections.OrderedDict() # key -> idle handles
+        self.count = 0
+
+    @contextmanager
+    def get(self, key):
+        """ check out (reopened) database for key, for use by the current thread only """
+
+        with self.lock:
+            handles = self.dbs.get(key)
+            db = None
+            if handles:
+                db = handles.pop()
+                self.count -= 1
+                if not handles: # so eviction only sees idle handles
+                    del self.dbs[key]
+        if db is None:
+            db = self.open_func(*key)
+        else:
+            revision = db.get_revision()
+            try:
+                db.reopen()
+            except xapian.DatabaseError: # for example, replaced by reindexing or compaction
+                db.close()
+                db = self.open_func(*key)
+            else:
+                if db.get_revision() != revision:
+                    self.log.debug('reopened database %s-%s (revision %d)', key[0], key[1], db.get_revision())
+        if db is None:
+            yield None
+            return
+        try:
+            yield db
+        except:
+            db.close()
+            raise
+        else:
+            self.put(key, db)
+
+    def put(self, key, db):
+        with self.lock:
+            self.dbs.setdefault(key, []).append(db)
+            self.dbs.move_to_end(key)
+            self.count += 1
+            while self.count > self.size:
+                key2, handles = next(iter(self.dbs.items()))
+                handles.pop(0).close()
+                self.count -= 1
+                if not handles:
+                    del self.dbs[key2]
+
+class ResultCache:
+    """ LRU cache of query/suggestion results, within a memory budget """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.results = collections.OrderedDict() # key -> (revision, result, nbytes)
+        self.nbytes = self.hits = self.misses = 0
+
+    def get(self, key, revision):
+        with self.lock:
+            entry = self.results.get(key)
+            if entry and entry[0] == revision:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+    def put(self, key, revision, result, nbytes):
+        nbytes += len(repr(key))
+        if nbytes > self.size:
+            return
+        with self.lock:
+            old = self.results.pop(key, None)
+            if old:
+                self.nbytes -= old[2]
+            self.results[key] = (revision, result, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.size:
+                _, entry = self.results.popitem(last=False)
+                self.nbytes -= entry[2]
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.results), 'bytes': self.nbytes}
+
+SHADOW = '.shadow'
+PREFIX_METADATA = 'kopano_prefix_terms'
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+SYS_RENAMEAT2 = { # for libc without renameat2 wrapper (glibc < 2.28)
+    'x86_64': 316, 'i386': 353, 'i686': 353, 'aarch64': 276, 'armv7l': 382,
+    'ppc64le': 357, 'ppc64': 357, 's390x': 347,
+}.get(platform.machine())
+
+def _exchange(path1, path2):
+    """ atomically exchange two paths (linux renameat2), raising OSError if not supported """
+
+    args = (AT_FDCWD, path1.encode(), AT_FDCWD, path2.encode(), RENAME_EXCHANGE)
+    renameat2 = getattr(_libc, 'renameat2', None)
+    if renameat2 is not None:
+        result = renameat2(*args)
+    elif SYS_RENAMEAT2 is not None:
+        result = _libc.syscall(SYS_RENAMEAT2, *args)
+    else:
+        raise OSError('renameat2 not available')
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
 class Plugin:
-    def __init__(self, index_path, log):
+    def __init__(self, index_path, log, config=None):
         self.index_path = index_path
         self.log = log
         self.data = []
         self.deletes = []
+        config = config or {}
+        self.pool = DatabasePool(self._open_pooled,
+            config.get('index_db_pool_size', 16),
+            config.get('index_db_idle_timeout', 10),
+            log)
+        self.readers = ReaderCache(self._open_reader, config.get('query_db_cache_size', 64), log)
+        self.results = ResultCache(config.get('query_cache_size', 2**24))
+        self.prefix_terms = None
+        if config.get('index_prefix_terms'):
+            self.prefix_terms = (max(config.get('index_prefix_min_length', 1), 1), config.get('index_prefix_max_length', 8))
+
+    def dbpath(self, server_guid, store_guid):
+        return os.path.join(self.index_path, '%s-%s' % (server_guid, store_guid))
 
     def open_db(self, server_guid, store_guid, writable=False, log=None):
         """ open xapian database; if locked, wait until unlocked """
 
-        dbpath = os.path.join(self.index_path, '%s-%s' % (server_guid, store_guid))
+        dbpath = self.dbpath(server_guid, store_guid)
         try:
             if writable:
                 with open(os.path.join(dbpath+'.lock'), 'w') as lockfile: # avoid compaction using an external lock to be safe
-                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
-                    while True:
-                        try:
-                            return xapian.WritableDatabase(dbpath, xapian.DB_CREATE_OR_OPEN)
-                        except xapian.DatabaseLockError:
-                            time.sleep(0.1)
+                    lock_db(lockfile, dbpath)
+                    return self._open_writable(dbpath)
             else:
                 return xapian.Database(dbpath)
         except xapian.DatabaseOpeningError:
             if log:
                 log.warn('could not open database: %s', dbpath)
 
+    def _open_reader(self, server_guid, store_guid):
+        return self.open_db(server_guid, store_guid, log=self.log)
+
+    def _open_writable(self, dbpath, flags=xapian.DB_CREATE_OR_OPEN):
+        while True:
+            try:
+                return xapian.WritableDatabase(dbpath, flags)
+            except xapian.DatabaseLockError:
+                time.sleep(0.1)
+
+    def _open_pooled(self, key, pool, keep=None):
+        """ open writable database for pool, keeping the external lock """
+
+        dbpath = self.dbpath(*key)
+        lockfile = open(dbpath+'.lock', 'w')
+        try:
+            try:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+            except (IOError, OSError):
+                # another process holds the lock (indexing or compaction): release everything
+                # we hold ourselves before blocking, so processes cannot wait on each other.
+                # only a live database is kept while locking its shadow, and the other way
+                # around never happens (see commit and finish_reindex)
+                self.log.debug('waiting for lock on %s', dbpath)
+                pool.close(exclude=keep)
+                lock_db(lockfile, dbpath)
+            # do not recreate a shadow database which was swapped in the meantime
+            flags = xapian.DB_OPEN if key[1].endswith(SHADOW) else xapian.DB_CREATE_OR_OPEN
+            db = self._open_writable(dbpath, flags)
+            return PooledDatabase(db, lockfile, dbpath, self._prefix_mode(db, writable=True))
+        except xapian.DatabaseOpeningError:
+            lockfile.close()
+            self.log.warn('could not open database: %s', dbpath)
+        except:
+            lockfile.close()
+            raise
+
+    def _prefix_mode(self, db, writable=False):
+        """ return (min, max) prefix term lengths for database, or None if it does not contain prefix terms """
+
+        value = db.get_metadata(PREFIX_METADATA).decode('ascii')
+        if not value and writable and db.get_doccount() == 0: # new database: use configured mode
+            value = ('%d %d' % self.prefix_terms) if self.prefix_terms else 'off'
+            db.set_metadata(PREFIX_METADATA, value)
+        if value and value != 'off':
+            return tuple(int(x) for x in value.split())
+
     def extract_terms(self, text):
         """ extract terms as if we are indexing """
         doc = xapian.Document()
@@ -60,40 +381,85 @@ class Plugin:
     def search(self, server_guid, store_guid, folder_ids, fields_terms, query, limit_results, log):
         """ handle query; see links in the top for a description of the Xapian API """
 
-        db = self.open_db(server_guid, store_guid, log=log)
-        if not db:
-            return []
+        with self.readers.get((server_guid, store_guid)) as db:
+            if not db:
+                return []
+            key = ('search', server_guid, store_guid, tuple(folder_ids),
+                tuple((tuple(fields), tuple(terms)) for fields, terms in fields_terms), limit_results)
+            revision = (db.get_uuid(), db.get_revision())
+            matches = self.results.get(key, revision)
+            if matches is None:
+                matches = self._search(db, folder_ids, fields_terms, query, limit_results, log)
+                self.results.put(key, revision, matches, sum(len(m) for m in matches))
+            else:
+                log.info('using cached results for query: %s', query)
+            return matches
 
-        qp = xapian.QueryParser()
-        qp.add_prefix("sourcekey", "XK:")
-        qp.add_prefix("folderid", "XF:")
-        for fields, terms in fields_terms:
-            for field in fields:
-                qp.add_prefix('mapi%d' % field, "XM%d:" % field)
-        log.info('performing query: %s', query)
-        qp.set_database(db)
-        query = qp.parse_query(query, xapian.QueryParser.FLAG_BOOLEAN|xapian.QueryParser.FLAG_PHRASE|xapian.QueryParser.FLAG_WILDCARD)
+    def _search(self, db, folder_ids, fields_terms, query, limit_results, log):
+        prefix_terms = self._prefix_mode(db)
+        if prefix_terms:
+            log.info('performing query: %s (using prefix terms)', query)
+            query = self._prefix_query(folder_ids, fields_terms, *prefix_terms)
+        else:
+            qp = xapian.QueryParser()
+            qp.add_prefix("sourcekey", "XK:")
+            qp.add_prefix("folderid", "XF:")
+            for fields, terms in fields_terms:
+                for field in fields:
+                    qp.add_prefix('mapi%d' % field, "XM%d:" % field)
+            log.info('performing query: %s', query)
+            qp.set_database(db)
+            query = qp.parse_query(query, xapian.QueryParser.FLAG_BOOLEAN|xapian.QueryParser.FLAG_PHRASE|xapian.QueryParser.FLAG_WILDCARD)
         enquire = xapian.Enquire(db)
         enquire.set_query(query)
         matches = []
         for match in enquire.get_mset(0, limit_results or db.get_doccount()): # XXX catch exception if database is being updated?
             matches.append(match.document.get_value(0).decode('ascii'))
-        db.close()
         return matches
 
+    def _prefix_query(self, folder_ids, fields_terms, min_length, max_length):
+        """ build the same query as the query string, using prefix terms where possible """
+
+        def prefix_query(field, term):
+            if min_length <= len(term) <= max_length:
+                return xapian.Query('XP%d:%s' % (field, term))
+            return xapian.Query(xapian.Query.OP_WILDCARD, 'XM%d:%s' % (field, term)) # too short or long
+
+        restrictions = []
+        if folder_ids:
+            restrictions.append(xapian.Query(xapian.Query.OP_OR, [xapian.Query('XF:%s' % f) for f in folder_ids]))
+        for fields, terms in fields_terms:
+            if fields:
+                restrictions.append(xapian.Query(xapian.Query.OP_OR,
+                    [xapian.Query(xapian.Query.OP_AND, [prefix_query(f, term) for term in terms]) for f in fields]))
+            else:
+                restrictions.append(xapian.Query(xapian.Query.OP_AND,
+                    [xapian.Query(xapian.Query.OP_WILDCARD, term) for term in terms]))
+        return xapian.Query(xapian.Query.OP_AND, restrictions)
+
     def suggest(self, server_guid, store_guid, terms, orig, log):
         """ update original search text with suggested terms """
 
-        db = self.open_db(server_guid, store_guid, log=log)
-        if not db:
-            return orig
+        with self.readers.get((server_guid, store_guid)) as db:
+            if not db:
+                return orig
+
+            key = ('suggest', server_guid, store_guid, tuple(terms), orig)
+            revision = (db.get_uuid(), db.get_revision())
+            suggestion = self.results.get(key, revision)
+            if suggestion is None:
+                suggestion = orig
+                # XXX revisit later. looks like xapian cannot do this for us? :S
+                for term in sorted(terms, key=lambda s: len(s), reverse=True):
+                    suggestion2 = db.get_spelling_suggestion(term).decode('utf8') or term
+                    suggestion = suggestion.replace(term, suggestion2, 1)
+                self.results.put(key, revision, suggestion, len(suggestion))
+            return suggestion
+
+    def stats(self):
+        """ query result cache statistics """
 
-        with closing(db) as db:
-            # XXX revisit later. looks like xapian cannot do this for us? :S
-            for term in sorted(terms, key=lambda s: len(s), reverse=True):
-                suggestion = db.get_spelling_suggestion(term).decode('utf8') or term
-                orig = orig.replace(term, suggestion, 1)
-            return orig
+        return self.results.stats()
 
     def update(self, doc):
         """ new/changed document """
@@ -105,8 +471,11 @@ class Plugin:
 
         self.deletes.append(doc)
 
-    def commit(self, suggestions):
-        """ index pending documents; see links in the top for a description of the Xapian API """
+    def commit(self, suggestions, shadow=False):
+        """ index pending documents; see links in the top for a description of the Xapian API
+
+        when reindexing, documents are only written to the shadow database. otherwise,
+        they are also written to the shadow database if the store is being reindexed. """
 
         if not self.data and not self.deletes:
             return
@@ -115,37 +484,122 @@ class Plugin:
         try:
             # XXX we assume here that all data is from the same store
             doc = (self.data or self.deletes)[0]
-            with closing(self.open_db(doc['serverid'], doc['storeid'], writable=True, log=self.log)) as db:
-                termgenerator = xapian.TermGenerator()
-                termgenerator.set_database(db)
-                flags = 0
-                if suggestions:
-                    flags |= termgenerator.FLAG_SPELLING
-                termgenerator.set_flags(flags)
-                for doc in self.data:
-                    xdoc = xapian.Document()
-                    termgenerator.set_document(xdoc)
-                    for key, value in doc.items():
-                        if key.startswith('mapi'):
-                            value = value.replace('_', ' ') # xapian sees '_' as a word-character (to search for identifiers in source code)
-                            termgenerator.index_text_without_positions(value) # add to full-text, needed for spelling dict?
-                            termgenerator.index_text_without_positions(value, 1, 'XM%s:' % key[4:])
-                    xdoc.add_value(0, str(doc['docid']))
-                    sourcekey_term = 'XK:'+doc['sourcekey'].lower()
-                    xdoc.add_term(sourcekey_term)
-                    xdoc.add_term('XF:'+str(doc['folderid'])) #XXX
-                    xdoc.set_data(doc['data'])
-                    db.replace_document(sourcekey_term, xdoc)
-                for doc in self.deletes:
-                    db.delete_document('XK:'+doc['sourcekey'].lower())
+            server_guid, store_guid = doc['serverid'], doc['storeid']
+            live_key, shadow_key = (server_guid, store_guid), (server_guid, store_guid+SHADOW)
+            if not shadow:
+                pdb = self.pool.get(live_key)
+                if pdb:
+                    self._commit(pdb, suggestions)
+            # the live database stays locked until the shadow database is written as well,
+            # so finish_reindex cannot swap them in between
+            if shadow or os.path.isdir(self.dbpath(*shadow_key)):
+                pdb = self.pool.get(shadow_key, keep=None if shadow else live_key)
+                if pdb:
+                    self._commit(pdb, suggestions)
             self.log.debug('commit took %.2f seconds (%d items)', time.time()-t0, nitems)
         finally:
             self.data = []
             self.deletes = []
 
+    def _commit(self, pdb, suggestions):
+        db, termgenerator, prefix_terms = pdb.db, pdb.termgenerator, pdb.prefix_terms
+        pdb.dirty = True
+        flags = 0
+        if suggestions:
+            flags |= termgenerator.FLAG_SPELLING
+        termgenerator.set_flags(flags)
+        for doc in self.data:
+            xdoc = xapian.Document()
+            termgenerator.set_document(xdoc)
+            for key, value in doc.items():
+                if key.startswith('mapi'):
+                    value = value.replace('_', ' ') # xapian sees '_' as a word-character (to search for identifiers in source code)
+                    termgenerator.index_text_without_positions(value) # add to full-text, needed for spelling dict?
+                    termgenerator.index_text_without_positions(value, 1, 'XM%s:' % key[4:])
+            if prefix_terms:
+                self._add_prefix_terms(xdoc, *prefix_terms)
+            xdoc.add_value(0, str(doc['docid']))
+            sourcekey_term = 'XK:'+doc['sourcekey'].lower()
+            xdoc.add_term(sourcekey_term)
+            xdoc.add_term('XF:'+str(doc['folderid'])) #XXX
+            xdoc.set_data(doc['data'])
+            db.replace_document(sourcekey_term, xdoc)
+        for doc in self.deletes:
+            db.delete_document('XK:'+doc['sourcekey'].lower())
+
+    def _add_prefix_terms(self, xdoc, min_length, max_length):
+        """ add edge n-grams of field terms (including the terms themselves, if not too long) """
+
+        for t in list(xdoc.termlist()):
+            term = t.term.decode('utf-8')
+            if term.startswith('XM'):
+                field, _, word = term.partition(':')
+                for n in range(min_length, min(len(word), max_length)+1):
+                    xdoc.add_term('XP%s:%s' % (field[2:], word[:n]))
+
+    def flush(self, server_guid=None, store_guid=None):
+        """ make committed documents durable (before saving sync state); databases
+            other processes are waiting for are closed, so they can continue """
+
+        t0 = time.time()
+        if store_guid:
+            self.pool.flush((server_guid, store_guid))
+            self.pool.flush((server_guid, store_guid+SHADOW))
+        else:
+            self.pool.flush()
+        self.pool.release_waited()
+        self.log.debug('flush took %.2f seconds', time.time()-t0)
+
+    def flush_idle(self):
+        """ close databases which have been idle for a while, so others can lock them """
+
+        self.pool.flush_idle()
+
+    def close(self):
+        """ flush and close all open databases """
+
+        self.pool.close()
+
+    def start_reindex(self, server_guid, store_guid):
+        """ create empty shadow database, to reindex the store into """
+
+        dbpath = self.dbpath(server_guid, store_guid+SHADOW)
+        self.log.info('creating %s', dbpath)
+        with open(dbpath+'.lock', 'w') as lockfile:
+            lock_db(lockfile, dbpath)
+            shutil.rmtree(dbpath, ignore_errors=True) # left-over from interrupted reindexing
+            self._open_writable(dbpath, xapian.DB_CREATE).close()
+
+    def finish_reindex(self, server_guid, store_guid):
+        """ replace live database with shadow database """
+
+        dbpath = self.dbpath(server_guid, store_guid)
+        shadow_path = dbpath+SHADOW
+        self.log.info('replacing %s with %s', dbpath, shadow_path)
+        with open(dbpath+'.lock', 'w') as lockfile: # wait for indexing processes to close them
+            lock_db(lockfile, dbpath)
+            with open(shadow_path+'.lock', 'w') as shadow_lockfile:
+                lock_db(shadow_lockfile, shadow_path)
+                if os.path.isdir(dbpath):
+                    try:
+                        _exchange(shadow_path, dbpath)
+                    except OSError as e:
+                        # remove live database as before shadow reindexing (see reindex), but
+                        # move the shadow database in right away: queries briefly find no database
+                        self.log.warn('could not atomically replace %s (%s), removing it first', dbpath, e)
+                        os.rename(dbpath, shadow_path+'.old')
+                        os.rename(shadow_path, dbpath)
+                        shadow_path += '.old'
+                    shutil.rmtree(shadow_path)
+                else: # store had no items before
+                    os.rename(shadow_path, dbpath)
+        os.remove(dbpath+SHADOW+'.lock')
+
     def reindex(self, server_guid, store_guid):
         """ remove database so we can cleanly reindex the store """
 
-        dbpath = os.path.join(self.index_path, '%s-%s' % (server_guid, store_guid))
+        dbpath = self.dbpath(server_guid, store_guid)
         self.log.info('removing %s', dbpath)
-        shutil.rmtree(dbpath, ignore_errors=True) # may not exist yet (no items to index)
+        with open(dbpath+'.lock', 'w') as lockfile: # wait for indexing processes to close it
+            lock_db(lockfile, dbpath)
+            shutil.rmtree(dbpath, ignore_errors=True) # may not exist yet (no items to index)
@@ -0,0 +1,81 @@
+import importlib.util
+import logging
+import os
+
+import pytest
+
+pytest.importorskip('xapian')
+
+# load plugin module directly, as the package needs a running server
+spec = importlib.util.spec_from_file_location('plugin_xapian',
+    os.path.join(os.path.dirname(__file__), '..', 'kopano_search', 'plugin_xapian.py'))
+plugin_xapian = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(plugin_xapian)
+
+
+class FakeDatabase:
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+
+    def get_revision(self):
+        return 1
+
+    def reopen(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def readers():
+    opened = []
+    def open_func(*key):
+        db = FakeDatabase(key)
+        opened.append(db)
+        return db
+    cache = plugin_xapian.ReaderCache(open_func, 2, logging.getLogger())
+    cache.opened = opened
+    return cache
+
+
+def test_reader_checkout_checkin(readers):
+    with readers.get(('server', 'a')) as db:
+        assert db.key == ('server', 'a')
+    assert readers.count == 1
+
+    # idle handle is reused
+    with readers.get(('server', 'a')) as db2:
+        assert db2 is db
+        assert readers.count == 0
+        assert ('server', 'a') not in readers.dbs
+    assert readers.count == 1
+    assert len(readers.opened) == 1
+
+
+def test_reader_evict(readers):
+    with readers.get(('server', 'a')):
+        pass
+
+    # check in more handles than fit, while the only handle of 'a' is out
+    with readers.get(('server', 'a')) as a:
+        with readers.get(('server', 'b')) as b:
+            pass
+        with readers.get(('server', 'c')) as c:
+            pass
+        with readers.get(('server', 'd')) as d:
+            pass
+        assert readers.count == 2
+        assert b.closed and not c.closed and not d.closed
+    assert readers.count == 2
+    assert list(readers.dbs) == [('server', 'd'), ('server', 'a')]
+    assert c.closed and not a.closed
+
+
+def test_reader_error(readers):
+    with pytest.raises(ValueError):
+        with readers.get(('server', 'a')) as db:
+            raise ValueError
+    assert db.closed
+    assert readers.count == 0
@@ -28,6 +28,9 @@ CONFIG = {
     'header_tag': Config.string(default="x-spam-flag")
 }
 
+# seconds after which cached stores (and so their special folders) are looked up again
+STORE_CACHE_TIME = 300
+
 
 class Service(kopano.Service):
     def main(self):
@@ -49,6 +52,20 @@ class Importer:
         self.sagroup = service.config['sa_group']
         self.learnham = service.config['learn_ham']
         self.headertag = service.config['header_tag'].lower()
+        self.stores = {}
+        self.stores_time = time.time()
+
+    def cached_store(self, item):
+        # server-wide ICS passes a new Store with each item, so keep one per
+        # store, so special folders are not looked up again for every item
+        now = time.time()
+        if now - self.stores_time > STORE_CACHE_TIME: # special folders may change
+            self.stores = {}
+            self.stores_time = now
+        store = self.stores.get(item.storeid)
+        if store is None:
+            store = self.stores[item.storeid] = item.store
+        return store
 
     def mark_spam(self, searchkey):
         if not isinstance(searchkey, bytes): # python3
@@ -69,8 +86,10 @@ class Importer:
 
             searchkey = item.searchkey
             header = item.header(self.headertag)
+            folder = item.folder
+            store = self.cached_store(item)
 
-            if (item.folder == item.store.junk and \
+            if (store.is_special(folder, 'junk') and \
                 (not header or header.upper() != 'YES')):
 
                 fn = os.path.join(self.hamdir, searchkey + '.eml')
@@ -80,7 +99,7 @@ class Importer:
                 self.log.info("Learning message as SPAM, entryid: %s", item.entryid)
                 self.learn(item, searchkey, True)
 
-            elif (item.folder == item.store.inbox and \
+            elif (store.is_special(folder, 'inbox') and \
                   self.learnham and \
                   self.was_spam(searchkey)):
 
@@ -24,7 +24,7 @@ from .errors import (
     Error, ConfigError, DuplicateError, NotFoundError, LogonError,
     NotSupportedError, ArgumentError,
 )
-from .server import Server as _Server
+from .server import Server as _Server, UserRow
 from .address import Address
 from .appointment import Appointment
 from .attachment import Attachment
@@ -38,9 +38,10 @@ from .compat import (
 from .contact import Contact
 from .delegation import Delegation
 from .distlist import DistList
-from .folder import Folder
+from .folder import Folder, ItemRow
 from .freebusy import FreeBusyBlock, FreeBusy
 from .group import Group
+from .hierarchy import Hierarchy
 from .item import Item
 from .log import log_exc, QueueListener, logger
 from .meetingrequest import MeetingRequest
@@ -55,7 +56,7 @@ from .recurrence import Recurrence, Occurrence
 from .restriction import Restriction
 from .rule import Rule
 from .store import Store
-from .table import Table
+from .table import Table, Row
 from .user import User
 from .parser import parser
 from .service import Service, Worker, server_socket, client_socket
@@ -95,6 +95,10 @@ class Attachment(Properties):
             self.mapiobj.DeleteProps(proptags)
         _utils._save(self._item.mapiobj)
 
+    @property
+    def _name_store(self):
+        return self._item._name_store if self._item else None
+
     @property
     def entryid(self):
         return _benc(HrGetOneProp(self._mapiitem, PR_ENTRYID).Value) + \
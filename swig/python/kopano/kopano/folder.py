@@ -22,7 +22,8 @@ from MAPI import (
     BOOKMARK_BEGINNING, ROW_REMOVE, MESSAGE_MOVE, FOLDER_MOVE,
     FOLDER_GENERIC, MAPI_UNICODE, FL_SUBSTRING, FL_IGNORECASE,
     SEARCH_RECURSIVE, SEARCH_REBUILD, PT_MV_BINARY, PT_BINARY,
-    MAPI_DEFERRED_ERRORS
+    MAPI_DEFERRED_ERRORS, PT_ERROR, PT_UNICODE, PT_OBJECT, PT_UNSPECIFIED,
+    MAPI_E_NOT_FOUND,
 )
 from MAPI.Tags import (
     PR_ENTRYID, IID_IMAPIFolder, SHOW_SOFT_DELETES, PR_SOURCE_KEY,
@@ -42,7 +43,7 @@ from MAPI.Tags import (
     PR_RULE_CONDITION, PT_LONG, PR_ATTR_HIDDEN,
 )
 from MAPI.Defs import (
-    HrGetOneProp, CHANGE_PROP_TYPE
+    HrGetOneProp, CHANGE_PROP_TYPE, PROP_TYPE
 )
 from MAPI.Struct import (
     MAPIErrorNoAccess, MAPIErrorNotFound, MAPIErrorNoSupport,
@@ -57,11 +58,11 @@ from .permission import Permission, _permissions_dumps, _permissions_loads
 from .restriction import Restriction
 from .recurrence import Occurrence
 from .rule import Rule
-from .table import Table
-from .property_ import Property
+from .table import Table, Row, _RowColumns, _sorttags
+from .property_ import Property, SPropDelayedValue
 from .defs import (
     PSETID_Appointment, UNESCAPED_SLASH_RE,
-    ENGLISH_FOLDER_MAP, NAME_RIGHT, NAMED_PROPS_ARCHIVER
+    ENGLISH_FOLDER_MAP, NAME_RIGHT, NAMED_PROPS_ARCHIVER, REV_TAG
 )
 from .errors import NotFoundError, ArgumentError, DuplicateError
 from .query import _query_to_restriction
@@ -110,8 +111,94 @@ PROPMAP = {
     'subject': PR_SUBJECT_W,
     'received': PR_MESSAGE_DELIVERY_TIME,
     'created': PR_CREATION_TIME,
+    'last_modified': PR_LAST_MODIFICATION_TIME,
+    'size': PR_MESSAGE_SIZE,
+    'message_class': PR_MESSAGE_CLASS_W,
+    'entryid': PR_ENTRYID,
+    'sourcekey': PR_SOURCE_KEY,
+    'changekey': PR_CHANGE_KEY,
 }
 
+# adaptive preloading (see Folder.items): extra columns per call site
+# and container class, for the most recently used sites
+PRELOAD_MAX_COLUMNS = 32
+PRELOAD_MAX_SITES = 64
+_PRELOAD_SITES = collections.OrderedDict()
+
+class _ItemMapiobj(object):
+    # stands in for the MAPI object of an item, as parent of properties
+    # served from preloaded columns: opens it on first use (dropping the
+    # preloaded columns, see Item.mapiobj)
+
+    def __init__(self, item):
+        self.item = item
+
+    def __getattr__(self, name):
+        return getattr(self.item.mapiobj, name)
+
+class _Preload(object):
+    # tracks properties accessed on items of an items() iteration,
+    # which could not be served from the preloaded table columns
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.pending = set()
+        self.fallbacks = collections.Counter()
+        self.items = 0
+
+    def prop(self, item, proptag):
+        # preloaded property, or None (counting fallback)
+        prop = item._cache.get(proptag)
+        if prop is not None:
+            proptype = PROP_TYPE(prop.proptag)
+            if proptype == PT_ERROR:
+                if prop.mapiobj.Value == MAPI_E_NOT_FOUND:
+                    raise NotFoundError('no such property: %s' %
+                        REV_TAG.get(proptag, hex(proptag)))
+            # mapi table cells are limited to 255 characters/bytes
+            elif not (isinstance(prop.mapiobj, SPropDelayedValue) or
+                      proptype in (PT_UNICODE, PT_BINARY) and
+                      len(prop.value) >= 255):
+                # table properties belong to the folder
+                return Property(_ItemMapiobj(item), prop.mapiobj,
+                    item._name_store)
+        elif (proptag not in self.columns and
+              PROP_TYPE(proptag) not in (PT_UNSPECIFIED, PT_OBJECT)):
+            self.pending.add(proptag)
+        self.fallbacks[proptag] += 1
+
+    def widen(self):
+        # add pending columns, returns whether any were added
+        added = False
+        for proptag in sorted(self.pending):
+            if len(self.columns) >= PRELOAD_MAX_COLUMNS:
+                break
+            if proptag not in self.columns:
+                self.columns.append(proptag)
+                added = True
+        self.pending.clear()
+        return added
+
+class ItemRow(Row):
+    """Lightweight item row, see :func:`Folder.rows`."""
+
+    __slots__ = ()
+
+    def item(self):
+        """Return full :class:`item <Item>` for row."""
+        folder = self._context
+        cache = {}
+        for proptag, value in zip(self._columns.proptags, self._values):
+            if value is not None:
+                cache[proptag] = Property(folder.mapiobj,
+                    SPropValue(proptag, value))
+        return _item.Item(
+            folder,
+            entryid=self._raw(PR_ENTRYID),
+            content_flag=folder._content_flag,
+            cache=cache
+        )
+
 class Folder(Properties):
     """Folder class
 
@@ -147,6 +234,10 @@ class Folder(Properties):
         self._cache = cache
         self._iter = None
 
+    @property
+    def _name_store(self):
+        return self.store
+
     @property
     def mapiobj(self):
         """Underlying MAPI object."""
@@ -183,12 +274,31 @@ class Folder(Properties):
     def guid(self):
         return self.entryid[56:88] # TODO assumes hex
 
+    @property
+    def _hierarchy(self):
+        # store hierarchy snapshot, if read and containing this folder
+        hierarchy = self.store._hierarchy
+        if hierarchy is not None and not self._content_flag:
+            if hierarchy._stale:
+                hierarchy.update()
+            if self.entryid in hierarchy:
+                return hierarchy
+
+    def _hierarchy_changed(self):
+        # refresh store hierarchy snapshot on next use
+        if self.store._hierarchy is not None:
+            self.store._hierarchy._stale = True
+
     @property
     def sourcekey(self):
         """Folder sourcekey."""
         if not self._sourcekey:
-            self._sourcekey = \
-                _benc(HrGetOneProp(self.mapiobj, PR_SOURCE_KEY).Value)
+            hierarchy = self._hierarchy
+            if hierarchy is not None:
+                self._sourcekey = hierarchy[self.entryid].sourcekey
+            else:
+                self._sourcekey = \
+                    _benc(HrGetOneProp(self.mapiobj, PR_SOURCE_KEY).Value)
         return self._sourcekey
 
     @property
@@ -209,12 +319,17 @@ class Folder(Properties):
     @property
     def subfolder_count(self):
         """Direct subfolder count."""
+        hierarchy = self._hierarchy
+        if hierarchy is not None:
+            return hierarchy.subfolder_count(self.entryid)
         return self.prop(PR_FOLDER_CHILD_COUNT).value
 
     @property
     def subfolder_count_recursive(self):
         """Subfolder count (recursive)."""
-        # TODO faster?
+        hierarchy = self._hierarchy
+        if hierarchy is not None:
+            return hierarchy.subfolder_count_recursive(self.entryid)
         flags = MAPI_UNICODE | self._content_flag | CONVENIENT_DEPTH | \
             MAPI_DEFERRED_ERRORS
         mapitable = self.mapiobj.GetHierarchyTable(flags)
@@ -237,7 +352,7 @@ class Folder(Properties):
             return name.replace('/', '\\/')
         else:
             # root folder doesn't have PR_DISPLAY_NAME_W
-            if self.entryid == self.store.root.entryid:
+            if self.store.is_special(self, 'root'):
                 return 'ROOT'
             else:
                 return ''
@@ -245,10 +360,14 @@ class Folder(Properties):
     @property
     def path(self):
         """Folder path."""
+        hierarchy = self._hierarchy
+        if hierarchy is not None:
+            return hierarchy.path(self.entryid)
         names = []
         parent = self
-        subtree_entryid = self.store.subtree.entryid
-        root_entryid = self.store.root.entryid
+        special = self.store._special_entryids()
+        subtree_entryid = _benc(special.get('subtree', b''))
+        root_entryid = _benc(special.get('root', b''))
         # parent entryids coming from a table are not converted like normal
         # parent entryids for certains public store folders (via getprops,
         # or store PR_IPM_SUBTREE_ENTRYID), so we match with this property,
@@ -270,6 +389,7 @@ class Folder(Properties):
     def name(self, name):
         self.mapiobj.SetProps([SPropValue(PR_DISPLAY_NAME_W, str(name))])
         _utils._save(self.mapiobj)
+        self._hierarchy_changed()
 
     @property
     def container_class(self): # TODO return '' by default?
@@ -358,7 +478,7 @@ class Folder(Properties):
         return item
 
     def items(self, restriction=None, page_start=None, page_limit=None,
-              order=None, query=None):
+              order=None, query=None, adaptive=False):
         """Return all :class:`items <Item>` in folder, reverse sorted on
         received date.
 
@@ -368,8 +488,13 @@ class Folder(Properties):
         :param page_start: skip this many items from the start
         :param page_limit: return up to this many items
         :param query: use search query
+        :param adaptive: preload properties which are accessed on items,
+            but were not preloaded, for the remaining items (and for later
+            calls from the same place, on the same type of folder). may
+            also be a function, which is called with statistics (such as
+            the number of fallbacks to slow property lookups per proptag)
+            at the end
         """
-        # TODO determine preload columns dynamically, based on usage pattern
         columns = [
             PR_ENTRYID,
             PR_MESSAGE_DELIVERY_TIME,
@@ -381,6 +506,19 @@ class Folder(Properties):
             PR_SOURCE_KEY,
         ]
 
+        preload = None
+        if adaptive:
+            fixed = len(columns)
+            caller = sys._getframe(1)
+            site = (caller.f_code.co_filename, caller.f_lineno,
+                self.container_class)
+            learned = _PRELOAD_SITES.pop(site, [])
+            _PRELOAD_SITES[site] = learned # most recently used last
+            for proptag in learned:
+                if proptag not in columns:
+                    columns.append(proptag)
+            preload = _Preload(columns)
+
         if query is not None:
             if self.container_class == 'IPF.Contact':
                 type_ = 'contact'
@@ -401,27 +539,93 @@ class Folder(Properties):
         except MAPIErrorNoSupport:
             return
 
-        # TODO MAPI has more than just ascend/descend
         if order is None:
             order = '-received'
-        if not isinstance(order, tuple):
-            order = (order,)
-        sorttags = []
-        for term in order:
-            if term.startswith('-'):
-                sorttags.append(-PROPMAP[term[1:]])
+        table.sort(_sorttags(order, PROPMAP))
+
+        try:
+            for row in table.rows(page_start=page_start,
+                    page_limit=page_limit):
+                item = _item.Item(
+                    self,
+                    entryid=row[0].value,
+                    content_flag=self._content_flag,
+                    # (rows fetched before widening have fewer columns)
+                    cache=dict(zip(columns, row))
+                )
+                if preload:
+                    item._preload = preload
+                    preload.items += 1
+                yield item
+
+                # widen columns for next rows
+                if preload and preload.pending and preload.widen():
+                    table.mapitable.SetColumns(columns, 0)
+        finally:
+            if preload:
+                # only remember columns when some were added, so aborted
+                # iterations do not forget what earlier ones learned
+                if len(columns) > fixed + len(learned):
+                    _PRELOAD_SITES[site] = columns[fixed:]
+                while len(_PRELOAD_SITES) > PRELOAD_MAX_SITES:
+                    _PRELOAD_SITES.popitem(last=False)
+                if callable(adaptive):
+                    adaptive({
+                        'site': site,
+                        'items': preload.items,
+                        'columns': list(columns),
+                        'fallbacks': dict(preload.fallbacks),
+                    })
+
+    def rows(self, columns=('entryid', 'received', 'subject', 'size',
+            'message_class'), restriction=None, order=None, batch_size=None,
+            page_start=None, page_limit=None, query=None):
+        """Return lightweight :class:`rows <ItemRow>` for items in folder,
+        containing only the given columns. This is much faster than
+        :func:`items` when only a few attributes are needed. Also works
+        for search folders.
+
+        :param columns: column names (such as *subject*, *received*,
+            *size* or *message_class*) and/or proptags
+        :param restriction: apply :class:`restriction <Restriction>`
+        :param order: order by column name(s), e.g. 'subject', '-subject'
+            (reverse order), or ('subject', '-received')
+        :param batch_size: number of rows to fetch per server call
+            (adapted to server response times by default)
+        :param page_start: skip this many rows from the start
+        :param page_limit: return up to this many rows
+        :param query: use search query
+        """
+        row_columns = _RowColumns(columns, PROPMAP)
+        row_columns.add(PR_ENTRYID)
+
+        if query is not None:
+            if self.container_class == 'IPF.Contact':
+                type_ = 'contact'
             else:
-                sorttags.append(PROPMAP[term])
-        table.sort(tuple(sorttags))
+                type_ = 'message'
+            restriction = _query_to_restriction(query, type_, self.store)
 
-        for row in table.rows(page_start=page_start, page_limit=page_limit):
-            item = _item.Item(
-                self,
-                entryid=row[0].value,
-                content_flag=self._content_flag,
-                cache=dict(zip(columns, row))
+        try:
+            table = Table(
+                self.server,
+                self.mapiobj,
+                self.mapiobj.GetContentsTable(self._content_flag | \
+                    MAPI_DEFERRED_ERRORS),
+                PR_CONTAINER_CONTENTS,
+                columns=row_columns.proptags,
+                restriction=restriction,
             )
-            yield item
+        except MAPIErrorNoSupport:
+            return
+
+        if order is not None:
+            table.sort(_sorttags(order, PROPMAP))
+
+        for row in table._row_objects(row_columns, ItemRow, self,
+                batch_size=batch_size, page_start=page_start,
+                page_limit=page_limit):
+            yield row
 
     def occurrences(self, start=None, end=None, page_start=None,
             page_limit=None, order=None):
@@ -570,6 +774,7 @@ class Folder(Properties):
             if associated:
                 flags |= DEL_ASSOCIATED
             self.mapiobj.EmptyFolder(0, None, flags)
+            self._hierarchy_changed()
         else:
             self.delete(self.items()) # TODO look at associated flag!
 
@@ -649,6 +854,8 @@ class Folder(Properties):
             else:
                 self.mapiobj.DeleteFolder(entryid, 0, None,
                     DEL_FOLDERS | DEL_MESSAGES | DELETE_HARD_DELETE)
+        if folder_entryids:
+            self._hierarchy_changed()
         for perm in perms:
             acl_table = self.mapiobj.OpenProperty(PR_ACL_TABLE,
                 IID_IExchangeModifyTable, 0, 0)
@@ -686,6 +893,8 @@ class Folder(Properties):
             self.mapiobj.CopyFolder(entryid, IID_IMAPIFolder, folder.mapiobj,
                 None, 0, None,
                 COPY_SUBFOLDERS | (FOLDER_MOVE if _delete else 0))
+        if folder_entryids:
+            self._hierarchy_changed()
 
     def move(self, objects, folder):
         """Move items or subfolders to folder
@@ -720,7 +929,8 @@ class Folder(Properties):
                     recurse=False)
             return subfolder
         # TODO depth==0?
-        if self == self.store.subtree and path in ENGLISH_FOLDER_MAP:
+        if self.store.is_special(self, 'subtree') and \
+                path in ENGLISH_FOLDER_MAP:
             f = getattr(self.store, ENGLISH_FOLDER_MAP[path], None)
             if f:
                 path = f.name
@@ -730,6 +940,7 @@ class Folder(Properties):
             try:
                 mapifolder = self.mapiobj.CreateFolder(FOLDER_GENERIC,
                     str(name), '', None, MAPI_UNICODE)
+                self._hierarchy_changed()
                 return Folder(self.store, _benc(HrGetOneProp(mapifolder,
                     PR_ENTRYID).Value))
             except MAPIErrorCollision:
@@ -1178,6 +1389,7 @@ class Folder(Properties):
             yield item
         self.store.findroot.mapiobj.DeleteFolder(
             _bdec(searchfolder.entryid), 0, None, 0) # TODO store.findroot
+        searchfolder._hierarchy_changed()
 
     def search_start(self, folders, text, recurse=False):
         # specific restriction format, needed to reach indexer
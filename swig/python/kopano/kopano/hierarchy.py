@@ -0,0 +1,248 @@
+# SPDX-License-Identifier: AGPL-3.0-only
+"""
+Part of the high-level python bindings for Kopano
+
+Copyright 2005 - 2016 Zarafa and its licensors (see LICENSE file)
+Copyright 2016 - 2019 Kopano and its licensors (see LICENSE file)
+"""
+
+import collections
+import sys
+
+from MAPI import (
+    MAPI_UNICODE, MAPI_DEFERRED_ERRORS, PT_ERROR,
+)
+from MAPI.Defs import PROP_TYPE
+from MAPI.Tags import (
+    PR_ENTRYID, PR_PARENT_ENTRYID, PR_DISPLAY_NAME_W, PR_SOURCE_KEY,
+    PR_CONTENT_COUNT, PR_CONTENT_UNREAD, PR_CONTAINER_HIERARCHY,
+    CONVENIENT_DEPTH, PR_EC_PUBLIC_IPM_SUBTREE_ENTRYID,
+)
+
+from .compat import benc as _benc
+from .errors import NotFoundError
+from .table import Table, _RowColumns
+
+try:
+    from . import ics as _ics
+except ImportError: # pragma: no cover
+    _ics = sys.modules[__package__ + '.ics']
+
+COLUMNS = [
+    PR_ENTRYID, PR_PARENT_ENTRYID, PR_DISPLAY_NAME_W, PR_SOURCE_KEY,
+    PR_CONTENT_COUNT, PR_CONTENT_UNREAD,
+]
+
+HierarchyEntry = collections.namedtuple('HierarchyEntry',
+    'parent name depth count unread sourcekey')
+
+class _Importer(object):
+    # applies hierarchy changes (see Folder.sync_hierarchy) to snapshot
+    def __init__(self, hierarchy):
+        self.hierarchy = hierarchy
+        self.changes = 0
+
+    def update(self, folder):
+        values = [None if PROP_TYPE(prop.ulPropTag) == PT_ERROR else
+            prop.Value for prop in
+            folder.mapiobj.GetProps(COLUMNS, MAPI_UNICODE)]
+        self.hierarchy._set(*values)
+        self.changes += 1
+
+    def delete(self, folder, flags):
+        entryid = self.hierarchy._sourcekeys.get(folder.sourcekey)
+        if entryid:
+            self.hierarchy._remove(entryid)
+        self.changes += 1
+
+class Hierarchy(object):
+    """Hierarchy class
+
+    In-memory snapshot of the folder hierarchy of a :class:`Store`, read
+    from the (recursive) hierarchy table of the root folder in one go.
+
+    For each folder (by entryid), the snapshot holds its parent entryid,
+    name, depth (the root folder having depth 0), content and unread
+    counts and sourcekey. Folder paths, subfolder counts and sourcekey
+    lookups are computed from these, without opening any folder.
+
+    The snapshot is refreshed incrementally using hierarchy
+    synchronization, either explicitly (see :func:`update`) or on next
+    use after changes made through the respective :class:`Store`.
+    Folders created, renamed, moved or deleted by other clients (or
+    through another :class:`Store` instance) remain stale until
+    :func:`update` is called. Content and unread counts are not
+    refreshed by content changes.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._entries = {}
+        self._children = collections.defaultdict(set)
+        self._sourcekeys = {}
+        self._stale = False
+
+        root = store.root
+        special = store._special_entryids()
+        # public store tables use the unconverted subtree entryid (see
+        # Folder.path), so both forms end a path
+        self._subtrees = set()
+        if 'subtree' in special:
+            self._subtrees.add(_benc(special['subtree']))
+        public_subtree = store.get(PR_EC_PUBLIC_IPM_SUBTREE_ENTRYID)
+        if public_subtree:
+            self._subtrees.add(_benc(public_subtree))
+
+        # catch up first, so changes during the table read are not lost
+        self.state = _ics.hierarchy_state(root.mapiobj)
+
+        self.root = root.entryid
+        values = [None if PROP_TYPE(prop.ulPropTag) == PT_ERROR else
+            prop.Value for prop in
+            root.mapiobj.GetProps(COLUMNS, MAPI_UNICODE)]
+        self._entries[self.root] = HierarchyEntry(None, 'ROOT', 0,
+            values[4], values[5], values[3] and _benc(values[3]))
+        if values[3]:
+            self._sourcekeys[_benc(values[3])] = self.root
+
+        mapitable = root.mapiobj.GetHierarchyTable(
+            MAPI_UNICODE | CONVENIENT_DEPTH | MAPI_DEFERRED_ERRORS)
+        table = Table(store.server, root.mapiobj, mapitable,
+            PR_CONTAINER_HIERARCHY, columns=COLUMNS)
+        columns = _RowColumns(COLUMNS, {})
+        rows = [row._values for row in table._row_objects(columns)]
+
+        # add folders top-down, so depths follow from the parents
+        pending = collections.defaultdict(list)
+        for values in rows:
+            pending[_benc(values[1])].append(values)
+        todo = [self.root]
+        while todo:
+            parent = todo.pop()
+            for values in pending.pop(parent, ()):
+                todo.append(self._set(*values))
+
+        # folders with unknown parent (should not happen)
+        for orphans in pending.values():
+            for values in orphans:
+                self._set(*values)
+
+    def _parent(self, entryid):
+        # map converted public subtree entryid to the one in the table
+        if entryid not in self._entries and entryid in self._subtrees:
+            for subtree in self._subtrees:
+                if subtree in self._entries:
+                    return subtree
+        return entryid
+
+    def _set(self, entryid, parent, name, sourcekey, count, unread):
+        # add or update folder, from table row or folder properties
+        entryid = _benc(entryid)
+        parent = self._parent(_benc(parent))
+        parent_entry = self._entries.get(parent)
+        depth = parent_entry.depth + 1 if parent_entry else 1
+        sourcekey = sourcekey and _benc(sourcekey)
+
+        old = self._entries.get(entryid)
+        if old:
+            self._children[old.parent].discard(entryid)
+        self._children[parent].add(entryid)
+        self._entries[entryid] = HierarchyEntry(parent, name or '', depth,
+            count, unread, sourcekey)
+        if sourcekey:
+            self._sourcekeys[sourcekey] = entryid
+
+        if old and old.depth != depth: # moved
+            self._set_depth(entryid, depth)
+        return entryid
+
+    def _set_depth(self, entryid, depth):
+        for child in self._children.get(entryid, ()):
+            self._entries[child] = \
+                self._entries[child]._replace(depth=depth + 1)
+            self._set_depth(child, depth + 1)
+
+    def _remove(self, entryid):
+        for child in list(self._children.pop(entryid, ())):
+            self._remove(child)
+        entry = self._entries.pop(entryid, None)
+        if entry:
+            self._children[entry.parent].discard(entryid)
+            self._sourcekeys.pop(entry.sourcekey, None)
+
+    def update(self):
+        """Apply hierarchy changes since the snapshot was read or
+        last updated. Return the number of changes."""
+        importer = _Importer(self)
+        self.state = self.store.root.sync_hierarchy(importer, self.state)
+        self._stale = False
+        return importer.changes
+
+    def __getitem__(self, entryid):
+        try:
+            return self._entries[entryid]
+        except KeyError:
+            raise NotFoundError("no folder with entryid '%s'" % entryid)
+
+    def __contains__(self, entryid):
+        return entryid in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def path(self, entryid):
+        """Return path of folder with given entryid (relative to the
+        subtree), or *None* for the subtree and folders outside it.
+
+        :param entryid: Folder entryid
+        """
+        names = []
+        entry = self[entryid]
+        while entryid not in self._subtrees:
+            if entryid == self.root or entry is None:
+                return
+            names.append(entry.name.replace('/', '\\/'))
+            entryid = entry.parent
+            entry = self._entries.get(entryid)
+        return '/'.join(reversed(names)) if names else None
+
+    def subfolder_count(self, entryid):
+        """Return direct subfolder count of folder with given entryid.
+
+        :param entryid: Folder entryid
+        """
+        self[entryid]
+        return len(self._children.get(entryid, ()))
+
+    def subfolder_count_recursive(self, entryid):
+        """Return subfolder count (recursive) of folder with given entryid.
+
+        :param entryid: Folder entryid
+        """
+        self[entryid]
+        count = 0
+        todo = [entryid]
+        while todo:
+            children = self._children.get(todo.pop(), ())
+            count += len(children)
+            todo.extend(children)
+        return count
+
+    def entryid(self, sourcekey):
+        """Return entryid of folder with given sourcekey.
+
+        :param sourcekey: Folder sourcekey
+        """
+        try:
+            return self._sourcekeys[sourcekey]
+        except KeyError:
+            raise NotFoundError("no folder with sourcekey '%s'" % sourcekey)
+
+    def __unicode__(self):
+        return 'Hierarchy(%s)' % self.store.name
+
+    def __repr__(self):
+        return self.__unicode__()
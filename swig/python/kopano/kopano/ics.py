@@ -76,13 +76,20 @@ class TrackingHierarchyImporter(ECImportHierarchyChanges):
         self.importer = importer
         self.stats = stats
 
+    def _invalidate(self):
+        # special folders may have been moved, replaced or deleted
+        if self.importer.store:
+            self.importer.store._special = None
+
     def ImportFolderChange(self, props):
+        self._invalidate()
         if hasattr(self.importer, 'update'):
             eid = _benc(PpropFindProp(props, PR_ENTRYID).Value)
             folder = _folder.Folder(store=self.importer.store, entryid=eid)
             self.importer.update(folder)
 
     def ImportFolderDeletion(self, flags, sourcekeys):
+        self._invalidate()
         if hasattr(self.importer, 'delete'):
             for sourcekey in sourcekeys:
                 folder = _folder.Folder(self.importer.store,
@@ -221,6 +228,19 @@ def state(mapiobj, associated=False):
     stream.Seek(0, STREAM_SEEK_SET)
     return _benc(stream.Read(0xFFFFF))
 
+def hierarchy_state(mapiobj):
+    exporter = mapiobj.OpenProperty(
+        PR_HIERARCHY_SYNCHRONIZER, IID_IExchangeExportChanges, 0, 0)
+    exporter.Config(None, SYNC_NORMAL | SYNC_CATCHUP,
+        None, None, None, None, 0)
+    steps, step = None, 0
+    while steps != step:
+        steps, step = exporter.Synchronize(step)
+    stream = IStream()
+    exporter.UpdateState(stream)
+    stream.Seek(0, STREAM_SEEK_SET)
+    return _benc(stream.Read(0xFFFFF))
+
 def sync_hierarchy(server, syncobj, importer, state, stats=None):
     importer = TrackingHierarchyImporter(server, importer, stats)
     exporter = syncobj.OpenProperty(PR_HIERARCHY_SYNCHRONIZER,
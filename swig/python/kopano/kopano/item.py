@@ -235,6 +235,10 @@ class Item(Properties, Contact, Appointment):
         if not self._mapiobj:
             self.mapiobj = _utils.openentry_raw(self.store.mapiobj,
                 self._entryid, self._content_flag)
+            # preloaded table data may become stale once the item is
+            # changed, while reading the opened item is cheap
+            if self._preload is not None:
+                self._cache = {}
         return self._mapiobj
 
     @mapiobj.setter
@@ -270,6 +274,10 @@ class Item(Properties, Contact, Appointment):
                 self._architem = self.mapiobj
         return self._architem
 
+    @property
+    def _name_store(self):
+        return getattr(self, 'store', None)
+
     @property
     def entryid(self):
         """Item entryid."""
@@ -1082,6 +1090,8 @@ class Item(Properties, Contact, Appointment):
                 _copytags(self.mapiobj))
         if proptags:
             self.mapiobj.DeleteProps(proptags)
+            for proptag in proptags:
+                self._cache.pop(proptag, None)
         for attach_id in attach_ids:
             self._arch_item.DeleteAttach(attach_id, 0, None, 0)
 
@@ -1153,11 +1163,8 @@ class Item(Properties, Contact, Appointment):
                     PR_RTF_COMPRESSED) and prop.proptag != bestbody):
                 continue
             if prop.named: # named prop: prop.id_ system dependent...
-                data = [
-                    prop.proptag,
-                    prop.mapiobj.Value,
-                    self.mapiobj.GetNamesFromIDs([prop.proptag], None, 0)[0]
-                ]
+                # (names are resolved at once by props())
+                data = [prop.proptag, prop.mapiobj.Value, prop._lpname]
                 if not archiver and data[2].guid == PSETID_Archive:
                     continue
             else:
@@ -1203,6 +1210,8 @@ class Item(Properties, Contact, Appointment):
                             IID_IMessage, 0, MAPI_DEFERRED_ERRORS)
                     item = Item(mapiobj=msg)
                     item.server = self.server # TODO
+                    if self._name_store:
+                        item.store = self._name_store
                     data = item._dump(_main_item=_main_item) # recursion
                     atts.append(([[a, b, None] for a, b in row.items()], data))
                 elif method == ATTACH_BY_VALUE and attachments:
@@ -1240,6 +1249,8 @@ entryid %s', _main_item.entryid)
         """
         item = Item(mapiobj=self._arch_item) # TODO make configurable?
         item.server = self.server
+        if item.mapiobj is self.mapiobj and self._name_store: # not archived
+            item.store = self._name_store
         pickle.dump(item._dump(attachments=attachments, archiver=archiver),
             f, protocol=2)
 
@@ -1247,16 +1258,29 @@ entryid %s', _main_item.entryid)
         """Serialize item."""
         item = Item(mapiobj=self._arch_item) # TODO make configurable?
         item.server = self.server
+        if item.mapiobj is self.mapiobj and self._name_store: # not archived
+            item.store = self._name_store
         return pickle.dumps(item._dump(attachments=attachments,
             archiver=archiver, skip_broken=skip_broken), protocol=2)
 
     def _load(self, d, attachments):
+        # named props: resolve all names at once
+        nameids = [nameid for _, _, nameid in d[b'props']
+            if nameid is not None]
+        if not nameids:
+            ids = []
+        elif self._name_store:
+            ids = self._name_store._name_ids(nameids, MAPI_CREATE,
+                self.mapiobj)
+        else:
+            ids = self.mapiobj.GetIDsFromNames(nameids, MAPI_CREATE)
+        ids = iter(ids)
+
         # props
         props = []
         for proptag, value, nameid in d[b'props']:
             if nameid is not None:
-                proptag = self.mapiobj.GetIDsFromNames(
-                    [nameid], MAPI_CREATE)[0] | (proptag & 0xffff)
+                proptag = next(ids) | (proptag & 0xffff)
             if ((proptag >> 16) not in \
                 (PR_BODY >> 16, PR_HTML >> 16, PR_RTF_COMPRESSED >> 16) or \
                 value not in (MAPI_E_NOT_FOUND, MAPI_E_NOT_ENOUGH_MEMORY)):
@@ -1280,6 +1304,8 @@ entryid %s', _main_item.entryid)
                     msg = attach.OpenProperty(PR_ATTACH_DATA_OBJ,
                         IID_IMessage, 0, MAPI_CREATE | MAPI_MODIFY)
                     item = Item(mapiobj=msg)
+                    if self._name_store:
+                        item.store = self._name_store
                     item._load(data, attachments) # recursion
                 else:
                     stream = attach.OpenProperty(PR_ATTACH_DATA_BIN,
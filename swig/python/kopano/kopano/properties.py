@@ -32,12 +32,27 @@ class Properties(object):
     such as :class:`Item <Item>` and :class:`Folder <Folder>`.
     """
 
+    # adaptive preloading of table columns, see Folder.items()
+    _preload = None
+
+    @property
+    def _name_store(self):
+        # store caching named property IDs for this object (if any)
+        return None
+
     def prop(self, proptag, create=False, proptype=None):
         """Return :class:`property <Property>` with given property tag.
 
         :param proptag: MAPI property tag
         :param create: create property if it doesn't exist
         """
+        if self._preload is not None and isinstance(proptag, int):
+            if create:
+                self._cache.pop(proptag, None)
+            else:
+                prop = self._preload.prop(self, proptag)
+                if prop is not None:
+                    return prop
         return _prop.prop(self, self.mapiobj, proptag, create=create,
                           proptype=proptype)
 
@@ -58,11 +73,13 @@ class Properties(object):
         :param proptag: MAPI property tag
         :param value: property value (or a default value is used)
         """
+        if self._preload is not None:
+            self._cache.pop(proptag, None)
         return _prop.create_prop(self, self.mapiobj, proptag, value, proptype)
 
     def props(self, namespace=None):
         """Return all :class:`properties <Property>`."""
-        return _prop.props(self.mapiobj, namespace)
+        return _prop.props(self.mapiobj, namespace, self._name_store)
 
     # mapi objects/properties are basically key-value stores
     # so the following provides some useful dict-like behaviour
@@ -129,7 +129,7 @@ def _split_proptag(proptag): # TODO syntax error exception
         proptype, namespace, name = parts
         return TYPEMAP[proptype], namespace, name
 
-def _name_to_proptag(proptag, mapiobj, proptype=None):
+def _name_to_proptag(proptag, mapiobj, proptype=None, store=None):
     ptype, namespace, name = _split_proptag(proptag)
     proptype = proptype or ptype
 
@@ -149,7 +149,10 @@ def _name_to_proptag(proptag, mapiobj, proptype=None):
     nameid = MAPINAMEID(guid, MNID_ID if isinstance(name, int) else \
         MNID_STRING, name)
     # TODO MAPI_CREATE, or too dangerous because of potential db overflow?
-    lpname = mapiobj.GetIDsFromNames([nameid], 0)
+    if store is not None:
+        lpname = store._name_ids([nameid], 0, mapiobj)
+    else:
+        lpname = mapiobj.GetIDsFromNames([nameid], 0)
     proptag = CHANGE_PROP_TYPE(lpname[0], proptype)
 
     return proptag, proptype, namespace, name
@@ -166,7 +169,7 @@ def create_prop(self, mapiobj, proptag, value=None, proptype=None):
 
     else: # named property
         proptag2, proptype2, _, _ = \
-            _name_to_proptag(proptag, mapiobj, proptype)
+            _name_to_proptag(proptag, mapiobj, proptype, self._name_store)
 
         if proptype2 is None:
             # TODO exception too general?
@@ -204,6 +207,7 @@ def create_prop(self, mapiobj, proptag, value=None, proptype=None):
 
 # TODO self
 def prop(self, mapiobj, proptag, create=False, value=None, proptype=None):
+    store = self._name_store
     if isinstance(proptag, int) or \
        (isinstance(proptag, str) and ':' not in proptag):
         # search for property
@@ -222,22 +226,22 @@ def prop(self, mapiobj, proptag, create=False, value=None, proptype=None):
             else:
                 raise NotFoundError('no such property: %s' %
                     REV_TAG.get(proptag, hex(proptag)))
-        return Property(mapiobj, sprop)
+        return Property(mapiobj, sprop, store)
 
     else: # named property
         proptag2, proptype2, namespace, name = \
-            _name_to_proptag(proptag, mapiobj, proptype)
+            _name_to_proptag(proptag, mapiobj, proptype, store)
 
         # search for property
         if proptype2:
             try:
                 # TODO merge two main branches?
                 sprop = HrGetOneProp(mapiobj, proptag2)
-                return Property(mapiobj, sprop)
+                return Property(mapiobj, sprop, store)
             except MAPIErrorNotEnoughMemory:
                 data = _utils.stream(mapiobj, proptag2)
                 sprop = SPropValue(proptag2, data)
-                return Property(mapiobj, sprop)
+                return Property(mapiobj, sprop, store)
             except MAPIErrorNotFound:
                 pass
         else:
@@ -253,12 +257,30 @@ def prop(self, mapiobj, proptag, create=False, value=None, proptype=None):
         else:
             raise NotFoundError('no such property: %s' % proptag)
 
-def props(mapiobj, namespace=None):
+def _names(mapiobj, proptags, store=None):
+    # resolve names of named properties in a single call (or from the
+    # cache of the store, if given)
+    if store is not None:
+        return store._id_names(proptags, mapiobj)
+    if not proptags:
+        return []
+    try:
+        return mapiobj.GetNamesFromIDs(proptags, None, 0)
+    except MAPIErrorNoSupport: # TODO user.props()?
+        return [None] * len(proptags)
+
+def props(mapiobj, namespace=None, store=None):
     proptags = mapiobj.GetPropList(MAPI_UNICODE)
     sprops = mapiobj.GetProps(proptags, MAPI_UNICODE)
     sprops = [s for s in sprops if not \
         (PROP_TYPE(s.ulPropTag) == PT_ERROR and s.Value == MAPI_E_NOT_FOUND)]
-    props = [Property(mapiobj, sprop) for sprop in sprops]
+    props = [Property(mapiobj, sprop, store) for sprop in sprops]
+
+    # resolve all names at once, instead of per property
+    named = [p for p in props if p.id_ >= 0x8000]
+    lpnames = _names(mapiobj, [p.proptag for p in named], store)
+    for p, lpname in zip(named, lpnames):
+        p._lpname = lpname
 
     def prop_key(prop): # sort identically across servers
         if prop.named:
@@ -270,6 +292,15 @@ def props(mapiobj, namespace=None):
         if not namespace or p.namespace == namespace:
             yield p
 
+def _systime(value):
+    # PT_SYSTIME value to timezone-unaware system-local datetime
+    # TODO add global flag to enable tz-aware UTC datetimes
+    try:
+        value = datetime.datetime.utcfromtimestamp(value.unixtime)
+        return _timezone._from_utc(value, _timezone.LOCAL)
+    except ValueError: # Y10K: datetime is limited to 4-digit years
+        return datetime.datetime(9999, 1, 1)
+
 # do not get full property contents, only when explicitly requested
 class SPropDelayedValue(SPropValue):
     def __init__(self, mapiobj, proptag):
@@ -293,8 +324,9 @@ class Property(object):
     Low-level abstraction for MAPI properties.
     """
 
-    def __init__(self, parent_mapiobj, mapiobj):
+    def __init__(self, parent_mapiobj, mapiobj, store=None):
         self._parent_mapiobj = parent_mapiobj
+        self._store = store
         #: MAPI proptag, for example 0x37001f for PR_SUBJECT_W
         self.proptag = mapiobj.ulPropTag
 
@@ -352,13 +384,14 @@ class Property(object):
     @property
     def _lpname(self):
         if self.__lpname is None and self.id_ >= 0x8000:
-            try:
-                self.__lpname = self._parent_mapiobj.GetNamesFromIDs(
-                    [self.proptag], None, 0)[0]
-            except MAPIErrorNoSupport: # TODO user.props()?
-                pass
+            self.__lpname = _names(self._parent_mapiobj, [self.proptag],
+                self._store)[0]
         return self.__lpname
 
+    @_lpname.setter
+    def _lpname(self, lpname):
+        self.__lpname = lpname
+
     @property
     def named(self):
         """Is the property a named property."""
@@ -409,13 +442,7 @@ class Property(object):
         """
         if self._value is None:
             if self.type_ == PT_SYSTIME: # TODO generalize, property?
-                # TODO add global flag to enable tz-aware UTC datetimes
-                try:
-                    value = datetime.datetime.utcfromtimestamp(self.mapiobj.Value.unixtime)
-                    value = _timezone._from_utc(value, _timezone.LOCAL)
-                except ValueError: # Y10K: datetime is limited to 4-digit years
-                    value = datetime.datetime(9999, 1, 1)
-                self._value = value
+                self._value = _systime(self.mapiobj.Value)
             else:
                 self._value = self.mapiobj.Value
         return self._value
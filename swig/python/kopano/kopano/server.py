@@ -46,7 +46,7 @@ from MAPI.Tags import (
     PR_STORE_ENTRYID, EC_PROFILE_FLAGS_NO_UID_AUTH, PR_EC_STATS_SYSTEM_VALUE,
     EC_PROFILE_FLAGS_NO_NOTIFICATIONS, EC_PROFILE_FLAGS_OIDC,
     PR_FREEBUSY_ENTRYIDS,
-    PR_OBJECT_TYPE, PR_DISPLAY_TYPE,
+    PR_OBJECT_TYPE, PR_DISPLAY_TYPE, PR_SMTP_ADDRESS_W,
 )
 from MAPI.Tags import (
     IID_IMsgStore, IID_IMAPITable, IID_IExchangeManageStore,
@@ -60,7 +60,7 @@ from .errors import (
 from .log import LOG, _loglevel
 
 from .parser import parser
-from .table import Table
+from .table import Table, Row, _RowColumns, _sorttags
 from .company import Company
 from .group import Group
 from .query import _query_to_restriction
@@ -88,6 +88,23 @@ try:
 except ImportError: # pragma: no cover
     _utils = sys.modules[__package__ + '.utils']
 
+USER_PROPMAP = {
+    'name': PR_ACCOUNT_W,
+    'fullname': PR_DISPLAY_NAME_W,
+    'email': PR_SMTP_ADDRESS_W,
+    'entryid': PR_ENTRYID,
+}
+
+class UserRow(Row):
+    """Lightweight user row, see :func:`Server.user_rows`."""
+
+    __slots__ = ()
+
+    def user(self):
+        """Return full :class:`user <User>` for row."""
+        return _user.User(server=self._context,
+            userid=_benc(self._raw(PR_ENTRYID)))
+
 def _timed_cache(seconds=0, minutes=0, hours=0, days=0):
     # used with permission from will mcgugan, https://www.willmcgugan.com
     time_delta = datetime.timedelta(
@@ -597,6 +614,49 @@ password incorrect')
                         return
                     pos += 1
 
+    def user_rows(self, columns=('name', 'fullname', 'email'),
+            restriction=None, order=None, batch_size=None, system=False,
+            page_start=None, page_limit=None):
+        """Return lightweight :class:`rows <UserRow>` for users in the
+        global address book, containing only the given columns. This
+        is much faster than :func:`users` when only a few attributes
+        are needed.
+
+        :param columns: column names (*name*, *fullname*, *email* or
+            *entryid*) and/or proptags
+        :param restriction: apply :class:`restriction <Restriction>`
+        :param order: order by column name(s), e.g. 'name', '-name'
+            (reverse order), or ('fullname', 'name')
+        :param batch_size: number of rows to fetch per server call
+            (adapted to server response times by default)
+        :param system: Include system users (default False)
+        """
+        row_columns = _RowColumns(columns, USER_PROPMAP)
+        row_columns.add(PR_ENTRYID)
+
+        restrictions = [
+            SPropertyRestriction(RELOP_EQ, PR_OBJECT_TYPE,
+                SPropValue(PR_OBJECT_TYPE, MAPI_MAILUSER)),
+            SPropertyRestriction(RELOP_NE, PR_DISPLAY_TYPE,
+                SPropValue(PR_DISPLAY_TYPE, DT_REMOTE_MAILUSER))
+        ]
+        if not system:
+            restrictions.append(SPropertyRestriction(RELOP_NE, PR_ACCOUNT_W,
+                SPropValue(PR_ACCOUNT_W, 'SYSTEM')))
+        if restriction:
+            restrictions.append(restriction.mapiobj)
+
+        table = Table(self, self.gab, self.gab.GetContentsTable(0),
+            columns=row_columns.proptags)
+        table.mapitable.Restrict(SAndRestriction(restrictions), TBL_BATCH)
+        if order is not None:
+            table.sort(_sorttags(order, USER_PROPMAP))
+
+        for row in table._row_objects(row_columns, UserRow, self,
+                batch_size=batch_size, page_start=page_start,
+                page_limit=page_limit):
+            yield row
+
     def create_user(self, name, email=None, password=None, company=None,
             fullname=None, create_store=True):
         """Create a new :class:`user <User>` on the server.
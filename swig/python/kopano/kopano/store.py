@@ -16,11 +16,11 @@ import sys
 from MAPI import (
     MAPI_UNICODE, MAPI_MODIFY, PT_MV_BINARY, RELOP_EQ,
     TBL_BATCH, ECSTORE_TYPE_PUBLIC, FOLDER_SEARCH, MAPI_ASSOCIATED,
-    MAPI_DEFERRED_ERRORS, ROW_REMOVE, MAPI_CREATE,
+    MAPI_DEFERRED_ERRORS, ROW_REMOVE, MAPI_CREATE, PT_ERROR,
     ECSTORE_TYPE_PRIVATE, ECSTORE_TYPE_ARCHIVE, KEEP_OPEN_READWRITE,
 )
 from MAPI.Defs import (
-    HrGetOneProp, CHANGE_PROP_TYPE, PpropFindProp
+    HrGetOneProp, CHANGE_PROP_TYPE, PpropFindProp, PROP_ID, PROP_TYPE
 )
 from MAPI.Tags import (
     PR_ENTRYID, PR_MDB_PROVIDER, ZARAFA_STORE_PUBLIC_GUID,
@@ -68,6 +68,7 @@ from .permission import Permission, _permissions_dumps, _permissions_loads
 from .freebusy import FreeBusy
 from .table import Table
 from .restriction import Restriction
+from .hierarchy import Hierarchy
 
 from . import notification as _notification
 
@@ -95,6 +96,33 @@ SETTINGS_PROPTAGS = (
     PR_EC_OUTOFOFFICE, PR_EC_OUTOFOFFICE_FROM, PR_EC_OUTOFOFFICE_UNTIL,
 )
 
+# special folders, found via the store or the root folder (and the inbox via
+# the receive folder)
+STORE_SPECIAL_PROPTAGS = (
+    ('subtree', PR_IPM_SUBTREE_ENTRYID),
+    ('public_subtree', PR_IPM_PUBLIC_FOLDERS_ENTRYID),
+    ('findroot', PR_FINDER_ENTRYID),
+    ('outbox', PR_IPM_OUTBOX_ENTRYID),
+    ('wastebasket', PR_IPM_WASTEBASKET_ENTRYID),
+    ('sentmail', PR_IPM_SENTMAIL_ENTRYID),
+    ('views', PR_VIEWS_ENTRYID),
+    ('common_views', PR_COMMON_VIEWS_ENTRYID),
+)
+ROOT_SPECIAL_PROPTAGS = (
+    ('root', PR_ENTRYID),
+    ('junk', PR_ADDITIONAL_REN_ENTRYIDS),
+    ('calendar', PR_IPM_APPOINTMENT_ENTRYID),
+    ('contacts', PR_IPM_CONTACT_ENTRYID),
+    ('drafts', PR_IPM_DRAFTS_ENTRYID),
+    ('journal', PR_IPM_JOURNAL_ENTRYID),
+    ('notes', PR_IPM_NOTE_ENTRYID),
+    ('tasks', PR_IPM_TASK_ENTRYID),
+    ('reminders', PR_REM_ONLINE_ENTRYID),
+)
+SPECIAL_FOLDERS = ('inbox',) + tuple(
+    name for name, _ in STORE_SPECIAL_PROPTAGS + ROOT_SPECIAL_PROPTAGS
+    if name != 'public_subtree')
+
 
 class Store(Properties):
     """Store class.
@@ -142,7 +170,10 @@ class Store(Properties):
         self.__root = None
 
         self._name_id_cache = {}
+        self._id_name_cache = {}
         self._pidlid_cache = {}
+        self._special = None
+        self._hierarchy = None
 
     @property
     def _root(self):
@@ -182,6 +213,16 @@ class Store(Properties):
         """Hierarchy (SQL) id."""
         return self.prop(PR_EC_HIERARCHYID).value
 
+    @property
+    def hierarchy(self):
+        """Folder :class:`hierarchy <Hierarchy>` snapshot, read on first
+        use. Once read, :class:`folders <Folder>` use it to determine
+        their path, sourcekey and subfolder counts. Changes by other
+        clients are only seen after :func:`Hierarchy.update`."""
+        if self._hierarchy is None:
+            self._hierarchy = Hierarchy(self)
+        return self._hierarchy
+
     @property
     def webapp_settings(self):
         """Webapp settings (JSON)."""
@@ -191,6 +232,72 @@ class Store(Properties):
         except NotFoundError:
             pass
 
+    def _special_entryids(self):
+        # special folder entryids, from one GetProps on the store, the root
+        # folder and the receive folder, until a setter or hierarchy change
+        if self._special is None:
+            special = {}
+            props = self.mapiobj.GetProps(
+                [PR_MDB_PROVIDER] + [t for _, t in STORE_SPECIAL_PROPTAGS],
+                MAPI_UNICODE)
+            public = props[0].Value == ZARAFA_STORE_PUBLIC_GUID
+            for (name, _), prop in zip(STORE_SPECIAL_PROPTAGS, props[1:]):
+                if PROP_TYPE(prop.ulPropTag) == PT_ERROR:
+                    continue
+                if name == 'subtree' and public:
+                    continue
+                if name == 'public_subtree':
+                    if not public:
+                        continue
+                    name = 'subtree'
+                special[name] = prop.Value
+
+            props = self._root.GetProps(
+                [t for _, t in ROOT_SPECIAL_PROPTAGS], MAPI_UNICODE)
+            for (name, _), prop in zip(ROOT_SPECIAL_PROPTAGS, props):
+                if PROP_TYPE(prop.ulPropTag) == PT_ERROR:
+                    continue
+                if name == 'junk':
+                    # PR_ADDITIONAL_REN_ENTRYIDS is a multi-value property.
+                    # The 4th entry points to the junk folder
+                    if len(prop.Value) <= 4 or not prop.Value[4]:
+                        continue
+                    special[name] = prop.Value[4]
+                else:
+                    special[name] = prop.Value
+
+            try:
+                special['inbox'] = \
+                    self.mapiobj.GetReceiveFolder('IPM', MAPI_UNICODE)[0]
+            except (MAPIErrorNotFound, MAPIErrorNoSupport):
+                pass
+
+            self._special = special
+        return self._special
+
+    def _special_folder(self, name):
+        entryid = self._special_entryids().get(name)
+        if entryid:
+            try:
+                return _folder.Folder(self, _benc(entryid))
+            except NotFoundError:
+                pass
+
+    def is_special(self, folder, name):
+        """Return *True* if the given :class:`Folder` is the special folder
+        with the given name (for example, 'inbox' or 'junk'), comparing
+        entryids, so neither folder has to be opened.
+
+        :param folder: The folder (or *None*)
+        :param name: Special folder name (one of *SPECIAL_FOLDERS*)
+        """
+        if name not in SPECIAL_FOLDERS:
+            raise ArgumentError('no such special folder: %s' % name)
+        if folder is None:
+            return False
+        entryid = self._special_entryids().get(name)
+        return bool(entryid) and folder._entryid == entryid
+
     def _set_special_folder(self, folder, proptag, container_class=None):
         _root = self.mapiobj.OpenEntry(None, None, MAPI_MODIFY)
 
@@ -209,6 +316,7 @@ class Store(Properties):
             if self.inbox:
                 self.inbox.mapiobj.SetProps([SPropValue(proptag, _bdec(folder.entryid))])
         _utils._save(self._root)
+        self._special = None
 
         if container_class:
             folder.container_class = container_class
@@ -217,65 +325,43 @@ class Store(Properties):
             if prop:
                 folder.delete(prop)
 
+    def _set_store_special_folder(self, folder, proptag):
+        self[proptag] = _bdec(folder.entryid)
+        self._special = None
+
     @property
     def root(self):
         """The user-invisible store root :class:`Folder`."""
-        try:
-            return _folder.Folder(self,
-                _benc(HrGetOneProp(self._root, PR_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('root')
 
     @property
     def subtree(self):
         """The user-visible store root :class:`Folder`."""
-        try:
-            if self.public:
-                ipmsubtreeid = HrGetOneProp(
-                    self.mapiobj, PR_IPM_PUBLIC_FOLDERS_ENTRYID).Value
-            else:
-                ipmsubtreeid = HrGetOneProp(
-                    self.mapiobj, PR_IPM_SUBTREE_ENTRYID).Value
-
-            return _folder.Folder(self, _benc(ipmsubtreeid))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('subtree')
 
     @subtree.setter
     def subtree(self, folder):
-        self[PR_IPM_SUBTREE_ENTRYID] = _bdec(folder.entryid)
+        self._set_store_special_folder(folder, PR_IPM_SUBTREE_ENTRYID)
 
     @property
     def findroot(self):
         """The user-invisible store search folder :class:`Folder`."""
-        try:
-            return _folder.Folder(self,
-                _benc(HrGetOneProp(self.mapiobj, PR_FINDER_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('findroot')
 
     @findroot.setter
     def findroot(self, folder):
-        self[PR_FINDER_ENTRYID] = _bdec(folder.entryid)
+        self._set_store_special_folder(folder, PR_FINDER_ENTRYID)
 
     @property
     def reminders(self):
         """The user-invisible store reminder :class:`Folder`."""
-        try:
-            return _folder.Folder(self,
-                _benc(HrGetOneProp(self._root, PR_REM_ONLINE_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('reminders')
     # TODO setter
 
     @property
     def inbox(self):
         """The store :class:`inbox <Folder>`."""
-        try:
-            return _folder.Folder(self,
-                _benc(self.mapiobj.GetReceiveFolder('IPM', MAPI_UNICODE)[0]))
-        except (MAPIErrorNotFound, NotFoundError, MAPIErrorNoSupport):
-            pass
+        return self._special_folder('inbox')
 
     @inbox.setter
     def inbox(self, folder):
@@ -283,17 +369,12 @@ class Store(Properties):
         for messageclass in ('', 'IPM', 'REPORT.IPM'):
             self.mapiobj.SetReceiveFolder(
                 messageclass, MAPI_UNICODE, _bdec(folder.entryid))
+        self._special = None
 
     @property
     def junk(self):
         """The store :class:`junk folder <Folder>`."""
-        # PR_ADDITIONAL_REN_ENTRYIDS is a multi-value property.
-        # The 4th entry points to the junk folder
-        try:
-            return _folder.Folder(self,_benc(HrGetOneProp(
-                self._root, PR_ADDITIONAL_REN_ENTRYIDS).Value[4]))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('junk')
 
     @junk.setter
     def junk(self, folder):
@@ -303,11 +384,7 @@ class Store(Properties):
     @property
     def calendar(self):
         """The store (default) :class:`calendar <Folder>`."""
-        try:
-            return _folder.Folder(self,_benc(HrGetOneProp(
-                self._root, PR_IPM_APPOINTMENT_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('calendar')
 
     @calendar.setter
     def calendar(self, folder):
@@ -317,25 +394,17 @@ class Store(Properties):
     @property
     def outbox(self):
         """The store :class:`outbox <Folder>`."""
-        try:
-            return _folder.Folder(self,
-                _benc(HrGetOneProp(self.mapiobj, PR_IPM_OUTBOX_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('outbox')
 
     @outbox.setter
     def outbox(self, folder):
-        self[PR_IPM_OUTBOX_ENTRYID] = _bdec(folder.entryid)
+        self._set_store_special_folder(folder, PR_IPM_OUTBOX_ENTRYID)
         # TODO clear container class
 
     @property
     def contacts(self):
         """The store (default) :class:`contacts folder <Folder>`."""
-        try:
-            return _folder.Folder(self,
-                _benc(HrGetOneProp(self._root, PR_IPM_CONTACT_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('contacts')
 
     @contacts.setter
     def contacts(self, folder):
@@ -346,40 +415,28 @@ class Store(Properties):
     def views(self):
         """:class:`Folder` containing sub-folders acting as special views
         on the message store."""
-        try:
-            return _folder.Folder(
-                self, _benc(self.prop(PR_VIEWS_ENTRYID).value))
-        except NotFoundError:
-            pass
+        return self._special_folder('views')
 
     @views.setter
     def views(self, folder):
-        self[PR_VIEWS_ENTRYID] = _bdec(folder.entryid)
+        self._set_store_special_folder(folder, PR_VIEWS_ENTRYID)
         # TODO clear container class
 
     @property
     def common_views(self):
         """:class:`Folder` containing sub-folders acting as special views
         on the message store."""
-        try:
-            return _folder.Folder(self,
-                _benc(self.prop(PR_COMMON_VIEWS_ENTRYID).value))
-        except NotFoundError:
-            pass
+        return self._special_folder('common_views')
 
     @common_views.setter
     def common_views(self, folder):
-        self[PR_COMMON_VIEWS_ENTRYID] = _bdec(folder.entryid)
+        self._set_store_special_folder(folder, PR_COMMON_VIEWS_ENTRYID)
         # TODO clear container class
 
     @property
     def drafts(self):
         """The store :class:`drafts folder <Folder>`."""
-        try:
-            return _folder.Folder(self, _benc(HrGetOneProp(
-                self._root, PR_IPM_DRAFTS_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('drafts')
 
     @drafts.setter
     def drafts(self, folder):
@@ -388,25 +445,17 @@ class Store(Properties):
     @property
     def wastebasket(self):
         """The store :class:`wastebasket <Folder>`."""
-        try:
-            return _folder.Folder(self, _benc(HrGetOneProp(
-                self.mapiobj, PR_IPM_WASTEBASKET_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('wastebasket')
 
     @wastebasket.setter
     def wastebasket(self, folder):
-        self[PR_IPM_WASTEBASKET_ENTRYID] = _bdec(folder.entryid)
+        self._set_store_special_folder(folder, PR_IPM_WASTEBASKET_ENTRYID)
         # TODO clear container class
 
     @property
     def journal(self):
         """The store :class:`journal folder <Folder>`."""
-        try:
-            return _folder.Folder(self, _benc(HrGetOneProp(
-                self._root, PR_IPM_JOURNAL_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('journal')
 
     @journal.setter
     def journal(self, folder):
@@ -415,11 +464,7 @@ class Store(Properties):
     @property
     def notes(self):
         """The store :class:`notes folder <Folder>`."""
-        try:
-            return _folder.Folder(self,
-                _benc(HrGetOneProp(self._root, PR_IPM_NOTE_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('notes')
 
     @notes.setter
     def notes(self, folder):
@@ -428,25 +473,17 @@ class Store(Properties):
     @property
     def sentmail(self):
         """The store :class:`sentmail folder <Folder>`."""
-        try:
-            return _folder.Folder(self, _benc(HrGetOneProp(
-                self.mapiobj, PR_IPM_SENTMAIL_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('sentmail')
 
     @sentmail.setter
     def sentmail(self, folder):
-        self[PR_IPM_SENTMAIL_ENTRYID] = _bdec(folder.entryid)
+        self._set_store_special_folder(folder, PR_IPM_SENTMAIL_ENTRYID)
         # TODO clear container class
 
     @property
     def tasks(self):
         """The store :class:`tasks folder <Folder>`."""
-        try:
-            return _folder.Folder(self,
-                _benc(HrGetOneProp(self._root, PR_IPM_TASK_ENTRYID).Value))
-        except (MAPIErrorNotFound, NotFoundError):
-            pass
+        return self._special_folder('tasks')
 
     @tasks.setter
     def tasks(self, folder):
@@ -638,7 +675,9 @@ class Store(Properties):
     def create_searchfolder(self, text=None):
         mapiobj = self.findroot.mapiobj.CreateFolder(FOLDER_SEARCH,
             str(uuid.uuid4()).encode(), 'comment'.encode(), None, 0)
-        return _folder.Folder(self, mapiobj=mapiobj)
+        folder = _folder.Folder(self, mapiobj=mapiobj)
+        folder._hierarchy_changed()
+        return folder
 
     def item(self, entryid=None, guid=None):
         """Return :class:`Item` with given entryid."""
@@ -1132,21 +1171,65 @@ class Store(Properties):
         """:class:`Freebusy <Freebusy>` information."""
         return FreeBusy(self)
 
+    @property
+    def _name_store(self):
+        return self
+
     def _name_id(self, name_tuple):
         # TODO: use _pidlid_proptag everywhere
-        id_ = self._name_id_cache.get(name_tuple)
-        if id_ is None:
-            named_props = [MAPINAMEID(*name_tuple)]
-            # TODO use MAPI_CREATE, or too dangerous because of
-            # potential db overflow?
-            id_ = self.mapiobj.GetIDsFromNames(named_props, 0)[0]
-            self._name_id_cache[name_tuple] = id_
-        return id_
+        # TODO use MAPI_CREATE, or too dangerous because of
+        # potential db overflow?
+        return self._name_ids([MAPINAMEID(*name_tuple)])[0]
+
+    def _name_ids(self, nameids, flags=0, mapiobj=None):
+        # resolve names to proptags (without type), in a single call
+        # for those not yet cached. unknown names (PT_ERROR) are not
+        # cached, as they may be created later on
+        keys = [(n.guid, n.kind, n.id) for n in nameids]
+        missing = {}
+        for nameid, key in zip(nameids, keys):
+            if key not in self._name_id_cache:
+                missing.setdefault(key, nameid)
+        found = {}
+        if missing:
+            ids = (mapiobj or self.mapiobj).GetIDsFromNames(
+                list(missing.values()), flags)
+            for key, id_ in zip(missing, ids):
+                found[key] = id_
+                if PROP_TYPE(id_) != PT_ERROR:
+                    self._name_id_cache[key] = id_
+                    self._id_name_cache[PROP_ID(id_)] = missing[key]
+        return [found[key] if key in found else self._name_id_cache[key]
+            for key in keys]
+
+    def _id_names(self, proptags, mapiobj=None):
+        # resolve proptags of named properties to names (None if
+        # unknown), in a single call for those not yet cached. unknown
+        # ids are not cached, as names may be created later on
+        missing = {}
+        for proptag in proptags:
+            if PROP_ID(proptag) not in self._id_name_cache:
+                missing.setdefault(PROP_ID(proptag), proptag)
+        found = {}
+        if missing:
+            try:
+                names = (mapiobj or self.mapiobj).GetNamesFromIDs(
+                    list(missing.values()), None, 0)
+            except MAPIErrorNoSupport:
+                names = [None] * len(missing)
+            for id_, name in zip(missing, names):
+                found[id_] = name
+                if name is not None:
+                    self._id_name_cache[id_] = name
+                    self._name_id_cache[(name.guid, name.kind, name.id)] = \
+                        id_ << 16
+        return [found[PROP_ID(p)] if PROP_ID(p) in found else
+            self._id_name_cache[PROP_ID(p)] for p in proptags]
 
     def _pidlid_proptag(self, pidlid):
         id_ = self._pidlid_cache.get(pidlid)
         if id_ is None:
-            id_ = _name_to_proptag(pidlid, self.mapiobj)[0]
+            id_ = _name_to_proptag(pidlid, self.mapiobj, store=self)[0]
             self._pidlid_cache[pidlid] = id_
         return id_
 
@@ -7,19 +7,131 @@ Copyright 2016 - 2019 Kopano and its licensors (see LICENSE file)
 """
 
 import csv
+import time
 
 from io import StringIO
 
 from MAPI import (
-    TBL_ALL_COLUMNS, TABLE_SORT_ASCEND, TABLE_SORT_DESCEND, TBL_BATCH
+    TBL_ALL_COLUMNS, TABLE_SORT_ASCEND, TABLE_SORT_DESCEND, TBL_BATCH,
+    PT_ERROR, PT_SYSTIME,
 )
-from MAPI.Defs import PpropFindProp
+from MAPI.Defs import PpropFindProp, PROP_TYPE
 from MAPI.Struct import MAPIErrorNotFound, SSort, SSortOrderSet
 
+from .compat import benc as _benc
 from .defs import REV_TAG
+from .errors import ArgumentError
 
 from . import property_ as _prop
 
+# adaptive batch size for row iteration: aim for QueryRows calls
+# taking about this long
+ROW_BATCH_TIME = 0.2
+ROW_BATCH_MIN = 10
+ROW_BATCH_MAX = 5000
+
+# binary columns shown as hex, as the respective object attributes
+HEX_COLUMNS = ('entryid', 'sourcekey', 'parent_entryid', 'changekey')
+
+def _sorttags(order, propmap):
+    # TODO MAPI has more than just ascend/descend
+    if not isinstance(order, tuple):
+        order = (order,)
+    sorttags = []
+    for term in order:
+        if isinstance(term, int): # proptag, negative for descending
+            sorttags.append(term)
+        elif term.startswith('-'):
+            sorttags.append(-propmap[term[1:]])
+        else:
+            sorttags.append(propmap[term])
+    return tuple(sorttags)
+
+class _RowColumns(object):
+    # column layout shared by all rows of a query
+    def __init__(self, columns, propmap):
+        self.names = []
+        self.proptags = []
+        self.index = {}
+        self.decoders = []
+        for i, column in enumerate(columns):
+            if isinstance(column, int):
+                proptag = column
+            else:
+                try:
+                    proptag = propmap[column]
+                except KeyError:
+                    raise ArgumentError('unsupported column: %s' % column)
+            self.names.append(column)
+            self.proptags.append(proptag)
+            self.index[column] = self.index[proptag] = i
+            if column in HEX_COLUMNS:
+                self.decoders.append(_benc)
+            elif PROP_TYPE(proptag) == PT_SYSTIME:
+                self.decoders.append(_prop._systime)
+            else:
+                self.decoders.append(None)
+
+    def add(self, proptag):
+        # (hidden) column needed to open the full object
+        if proptag not in self.index:
+            self.index[proptag] = len(self.proptags)
+            self.proptags.append(proptag)
+            self.decoders.append(None)
+        return self.index[proptag]
+
+class Row(object):
+    """Row class
+
+    Lightweight table row, as returned by for example
+    :func:`Folder.rows() <kopano.Folder.rows>`. Column values are
+    available as attributes (for named columns, such as *subject*)
+    or by indexing (by column name or proptag), and are decoded on
+    access. Missing values are *None*.
+
+    Note that table values of string and binary columns are limited
+    to 255 characters/bytes.
+    """
+
+    __slots__ = ('_columns', '_values', '_context')
+
+    def __init__(self, columns, values, context=None):
+        self._columns = columns
+        self._values = values
+        self._context = context
+
+    def __getitem__(self, key):
+        i = self._columns.index[key]
+        value = self._values[i]
+        decoder = self._columns.decoders[i]
+        if value is not None and decoder is not None:
+            value = decoder(value)
+        return value
+
+    def __getattr__(self, name):
+        # also called for (unset) slots and special methods, for example by
+        # copy and pickle on a row that is not yet initialized
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self):
+        for name in self._columns.names:
+            yield self[name]
+
+    def _raw(self, proptag):
+        return self._values[self._columns.index[proptag]]
+
+    def __unicode__(self):
+        return 'Row(%s)' % ', '.join('%s=%r' % (REV_TAG.get(name, name),
+            self[name]) for name in self._columns.names)
+
+    def __repr__(self):
+        return self.__unicode__()
+
 class Table(object):
     """Table class
 
@@ -72,6 +184,40 @@ class Table(object):
         except MAPIErrorNotFound:
             pass
 
+    def _row_objects(self, columns, cls=Row, context=None, batch_size=None,
+            page_start=None, page_limit=None):
+        # yield lightweight rows; without batch size, adapt batch size
+        # so QueryRows calls take about ROW_BATCH_TIME
+        adaptive = batch_size is None
+        if adaptive:
+            batch_size = 100
+        if page_start is not None:
+            self.mapitable.SeekRow(0, page_start)
+        count = 0
+        try:
+            while page_limit is None or count < page_limit:
+                if page_limit is not None:
+                    batch_size = min(batch_size, page_limit - count)
+                t0 = time.time()
+                result = self.mapitable.QueryRows(batch_size, 0)
+                if not result:
+                    break
+
+                for row in result:
+                    yield cls(columns, tuple(None if PROP_TYPE(c.ulPropTag) ==
+                        PT_ERROR else c.Value for c in row), context)
+                count += len(result)
+
+                if adaptive:
+                    t = time.time() - t0
+                    if t < ROW_BATCH_TIME / 2:
+                        batch_size = min(batch_size * 2, ROW_BATCH_MAX)
+                    elif t > ROW_BATCH_TIME * 2:
+                        batch_size = max(batch_size // 2, ROW_BATCH_MIN)
+
+        except MAPIErrorNotFound:
+            pass
+
     @property
     def count(self):
         """Return table row count."""
@@ -1,6 +1,9 @@
+import copy
+
 import pytest
 
 from kopano import Folder, User, ArgumentError, NotFoundError
+from MAPI.Tags import PR_IMPORTANCE, PR_SUBJECT_W, PR_MESSAGE_FLAGS
 
 
 def test_createfolder(inbox, create_folder):
@@ -48,6 +51,59 @@ def test_count(inbox, create_item):
     assert inbox.count == 1
 
 
+def test_rows(inbox, create_item):
+    create_item(inbox, 'b')
+    create_item(inbox, 'a')
+
+    rows = list(inbox.rows(columns=['subject', 'size'], order='subject'))
+    assert [row.subject for row in rows] == ['a', 'b']
+    assert all(row.size > 0 for row in rows)
+    assert rows[0]['subject'] == 'a'
+    assert rows[0].item().subject == 'a'
+    assert copy.copy(rows[0]).subject == 'a'
+
+    rows = list(inbox.rows(columns=['entryid'], batch_size=1, page_limit=1))
+    assert len(rows) == 1
+    assert inbox.item(rows[0].entryid)
+
+
+def test_items_adaptive(inbox, create_item):
+    for i in range(3):
+        create_item(inbox, 'adaptive%d' % i)
+
+    stats = []
+    for item in inbox.items(adaptive=stats.append):
+        assert item.urgency == 'normal'
+    assert stats[0]['items'] == 3
+    assert PR_IMPORTANCE in stats[0]['columns']
+    assert stats[0]['fallbacks'][PR_IMPORTANCE] >= 1
+
+
+def test_items_adaptive_write(inbox, create_item):
+    create_item(inbox, 'before')
+
+    for item in inbox.items(adaptive=True):
+        item.prop(PR_SUBJECT_W).value = 'after'
+        assert item.subject == 'after'
+        item.subject = None
+        assert item.subject == ''
+    assert inbox.get(PR_SUBJECT_W) is None
+    assert list(inbox.items())[0].subject == ''
+
+
+def test_items_adaptive_read(inbox, create_item):
+    for i in range(3):
+        create_item(inbox, 'read%d' % i)
+
+    stats = []
+    for item in inbox.items(adaptive=stats.append):
+        item.read = False
+        assert not item.read
+        item.read = True
+        assert item.read
+    assert PR_MESSAGE_FLAGS in stats[0]['columns']
+
+
 def test_delete(inbox, create_item):
     item = create_item(inbox, 'delete')
     assert inbox.count == 1
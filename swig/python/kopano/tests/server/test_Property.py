@@ -170,3 +170,26 @@ def test_strval(item):
 def test_str(item):
     item.subject = ''
     assert str(item.prop(PR_SUBJECT_W)) == 'Property(PR_SUBJECT_W)'
+
+
+def test_named_cache(item):
+    item.create_prop('common:34070', datetime.now(), proptype=PT_SYSTIME)
+    item.create_prop('appointment:33315', True, proptype=PT_BOOLEAN)
+
+    named = [prop for prop in item.props() if prop.named]
+    strids = [prop.strid for prop in named]
+    assert 'common:34070' in strids
+    assert 'appointment:33315' in strids
+
+    # names are cached per store, in both directions
+    for prop in named:
+        lpname = prop._lpname
+        assert item.store._id_names([prop.proptag]) == [lpname]
+        assert item.store._name_ids([lpname])[0] == prop.proptag & 0xffff0000
+
+
+def test_named_cache_unknown(item):
+    # unknown ids are not cached, as they may be created later on
+    proptag = (0xfff0 << 16) | PT_UNICODE
+    assert item.store._id_names([proptag]) == [None]
+    assert 0xfff0 not in item.store._id_name_cache
@@ -113,6 +113,14 @@ def test_users(server):
     assert list(server.users())
 
 
+def test_user_rows(server, user):
+    rows = list(server.user_rows(columns=['name', 'email'], order='name'))
+    assert user.name in [row.name for row in rows]
+    assert 'SYSTEM' not in [row.name for row in rows]
+    row = [row for row in rows if row.name == user.name][0]
+    assert row.user().name == user.name
+
+
 def test_company(server):
     assert isinstance(server.company('Default'), Company)
 
@@ -160,6 +160,54 @@ def test_specialfolders(server, store):
     # TODO: test deleted root and subtree
 
 
+def test_is_special(store, folder):
+    inbox = Folder(store, store.inbox.entryid, _check_mapiobj=False)
+    assert store.is_special(inbox, 'inbox')
+    assert not store.is_special(inbox, 'junk')
+    assert not store.is_special(None, 'inbox')
+
+    with pytest.raises(ArgumentError):
+        store.is_special(inbox, 'nosuchfolder')
+
+    junk = store.junk
+    store.junk = folder
+    try:
+        assert store.is_special(folder, 'junk')
+        assert store.junk == folder
+    finally:
+        store.junk = junk
+    assert store.is_special(junk, 'junk')
+
+
+def test_hierarchy(store, folder):
+    sourcekey = folder.sourcekey
+    hierarchy = store.hierarchy
+    test = store.folder(entryid=folder.entryid)
+    assert hierarchy.path(test.entryid) == test.path == 'Inbox/test'
+    assert hierarchy.entryid(sourcekey) == test.entryid
+    assert test.sourcekey == sourcekey
+    assert test.subfolder_count == 0
+
+    # changes are picked up on next use
+    sub = test.create_folder('sub')
+    assert test.subfolder_count == 1
+    assert sub.path == 'Inbox/test/sub'
+    assert hierarchy[sub.entryid].depth == hierarchy[test.entryid].depth + 1
+
+    sub.name = 'sub2'
+    assert sub.path == 'Inbox/test/sub2'
+
+    test.delete(sub)
+    assert test.subfolder_count == 0
+    assert sub.entryid not in hierarchy
+
+    sub = test.create_folder('sub')
+    assert test.subfolder_count == 1
+    test.empty()
+    assert test.subfolder_count == 0
+    assert sub.entryid not in hierarchy
+
+
 def test_guid(store):
     assert isinstance(store.guid, str)
     assert len(store.guid) == 32